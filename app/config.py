@@ -22,6 +22,129 @@ UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./images/uploads")
 # Maximum file size for uploads (in bytes)
 MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 100 * 1024 * 1024))  # 100MB default
 
+# Maximum size of a .nii.gz upload after decompression (in bytes)
+MAX_DECOMPRESSED_SIZE = int(os.getenv("MAX_DECOMPRESSED_SIZE", 10 * MAX_UPLOAD_SIZE))
+
+# Memory budget for decoded volumes shared between requests (in bytes)
+VOLUME_CACHE_MAX_BYTES = int(os.getenv("VOLUME_CACHE_MAX_BYTES", 1024 * 1024 * 1024))  # 1GB default
+
+# Memory budget for slices rendered at a given window/level (in bytes)
+RENDERED_SLICE_CACHE_MAX_BYTES = int(os.getenv("RENDERED_SLICE_CACHE_MAX_BYTES", 256 * 1024 * 1024))  # 256MB default
+
+# Memory budget for encoded (PNG/WebP/raw) slices (in bytes)
+ENCODED_SLICE_CACHE_MAX_BYTES = int(os.getenv("ENCODED_SLICE_CACHE_MAX_BYTES", 128 * 1024 * 1024))  # 128MB default
+
+# Threads encoding the slices of one volume in parallel
+SLICE_ENCODE_WORKERS = int(os.getenv("SLICE_ENCODE_WORKERS", os.cpu_count() or 1))
+
+# Default PNG setting for slices returned by upload: speed, balanced or ratio
+PNG_COMPRESSION = os.getenv("PNG_COMPRESSION", "ratio")
+
+# Budget for the arrays of uploaded images each worker keeps memory-mapped (in bytes); least recently used
+# images are unmapped beyond it and mapped again from the image store on their next access
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_BYTES", 2 * 1024 * 1024 * 1024))  # 2GB default
+
+# Seconds an uploaded image is kept without being accessed (0 keeps images until evicted)
+IMAGE_STORE_TTL_SECONDS = float(os.getenv("IMAGE_STORE_TTL_SECONDS", 4 * 60 * 60))
+
+# Directory of the image store shared by all workers: memory-mapped arrays plus the registry.db
+# metadata and session registry. Point it at tmpfs (e.g. /dev/shm/imageanalyzer) to keep images in RAM
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", "./cache/images")
+
+# Seconds a session may stay idle before it expires and its uploaded images are released
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", 30 * 60))
+
+# Secure flag of the session cookie: true/false force it, auto sets it only for requests made over HTTPS
+# (behind a TLS-terminating proxy that needs the proxy's forwarded scheme to be trusted)
+SESSION_COOKIE_SECURE = os.getenv("SESSION_COOKIE_SECURE", "true").lower()
+
+# SameSite of the session cookie. none (always sent with Secure) lets the frontends in CORS_ORIGINS,
+# which run on other sites, send it; lax suits a frontend served from this host only
+SESSION_COOKIE_SAMESITE = os.getenv("SESSION_COOKIE_SAMESITE", "none").lower()
+
+# Seconds between background sweeps of expired sessions and images in each worker
+STORE_SWEEP_INTERVAL = float(os.getenv("STORE_SWEEP_INTERVAL", 60))
+
+# Directory for pre-converted, memory-mappable copies of library volumes
+SIDECAR_CACHE_DIR = os.getenv("SIDECAR_CACHE_DIR", "./cache/sidecars")
+
+# Background threads converting library volumes to sidecars
+SIDECAR_CONVERTER_WORKERS = int(os.getenv("SIDECAR_CONVERTER_WORKERS", 1))
+
+# Queue every library volume without an up-to-date sidecar at startup
+SIDECAR_SCAN_ON_STARTUP = os.getenv("SIDECAR_SCAN_ON_STARTUP", "true").lower() == "true"
+
+# Threads reading and decoding the files of a DICOM series
+DICOM_LOAD_WORKERS = int(os.getenv("DICOM_LOAD_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+
+# Bins of the histogram that automatic window settings are read from
+WINDOW_HISTOGRAM_BINS = int(os.getenv("WINDOW_HISTOGRAM_BINS", 4096))
+
+# Volumes with more voxels than this are sampled when estimating window settings (0 disables sampling)
+WINDOW_SAMPLE_MAX_VOXELS = int(os.getenv("WINDOW_SAMPLE_MAX_VOXELS", 16 * 1024 * 1024))
+
+# Sampling of the preview sent first by progressive loads: every Nth row/column, and every Nth slice
+PREVIEW_IN_PLANE_STRIDE = int(os.getenv("PREVIEW_IN_PLANE_STRIDE", 4))
+PREVIEW_SLICE_STRIDE = int(os.getenv("PREVIEW_SLICE_STRIDE", 2))
+
+# Directory for the downsampled levels of large 2D images
+TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR", "./cache/tiles")
+
+# Edge length of pyramid tiles (in pixels)
+TILE_SIZE = int(os.getenv("TILE_SIZE", 256))
+
+# Largest image, in pixels, accepted when building a pyramid
+PYRAMID_MAX_PIXELS = int(os.getenv("PYRAMID_MAX_PIXELS", 1024 * 1024 * 1024))
+
+# Threads running an operation not listed in EXECUTOR_LIMITS off the event loop;
+# listed operations get a pool of their own concurrency each
+EXECUTOR_THREAD_WORKERS = int(os.getenv("EXECUTOR_THREAD_WORKERS", os.cpu_count() or 1))
+
+# Processes for work that is run in a separate process, such as registration (0 runs it in threads)
+EXECUTOR_PROCESS_WORKERS = int(os.getenv("EXECUTOR_PROCESS_WORKERS", max(1, (os.cpu_count() or 1) // 4)))
+
+# Concurrency and queue depth of each operation, as name=concurrency:queue pairs
+EXECUTOR_LIMITS = os.getenv(
+    "EXECUTOR_LIMITS",
+    "upload=4:16,load=4:32,tiles=4:64,render=8:128,transform=4:16,registration=1:4"
+)
+
+# Seconds a client is asked to wait after a 503 from a saturated operation
+EXECUTOR_RETRY_AFTER = int(os.getenv("EXECUTOR_RETRY_AFTER", 5))
+
+# Registration preset used when a request names none: fast, balanced, accurate or full
+# (full is a single full-resolution level)
+REGISTRATION_PRESET = os.getenv("REGISTRATION_PRESET", "full")
+
+# Deformable registration defaults: B-spline mesh cells per axis, the shrink factor of its finest
+# level (the coarser one is shrunk twice as much) and optimizer iterations per level
+REGISTRATION_BSPLINE_GRID_SIZE = int(os.getenv("REGISTRATION_BSPLINE_GRID_SIZE", 4))
+REGISTRATION_BSPLINE_MAX_GRID_SIZE = int(os.getenv("REGISTRATION_BSPLINE_MAX_GRID_SIZE", 16))
+REGISTRATION_BSPLINE_SHRINK = int(os.getenv("REGISTRATION_BSPLINE_SHRINK", 4))
+REGISTRATION_BSPLINE_ITERATIONS = int(os.getenv("REGISTRATION_BSPLINE_ITERATIONS", 30))
+
+# Directory for cached registration transforms, and how many are kept
+TRANSFORM_CACHE_DIR = os.getenv("TRANSFORM_CACHE_DIR", "./cache/transforms")
+TRANSFORM_CACHE_MAX_ENTRIES = int(os.getenv("TRANSFORM_CACHE_MAX_ENTRIES", 1000))
+
+# Registrations of one batch run at once (each gets an equal share of the CPUs), and the batch size limit
+REGISTRATION_BATCH_CONCURRENCY = int(os.getenv("REGISTRATION_BATCH_CONCURRENCY", max(1, (os.cpu_count() or 1) // 2)))
+REGISTRATION_BATCH_MAX_IMAGES = int(os.getenv("REGISTRATION_BATCH_MAX_IMAGES", 64))
+
+# Directory for the registration job registry and job results
+REGISTRATION_JOB_DIR = os.getenv("REGISTRATION_JOB_DIR", "./cache/registration")
+
+# Registration jobs run at once per worker, and how many more may wait before submissions get a 503
+REGISTRATION_JOB_WORKERS = int(os.getenv("REGISTRATION_JOB_WORKERS", 2))
+REGISTRATION_JOB_QUEUE = int(os.getenv("REGISTRATION_JOB_QUEUE", 8))
+
+# Seconds finished registration jobs and their results are kept
+REGISTRATION_JOB_TTL_SECONDS = float(os.getenv("REGISTRATION_JOB_TTL_SECONDS", 60 * 60))
+
+# Seconds a running registration job may go without reporting progress before it is marked failed,
+# e.g. because the worker running it was restarted
+REGISTRATION_JOB_STALE_SECONDS = float(os.getenv("REGISTRATION_JOB_STALE_SECONDS", 15 * 60))
+
 # Supported file extensions
 SUPPORTED_EXTENSIONS = {
     '.nii',     # NIfTI format
@@ -36,6 +159,12 @@ SUPPORTED_EXTENSIONS = {
 # Database
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
 
+# Seconds before a directory in the metadata index is rescanned on listing
+INDEX_REFRESH_SECONDS = float(os.getenv("INDEX_REFRESH_SECONDS", 60))
+
+# Index the whole images directory in the background at startup
+INDEX_SCAN_ON_STARTUP = os.getenv("INDEX_SCAN_ON_STARTUP", "true").lower() == "true"
+
 # CORS
 CORS_ORIGINS = [
     "https://viewer.rad-space.com",
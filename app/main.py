@@ -6,17 +6,29 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-from fastapi import FastAPI, Request, UploadFile, File
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from app.routes import session, upload, image, directory, image_registration
+from app.utils.file_handling import read_nifti_data
+from app.utils.caching import cache_stats, content_cache_key, load_cached_volume
+from app.utils.sidecar_cache import sidecar_converter
+from app.utils.metadata_index import get_metadata_index
+from app.config import IMAGES_DIR, INDEX_SCAN_ON_STARTUP, SIDECAR_SCAN_ON_STARTUP, STORE_SWEEP_INTERVAL
+from app.utils.upload_streaming import UPLOAD_OPENAPI_EXTRA, receive_upload
+from app.utils.transport import BINARY_HEADERS, binary_volume_response, validate_response_format
+from app.utils.executor import run_blocking, worker_pools
+from app.utils.image_store import reap_expired
+from app.utils.registration_jobs import registration_jobs
+from app.utils.transform_cache import transform_cache
 import nibabel as nib
 import pydicom
 import numpy as np
 from pathlib import Path
 import os
+import threading
 from PIL import Image
 import io
 import base64
@@ -43,6 +55,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=BINARY_HEADERS,
     max_age=3600,  # Cache preflight requests
 )
 
@@ -76,7 +89,7 @@ def process_medical_image(file_path):
         elif ext in ['.nii', '.gz']:
             # Handle NIfTI
             img = nib.load(str(file_path))
-            img_array = img.get_fdata().astype(np.float32)
+            img_array = read_nifti_data(img)
             
             # Extract voxel dimensions from NIfTI header
             voxel_dims = img.header.get_zooms()
@@ -111,52 +124,68 @@ def process_medical_image(file_path):
         logging.error(f"Error processing medical image: {str(e)}")
         return None, None
 
+def volume_json_payload(img_array, metadata):
+    """Build the JSON body of an upload response with each slice base64-encoded."""
+    # For 3D volumes, encode each slice
+    if len(img_array.shape) > 2:
+        encoded_slices = []
+        for i in range(img_array.shape[2]):
+            slice_data = img_array[:, :, i].tobytes()
+            encoded_slice = base64.b64encode(slice_data).decode('utf-8')
+            encoded_slices.append(encoded_slice)
+        response_data = encoded_slices
+    else:
+        # For 2D images, encode the single image
+        encoded_data = base64.b64encode(img_array.tobytes()).decode('utf-8')
+        response_data = [encoded_data]
+
+    return {
+        "success": True,
+        "data": response_data,
+        "metadata": metadata,
+        "dtype": str(img_array.dtype),
+        "debug": {
+            "shape": img_array.shape,
+            "min": float(np.min(img_array)),
+            "max": float(np.max(img_array)),
+            "sample": [float(x) for x in img_array.flatten()[:10]]
+        }
+    }
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
-@app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+@app.post("/upload", openapi_extra=UPLOAD_OPENAPI_EXTRA)
+async def upload_file(request: Request, format: str = "json"):
     try:
-        contents = await file.read()
-        file_path = UPLOAD_DIR / file.filename
+        validate_response_format(format)
 
-        # Save the uploaded file
-        with open(file_path, "wb") as f:
-            f.write(contents)
+        # Stream the uploaded file to a unique temporary file in the upload directory
+        upload = await receive_upload(request, destination_dir=UPLOAD_DIR)
+        file_path = Path(upload.path)
 
-        # Process the medical image and get data + metadata
-        img_array, metadata = process_medical_image(file_path)
+        # Process the medical image and get data + metadata, reusing the
+        # decoded volume when the same content was uploaded before
+        try:
+            img_array, metadata = await run_blocking(
+                "upload",
+                load_cached_volume,
+                content_cache_key("upload", upload.sha256, file_path.suffix.lower()),
+                lambda: process_medical_image(file_path)
+            )
+        finally:
+            upload.discard()
 
         if img_array is not None and metadata is not None:
             # Ensure the array is in float32 format
-            img_array = img_array.astype(np.float32)
-
-            # For 3D volumes, encode each slice
-            if len(img_array.shape) > 2:
-                encoded_slices = []
-                for i in range(img_array.shape[2]):
-                    slice_data = img_array[:, :, i].tobytes()
-                    encoded_slice = base64.b64encode(slice_data).decode('utf-8')
-                    encoded_slices.append(encoded_slice)
-                response_data = encoded_slices
-            else:
-                # For 2D images, encode the single image
-                encoded_data = base64.b64encode(img_array.tobytes()).decode('utf-8')
-                response_data = [encoded_data]
+            img_array = img_array.astype(np.float32, copy=False)
 
-            return JSONResponse({
-                "success": True,
-                "data": response_data,
-                "metadata": metadata,
-                "dtype": str(img_array.dtype),
-                "debug": {
-                    "shape": img_array.shape,
-                    "min": float(np.min(img_array)),
-                    "max": float(np.max(img_array)),
-                    "sample": [float(x) for x in img_array.flatten()[:10]]
-                }
-            }, headers={
+            if format == "binary":
+                return binary_volume_response(img_array, metadata)
+
+            payload = await run_blocking("upload", volume_json_payload, img_array, metadata)
+            return JSONResponse(payload, headers={
                 'Cache-Control': 'no-cache',
                 'Connection': 'keep-alive'
             })
@@ -166,6 +195,8 @@ async def upload_file(file: UploadFile = File(...)):
                 "message": "Failed to process image"
             }, status_code=500)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Upload error: {str(e)}")
         return JSONResponse({
@@ -173,6 +204,78 @@ async def upload_file(file: UploadFile = File(...)):
             "message": str(e)
         }, status_code=500)
 
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Report size and hit/miss/eviction counters of the in-process caches."""
+    return {
+        "success": True,
+        "caches": cache_stats(),
+        "sidecars": sidecar_converter.stats(),
+        "images": image.image_storage.stats(),
+        "sessions": session.SESSION_STORE.stats(),
+        "transforms": transform_cache.stats()
+    }
+
+@app.get("/api/executor/stats")
+async def get_executor_stats():
+    """Report worker pool sizes and per-operation running, queued and rejected counts."""
+    return {
+        "success": True,
+        "executor": worker_pools.stats(),
+        "registration_jobs": registration_jobs.stats()
+    }
+
+@app.on_event("shutdown")
+async def stop_worker_pools():
+    worker_pools.shutdown()
+    registration_jobs.shutdown()
+
+@app.on_event("startup")
+async def start_sidecar_converter():
+    """Convert library volumes to memory-mappable sidecars in the background."""
+    if SIDECAR_SCAN_ON_STARTUP:
+        threading.Thread(
+            target=sidecar_converter.scan,
+            args=(IMAGES_DIR,),
+            name="sidecar-scan",
+            daemon=True
+        ).start()
+
+@app.on_event("startup")
+async def start_metadata_indexing():
+    """Bring the directory metadata index up to date in the background."""
+    if INDEX_SCAN_ON_STARTUP:
+        threading.Thread(
+            target=lambda: get_metadata_index(IMAGES_DIR).refresh(),
+            name="metadata-index-scan",
+            daemon=True
+        ).start()
+
+@app.on_event("startup")
+async def start_store_sweeper():
+    """Release expired sessions and images in the background, not only when they are next requested."""
+    threading.Thread(
+        target=reap_expired,
+        args=(image.image_storage, session.SESSION_STORE, STORE_SWEEP_INTERVAL),
+        name="image-store-sweeper",
+        daemon=True
+    ).start()
+
+@app.middleware("http")
+async def touch_session(request: Request, call_next):
+    """
+    Keep the caller's session alive while it is making requests.
+
+    A session is written back at most every few seconds, and then in a
+    worker thread; a touch skipped because the pool is busy is retried
+    with the next request.
+    """
+    try:
+        await session.request_session(request)
+    except HTTPException:
+        pass
+    return await call_next(request)
+
 # Include routers with explicit prefixes
 app.include_router(session.router, prefix="/api")
 app.include_router(upload.router, prefix="/api")
@@ -1,20 +1,43 @@
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+import io
 import os
 import logging
-from app.utils.file_handling import process_file
+from app.utils.file_handling import process_file, read_nifti_data, LazyNiftiVolume
 import nibabel as nib
 import pydicom
 import numpy as np
 from PIL import Image
-from app.utils.image_processing import calculate_optimal_window_settings, precompute_normalized_slices
+from app.utils.caching import file_cache_key, load_cached_volume
+from app.utils.metadata_index import get_metadata_index
+from app.utils.dicom_series import describe_series, load_dicom_series, scan_series
+from app.utils.sidecar_cache import is_convertible, load_sidecar, open_sidecar, sidecar_converter
+from app.utils.tile_pyramid import get_pyramid
+from app.utils.executor import run_blocking
+from app.utils.transport import (
+    binary_slices_response, binary_volume_response, progressive_volume_response, validate_response_format
+)
+from app.config import PREVIEW_IN_PLANE_STRIDE, PREVIEW_SLICE_STRIDE
 import base64
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 @router.get("/directory")
-async def list_directory(path: str = "images"):
-    """List the contents of a given directory."""
+async def list_directory(path: str = "images", page: int = 1, page_size: int = None,
+                         recursive: bool = False, search: str = None, modality: str = None,
+                         dtype: str = None, file_format: str = None, ndim: int = None,
+                         min_size: int = None, max_size: int = None, refresh: bool = False):
+    """
+    List the contents of a given directory from the persistent metadata index.
+
+    Each file comes with its shape, dtype, voxel dimensions, modality and
+    byte size in "entries". Directories not scanned within
+    INDEX_REFRESH_SECONDS are rescanned incrementally first (refresh=true
+    forces a rescan). recursive=true includes files in subdirectories, and
+    search, modality, dtype, file_format, ndim, min_size and max_size filter
+    the files. page/page_size select one page of the sorted result.
+    """
     try:
         logger.info(f"Listing directory: {path}")
 
@@ -26,7 +49,7 @@ async def list_directory(path: str = "images"):
         # Get absolute paths - go up one level from app directory to find project root
         base_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
         target_path = os.path.join(base_path, path)
-        logger.info(f"Resolved path: {target_path}")
+        logger.debug(f"Resolved path: {target_path}")
 
         # Create images directory if it doesn't exist
         images_dir = os.path.join(base_path, 'images')
@@ -34,38 +57,55 @@ async def list_directory(path: str = "images"):
             os.makedirs(images_dir)
             logger.info(f"Created images directory at: {images_dir}")
 
-        # If requested path doesn't exist or isn't a directory, default to images directory
-        if not os.path.exists(target_path) or not os.path.isdir(target_path):
-            target_path = images_dir
-            logger.info(f"Using default images directory: {target_path}")
+        # If requested path doesn't exist, isn't a directory or leaves the images directory, default to images directory
+        relative_dir = os.path.relpath(os.path.realpath(target_path), os.path.realpath(images_dir))
+        if not os.path.isdir(target_path) or relative_dir.startswith('..'):
+            relative_dir = '.'
+            logger.info(f"Using default images directory: {images_dir}")
+        relative_dir = '' if relative_dir == '.' else relative_dir.replace(os.sep, '/')
 
-        # List directory contents
-        files = []
-        directories = []
+        if page < 1 or (page_size is not None and page_size < 1):
+            raise HTTPException(status_code=400, detail="page and page_size must be positive")
 
         try:
-            for item in sorted(os.listdir(target_path)):
-                item_path = os.path.join(target_path, item)
-
-                # Skip hidden files and directories
-                if item.startswith('.'):
-                    continue
-
-                if os.path.isdir(item_path):
-                    directories.append(item)
-                    logger.info(f"Added directory: {item}")
-                else:
-                    # Only include supported image formats
-                    if any(item.lower().endswith(ext) for ext in ['.nii', '.nii.gz', '.dcm', '.jpg', '.jpeg', '.png', '.bmp']):
-                        files.append(item)
-                        logger.info(f"Added file: {item}")
+            index = get_metadata_index(images_dir)
+            # Scanning walks the tree and reads file headers, so it stays off the event loop
+            if refresh:
+                await run_blocking("load", index.refresh, relative_dir, recursive=recursive)
+            else:
+                await run_blocking("load", index.refresh_if_stale, relative_dir, recursive=recursive)
+
+            offset = (page - 1) * page_size if page_size else 0
+            total, entries = index.query(
+                relative_dir,
+                recursive=recursive,
+                search=search,
+                modality=modality,
+                dtype=dtype,
+                fmt=file_format,
+                ndim=ndim,
+                min_size=min_size,
+                max_size=max_size,
+                offset=offset,
+                limit=page_size
+            )
+
+            # File names relative to the listed directory, as the viewer expects
+            prefix = f"{relative_dir}/" if relative_dir else ""
+            files = [entry["path"][len(prefix):] for entry in entries]
 
             return {
                 "success": True,
                 "files": files,
-                "directories": directories
+                "directories": index.subdirectories(relative_dir),
+                "entries": entries,
+                "total": total,
+                "page": page,
+                "page_size": page_size
             }
 
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error listing directory contents: {str(e)}", exc_info=True)
             raise HTTPException(
@@ -73,6 +113,8 @@ async def list_directory(path: str = "images"):
                 detail=f"Error listing directory contents: {str(e)}"
             )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in list_directory: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -80,134 +122,453 @@ async def list_directory(path: str = "images"):
             detail=f"Error in list_directory: {str(e)}"
         )
 
-@router.get("/load")
-async def load_remote_file(path: str):
-    """Load a file from the server."""
+def _images_path(path):
+    """Map a client path onto the images directory; 403 for paths that resolve outside it."""
+    # Clean and normalize path
+    path = path.replace('\\', '/')
+    if not path.startswith('images/'):
+        path = f'images/{path}'
+
+    # Get absolute paths - go up one level from app directory to find project root
+    base_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    file_path = os.path.join(base_path, path)
+    logger.info(f"Full path resolved to: {file_path}")
+
+    # Reject .. components and symlinks leading out of the images directory
+    relative = os.path.relpath(os.path.realpath(file_path), os.path.realpath(os.path.join(base_path, 'images')))
+    if relative == '..' or relative.startswith('..' + os.sep):
+        raise HTTPException(status_code=403, detail="Path is outside the images directory")
+    return path, file_path
+
+def _resolve_series_path(path):
+    """Resolve a directory holding a DICOM series."""
+    path, dir_path = _images_path(path)
+    if not os.path.isdir(dir_path):
+        raise HTTPException(status_code=404, detail=f"Directory not found: {path}")
+    return dir_path
+
+def _resolve_file_path(path):
+    """Resolve a path relative to the images directory and validate it."""
+    path, file_path = _images_path(path)
+
+    # Verify file exists and is a file
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail=f"File not found: {path}")
+
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=400, detail="Path is not a file")
+
+    # Process file based on extension
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext == '.gz' and file_path.lower().endswith('.nii.gz'):
+        file_ext = '.nii.gz'
+
+    supported_extensions = {'.nii', '.nii.gz', '.dcm', '.jpg', '.jpeg', '.png', '.bmp'}
+    if not any(file_path.lower().endswith(ext) for ext in supported_extensions):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file type. Supported extensions: {', '.join(supported_extensions)}"
+        )
+
+    return file_path, file_ext
+
+def _open_volume_lazily(file_path):
+    """Prefer the memory-mapped sidecar, falling back to reading the NIfTI file itself."""
+    volume = open_sidecar(file_path)
+    if volume is None:
+        volume = LazyNiftiVolume(file_path)
+        sidecar_converter.schedule(file_path)
+    return volume
+
+def _open_lazy_nifti(path):
+    """Open a NIfTI file from the images directory without reading voxel data."""
+    file_path, file_ext = _resolve_file_path(path)
+    if file_ext not in ['.nii', '.nii.gz']:
+        raise HTTPException(status_code=400, detail="Lazy access is only supported for NIfTI files")
     try:
-        logger.info(f"Loading file: {path}")
+        return _open_volume_lazily(file_path)
+    except Exception as e:
+        msg = f"Error opening NIfTI file: {str(e)}"
+        logger.error(msg, exc_info=True)
+        raise HTTPException(status_code=500, detail=msg)
+
+def _load_lazy_nifti(file_path, format):
+    """Serve a whole NIfTI volume one slice at a time, straight from disk."""
+    volume = _open_volume_lazily(file_path)
+    metadata = volume.metadata()
+
+    if format == "binary":
+        shape = (volume.total_slices, volume.dimensions[0], volume.dimensions[1])
+        return binary_slices_response(volume.iter_slices(), shape, metadata)
+
+    encoded_slices = [
+        base64.b64encode(slice_data.tobytes()).decode('utf-8')
+        for slice_data in volume.iter_slices()
+    ]
+    return {
+        "success": True,
+        "data": encoded_slices,
+        "metadata": metadata
+    }
+
+def _read_image_file(file_path, file_ext):
+    """Decode an image file into a float32 array and its metadata."""
+    data = None
+    dimensions = None
+
+    # Process different file types
+    if file_ext in ['.nii', '.nii.gz']:
+        logger.info("Processing NIfTI file")
+        img = nib.load(file_path)
+        # Get header information
+        header = img.header
+        data_type = header.get_data_dtype()
+        logger.info(f"NIfTI header data type: {data_type}")
+
+        # Get voxel dimensions from header
+        voxel_dims = img.header.get_zooms()
+        voxel_width = float(voxel_dims[0])
+        voxel_height = float(voxel_dims[1])
+        voxel_depth = float(voxel_dims[2]) if len(voxel_dims) > 2 else 1.0
+
+        # Read straight to float32 (first time point for 4D data)
+        data = read_nifti_data(img)
+        logger.info(f"Image array shape: {data.shape}")
+        logger.info(f"Sample values: {data.flat[:10]}")
+
+        dimensions = data.shape[:2]
+        img.uncache()
+
+    elif file_ext == '.dcm':
+        logger.info("Processing DICOM file")
+        dcm = pydicom.dcmread(file_path)
+        data = dcm.pixel_array
+        if hasattr(dcm, 'PixelSpacing'):
+            voxel_width = float(dcm.PixelSpacing[0])
+            voxel_height = float(dcm.PixelSpacing[1])
+        else:
+            voxel_width = voxel_height = 1.0
+        voxel_depth = float(dcm.SliceThickness) if hasattr(dcm, 'SliceThickness') else 1.0
+        data = data.astype(np.float32)
+        dimensions = data.shape[:2]
+
+    else:  # Standard image formats
+        logger.info("Processing standard image file")
+        with Image.open(file_path) as img:
+            if img.mode in ['RGB', 'RGBA']:
+                img = img.convert('L')
+            data = np.array(img, dtype=np.float32)
+            dimensions = data.shape[:2]
+            # Standard images use default 1.0 mm voxel dimensions
+            voxel_width = voxel_height = voxel_depth = 1.0
+
+    if data is None:
+        raise HTTPException(status_code=400, detail="Failed to load image data")
+
+    # Calculate value range
+    min_val = float(np.min(data))
+    max_val = float(np.max(data))
+    logger.info(f"Data range: min={min_val}, max={max_val}")
+
+    metadata = {
+        "dimensions": dimensions,
+        "min_value": min_val,
+        "max_value": max_val,
+        "voxel_dimensions": [voxel_width, voxel_height, voxel_depth]
+    }
+
+    return data, metadata
+
+def _load_volume(file_path, file_ext):
+    """Load a volume from its sidecar if one is up to date, else decode the file and queue a sidecar."""
+    if is_convertible(file_path):
+        data, metadata = load_sidecar(file_path)
+        if data is not None:
+            logger.info(f"Serving {file_path} from its sidecar")
+            return data, metadata
+        sidecar_converter.schedule(file_path)
+    return _read_image_file(file_path, file_ext)
+
+def _series_volume(dir_path, series_uid):
+    """Assemble a DICOM series stored as a directory of slices, through the volume cache."""
+    try:
+        return load_cached_volume(
+            file_cache_key(dir_path) + ("series", series_uid),
+            lambda: load_dicom_series(dir_path, series_uid)
+        )
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _load_series(dir_path, series_uid, format):
+    """Assemble and return a DICOM series stored as a directory of slices."""
+    data, metadata = _series_volume(dir_path, series_uid)
+
+    if format == "binary":
+        return binary_volume_response(data, metadata)
+
+    slices = [data] if data.ndim == 2 else [data[:, :, i] for i in range(data.shape[2])]
+    return {
+        "success": True,
+        "data": [base64.b64encode(slice_data.tobytes()).decode('utf-8') for slice_data in slices],
+        "metadata": metadata
+    }
+
+@router.get("/load/series")
+async def list_series(path: str):
+    """List the DICOM series in a directory, reading file headers only."""
+    dir_path = _resolve_series_path(path)
+    return {
+        "success": True,
+        "series": describe_series(await run_blocking("load", scan_series, dir_path))
+    }
+
+@router.get("/load/metadata")
+async def load_metadata(path: str):
+    """Return shape, dtype and voxel dimensions of a NIfTI file from its header only."""
+    volume = _open_lazy_nifti(path)
+    return {
+        "success": True,
+        "metadata": volume.metadata()
+    }
+
+@router.get("/load/slice")
+async def load_slice(path: str, index: int, format: str = "json"):
+    """Read a single slice of a NIfTI file, touching only that slice's bytes on disk."""
+    validate_response_format(format)
+    volume = _open_lazy_nifti(path)
 
-        # Clean and normalize path
-        path = path.replace('\\', '/')
-        if not path.startswith('images/'):
-            path = f'images/{path}'
+    try:
+        slice_data = await run_blocking("load", volume.get_slice, index)
+    except IndexError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    metadata = volume.metadata()
+    metadata["slice_index"] = index
+    if format == "binary":
+        return binary_volume_response(slice_data, metadata)
+
+    return {
+        "success": True,
+        "data": [base64.b64encode(slice_data.tobytes()).decode('utf-8')],
+        "metadata": metadata
+    }
+
+def _preview_metadata(metadata, preview):
+    """Metadata of a strided preview: its own dimensions, and voxels scaled by the strides."""
+    voxel_dimensions = metadata.get("voxel_dimensions") or [1.0, 1.0, 1.0]
+    return {
+        "dimensions": [int(preview.shape[0]), int(preview.shape[1])],
+        "total_slices": int(preview.shape[2]) if preview.ndim == 3 else 1,
+        "strides": [PREVIEW_IN_PLANE_STRIDE, PREVIEW_IN_PLANE_STRIDE, PREVIEW_SLICE_STRIDE],
+        "voxel_dimensions": [
+            voxel_dimensions[0] * PREVIEW_IN_PLANE_STRIDE,
+            voxel_dimensions[1] * PREVIEW_IN_PLANE_STRIDE,
+            voxel_dimensions[2] * PREVIEW_SLICE_STRIDE
+        ]
+    }
+
+def _progressive_response(data, metadata):
+    """Progressive response for a volume already held in memory."""
+    if data.ndim == 2:
+        preview = data[::PREVIEW_IN_PLANE_STRIDE, ::PREVIEW_IN_PLANE_STRIDE]
+        slices = [data]
+    else:
+        preview = data[::PREVIEW_IN_PLANE_STRIDE, ::PREVIEW_IN_PLANE_STRIDE, ::PREVIEW_SLICE_STRIDE]
+        slices = (data[:, :, i] for i in range(data.shape[2]))
+    shape = (data.shape[2] if data.ndim == 3 else 1, data.shape[0], data.shape[1])
+    return progressive_volume_response(preview, _preview_metadata(metadata, preview), slices, shape, metadata)
+
+def _load_progressive(path, file_path, file_ext, series_uid):
+    """
+    Stream a strided preview of a volume, then its full-resolution slices.
+
+    NIfTI volumes are read through their sidecar or the lazy reader, so the
+    preview only touches the sampled voxels and the full-resolution slices
+    are read one at a time while they are sent. A gzipped file without a
+    sidecar is decoded once through the volume cache instead: sampling its
+    preview already decompresses the whole file.
+    """
+    if file_path is None:
+        data, metadata = _series_volume(_resolve_series_path(path), series_uid)
+        return _progressive_response(data, metadata)
+
+    volume = _open_volume_lazily(file_path) if file_ext in ['.nii', '.nii.gz'] else None
+    if volume is not None and not (isinstance(volume, LazyNiftiVolume) and volume.compressed):
+        metadata = volume.metadata()
+        preview = volume.get_preview(PREVIEW_IN_PLANE_STRIDE, PREVIEW_SLICE_STRIDE)
+        shape = (volume.total_slices, volume.dimensions[0], volume.dimensions[1])
+        return progressive_volume_response(
+            preview, _preview_metadata(metadata, preview), volume.iter_slices(), shape, metadata
+        )
 
-        # Get absolute paths - go up one level from app directory to find project root
-        base_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        file_path = os.path.join(base_path, path)
-        logger.info(f"Full path resolved to: {file_path}")
+    data, metadata = load_cached_volume(
+        file_cache_key(file_path),
+        lambda: _load_volume(file_path, file_ext)
+    )
+    return _progressive_response(data, metadata)
 
-        # Verify file exists and is a file
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail=f"File not found: {path}")
+# Formats a pyramid can be built from
+TILE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
 
-        if not os.path.isfile(file_path):
-            raise HTTPException(status_code=400, detail="Path is not a file")
+# Encodings a tile can be returned in
+TILE_FORMATS = ("png", "binary")
 
-        # Process file based on extension
-        file_ext = os.path.splitext(file_path)[1].lower()
-        if file_ext == '.gz' and file_path.lower().endswith('.nii.gz'):
-            file_ext = '.nii.gz'
+async def _open_pyramid(path):
+    """Open the tile pyramid of a standard image, building it on first use."""
+    file_path, file_ext = _resolve_file_path(path)
+    if file_ext not in TILE_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tiles are only supported for {', '.join(TILE_EXTENSIONS)} images"
+        )
+    try:
+        return await run_blocking("tiles", get_pyramid, file_path)
+    except HTTPException:
+        raise
+    except Image.DecompressionBombError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        msg = f"Error building tile pyramid: {str(e)}"
+        logger.error(msg, exc_info=True)
+        raise HTTPException(status_code=500, detail=msg)
+
+@router.get("/tiles/info")
+async def tile_info(path: str):
+    """
+    Describe the tile pyramid of a large 2D image.
+
+    Level 0 is full resolution and each further level halves both sides.
+    The pyramid is built and stored on disk by the first request for it.
+    """
+    pyramid = await _open_pyramid(path)
+    return {
+        "success": True,
+        "pyramid": pyramid.info()
+    }
+
+@router.get("/tiles/{level}/{x}/{y}")
+async def load_tile(path: str, level: int, x: int, y: int, format: str = "png"):
+    """
+    Return one tile of a pyramid level, with x and y counted in tiles from the top-left.
+
+    format=png returns an 8-bit PNG scaled over the whole image's value
+    range; format=binary streams the tile's float32 values like /load does.
+    Tiles on the right and bottom edges may be smaller than tile_size.
+    """
+    if format not in TILE_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported format '{format}'. Supported formats: {', '.join(TILE_FORMATS)}"
+        )
+    pyramid = await _open_pyramid(path)
+    try:
+        tile = pyramid.read_tile(level, x, y)
+    except IndexError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "binary":
+        metadata = pyramid.info()
+        metadata.pop("levels")
+        metadata.update({"level": level, "x": x, "y": y, "dimensions": list(tile.shape)})
+        return binary_volume_response(tile, metadata)
+
+    def encode_png():
+        buffer = io.BytesIO()
+        Image.fromarray(pyramid.tile_to_uint8(tile)).save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    return Response(content=await run_blocking("tiles", encode_png), media_type="image/png")
+
+def load_image_volume(path, series_uid=None):
+    """
+    Return (data, metadata) of a file or DICOM series directory under the
+    images directory, through the volume cache, for use by other routes.
+    """
+    if os.path.isdir(_images_path(path)[1]):
+        return _series_volume(_resolve_series_path(path), series_uid)
+    file_path, file_ext = _resolve_file_path(path)
+    return load_cached_volume(
+        file_cache_key(file_path),
+        lambda: _load_volume(file_path, file_ext)
+    )
+
+def _load_file(file_path, file_ext, format):
+    """Load a single image file through the volume cache and build its response."""
+    data, metadata = load_cached_volume(
+        file_cache_key(file_path),
+        lambda: _load_volume(file_path, file_ext)
+    )
+    dimensions = metadata["dimensions"]
+
+    if format == "binary":
+        logger.info(f"Streaming binary image data. Shape: {data.shape}")
+        return binary_volume_response(data, metadata)
+
+    # Prepare slices if 3D, otherwise wrap 2D image in a list
+    if len(data.shape) == 3:
+        slices = [data[:, :, i] for i in range(data.shape[2])]
+    else:
+        slices = [data]
+
+    # Convert to base64
+    encoded_slices = []
+    for slice_data in slices:
+        # Store raw float32 data
+        slice_bytes = slice_data.astype(np.float32).tobytes()
+        encoded = base64.b64encode(slice_bytes).decode('utf-8')
+        encoded_slices.append(encoded)
+
+    logger.info(f"Successfully processed image. Dimensions: {dimensions}, Slices: {len(encoded_slices)}")
+    return {
+        "success": True,
+        "data": encoded_slices,
+        "metadata": metadata
+    }
 
-        supported_extensions = {'.nii', '.nii.gz', '.dcm', '.jpg', '.jpeg', '.png', '.bmp'}
-        if not any(file_path.lower().endswith(ext) for ext in supported_extensions):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Unsupported file type. Supported extensions: {', '.join(supported_extensions)}"
-            )
+@router.get("/load")
+async def load_remote_file(path: str, format: str = "json", lazy: bool = False,
+                           series_uid: str = None, progressive: bool = False):
+    """
+    Load a file from the server.
+
+    With format=json the slices are returned as base64 strings inside a JSON
+    document. With format=binary the raw float32 slices are streamed as
+    application/octet-stream and the metadata is sent in response headers.
+    With lazy=true NIfTI slices are read from disk one at a time while the
+    response is sent; the value range is then only reported if the header
+    carries cal_min/cal_max.
+
+    A directory path is loaded as a DICOM series: the series given by
+    series_uid, or else the one with the most slices.
+
+    With progressive=true (format=binary only) the response is a framed
+    stream: a preview sampled every PREVIEW_IN_PLANE_STRIDE rows/columns
+    and every PREVIEW_SLICE_STRIDE slices comes first, followed by the
+    full-resolution slices. See progressive_volume_response for the layout.
+    """
+    try:
+        logger.info(f"Loading file: {path}")
+        validate_response_format(format)
+        if progressive and format != "binary":
+            raise HTTPException(status_code=400, detail="Progressive loading requires format=binary")
 
-        try:
-            data = None
-            dimensions = None
-
-            # Process different file types
-            if file_ext in ['.nii', '.nii.gz']:
-                logger.info("Processing NIfTI file")
-                img = nib.load(file_path)
-                # Get header information
-                header = img.header
-                data_type = header.get_data_dtype()
-                logger.info(f"NIfTI header data type: {data_type}")
-
-                # Get voxel dimensions from header
-                voxel_dims = img.header.get_zooms()
-                voxel_width = float(voxel_dims[0])
-                voxel_height = float(voxel_dims[1])
-                voxel_depth = float(voxel_dims[2]) if len(voxel_dims) > 2 else 1.0
-
-                # Load data without specifying dtype
-                data = img.get_fdata()
-                logger.info(f"Data shape: {data.shape}")
-
-                # Sample some values for debugging
-                sample_values = data.flatten()[:10]
-                logger.info(f"Sample values: {sample_values}")
-
-                # Convert to float32
-                data = np.array(data, dtype=np.float32)
-                logger.info(f"Image array shape: {data.shape}")
-                logger.info(f"Min value: {np.min(data)}, Max value: {np.max(data)}")
-
-                dimensions = data.shape[:2]
-                if len(data.shape) > 3:
-                    data = data[..., 0]  # Take first time point for 4D data
-                img.uncache()
-
-            elif file_ext == '.dcm':
-                logger.info("Processing DICOM file")
-                dcm = pydicom.dcmread(file_path)
-                data = dcm.pixel_array
-                if hasattr(dcm, 'PixelSpacing'):
-                    voxel_width = float(dcm.PixelSpacing[0])
-                    voxel_height = float(dcm.PixelSpacing[1])
-                else:
-                    voxel_width = voxel_height = 1.0
-                voxel_depth = float(dcm.SliceThickness) if hasattr(dcm, 'SliceThickness') else 1.0
-                data = data.astype(np.float32)
-                dimensions = data.shape[:2]
-
-            else:  # Standard image formats
-                logger.info("Processing standard image file")
-                with Image.open(file_path) as img:
-                    if img.mode in ['RGB', 'RGBA']:
-                        img = img.convert('L')
-                    data = np.array(img, dtype=np.float32)
-                    dimensions = data.shape[:2]
-                    # Standard images use default 1.0 mm voxel dimensions
-                    voxel_width = voxel_height = voxel_depth = 1.0
-
-            if data is None:
-                raise HTTPException(status_code=400, detail="Failed to load image data")
-
-            # Calculate value range
-            min_val = float(np.min(data))
-            max_val = float(np.max(data))
-            logger.info(f"Data range: min={min_val}, max={max_val}")
-
-            # Prepare slices if 3D, otherwise wrap 2D image in a list
-            if len(data.shape) == 3:
-                slices = [data[:, :, i] for i in range(data.shape[2])]
-            else:
-                slices = [data]
+        if os.path.isdir(_images_path(path)[1]):
+            if progressive:
+                return await run_blocking("load", _load_progressive, path, None, None, series_uid)
+            return await run_blocking("load", _load_series, _resolve_series_path(path), series_uid, format)
 
-            # Convert to base64
-            encoded_slices = []
-            for slice_data in slices:
-                # Store raw float32 data
-                slice_bytes = slice_data.astype(np.float32).tobytes()
-                encoded = base64.b64encode(slice_bytes).decode('utf-8')
-                encoded_slices.append(encoded)
+        file_path, file_ext = _resolve_file_path(path)
 
-            logger.info(f"Successfully processed image. Dimensions: {dimensions}, Slices: {len(encoded_slices)}")
-            return {
-                "success": True,
-                "data": encoded_slices,
-                "metadata": {
-                    "dimensions": dimensions,
-                    "min_value": min_val,
-                    "max_value": max_val,
-                    "voxel_dimensions": [voxel_width, voxel_height, voxel_depth]
-                }
-            }
+        if progressive:
+            return await run_blocking("load", _load_progressive, path, file_path, file_ext, series_uid)
+
+        if lazy and file_ext in ['.nii', '.nii.gz']:
+            return await run_blocking("load", _load_lazy_nifti, file_path, format)
+
+        try:
+            return await run_blocking("load", _load_file, file_path, file_ext, format)
 
         except HTTPException:
             raise
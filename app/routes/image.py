@@ -1,17 +1,66 @@
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import numpy as np
 import logging
 import base64
 from typing import Dict, Any
 import traceback
+from app.utils.caching import encoded_slice_cache, rendered_slice_cache
+from app.utils.image_processing import estimate_window_presets, window_level_to_uint8
+from app.utils.slice_encoding import SLICE_MEDIA_TYPES, encode_slice, validate_slice_encoding
+from app.utils.transport import validate_response_format
+from app.utils.view_transform import apply_view_operations, identity_view, view_slice, view_spacing, volume_shape
+from app.utils.executor import run_blocking
+from app.utils.image_store import ImageStore
 
 router = APIRouter(prefix="/api", tags=["image"])
 logger = logging.getLogger(__name__)
 
+def _rotate_encoded_slices_180(image_data, width, height):
+    """Rotate base64-encoded float32 slices by 180 degrees."""
+    # Initialize array for rotated slices
+    rotated_data = []
+
+    # Process each slice
+    for slice_data in image_data:
+        try:
+            # Decode from base64
+            binary_data = base64.b64decode(slice_data)
+            # Convert to float32 array
+            pixels = np.frombuffer(binary_data, dtype=np.float32)
+            # Reshape to 2D array
+            slice_array = pixels.reshape((height, width))
+            # Rotate 180 degrees using flip operations for better performance
+            rotated_slice = np.flipud(np.fliplr(slice_array))
+            # Convert back to base64
+            rotated_bytes = rotated_slice.tobytes()
+            rotated_base64 = base64.b64encode(rotated_bytes).decode('utf-8')
+            rotated_data.append(rotated_base64)
+
+        except Exception as slice_error:
+            logger.error(f"Error processing slice: {str(slice_error)}")
+            logger.error(f"Slice data length: {len(slice_data)}")
+            logger.error(f"Expected size: {width * height * 4}")  # 4 bytes per float32
+            raise
+
+    return rotated_data
+
+
 @router.post("/rotate180")
 async def rotate_180(request_data: Dict[str, Any]):
-    """Rotate an image 180 degrees."""
+    """
+    Rotate an image 180 degrees.
+
+    With "image_id", the stored image's view is rotated (see /view) and no
+    pixel data is sent either way. Otherwise the base64 slices in
+    "image_data" are rotated and returned.
+    """
+    if "image_id" in request_data:
+        view = await run_blocking(
+            "transform", update_view, request_data["image_id"], [{"op": "rotate", "angle": 180}]
+        )
+        return {"success": True, "image_id": request_data["image_id"], **view}
+
     try:
         logger.info("Starting 180-degree rotation")
         logger.info(f"Received request data: {request_data.keys()}")
@@ -29,30 +78,7 @@ async def rotate_180(request_data: Dict[str, Any]):
         depth = len(image_data)
         logger.info(f"Processing image with dimensions: {width}x{height}x{depth}")
 
-        # Initialize array for rotated slices
-        rotated_data = []
-
-        # Process each slice
-        for slice_data in image_data:
-            try:
-                # Decode from base64
-                binary_data = base64.b64decode(slice_data)
-                # Convert to float32 array
-                pixels = np.frombuffer(binary_data, dtype=np.float32)
-                # Reshape to 2D array
-                slice_array = pixels.reshape((height, width))
-                # Rotate 180 degrees using flip operations for better performance
-                rotated_slice = np.flipud(np.fliplr(slice_array))
-                # Convert back to base64
-                rotated_bytes = rotated_slice.tobytes()
-                rotated_base64 = base64.b64encode(rotated_bytes).decode('utf-8')
-                rotated_data.append(rotated_base64)
-
-            except Exception as slice_error:
-                logger.error(f"Error processing slice: {str(slice_error)}")
-                logger.error(f"Slice data length: {len(slice_data)}")
-                logger.error(f"Expected size: {width * height * 4}")  # 4 bytes per float32
-                raise
+        rotated_data = await run_blocking("transform", _rotate_encoded_slices_180, image_data, width, height)
 
         logger.info("Rotation complete")
 
@@ -62,6 +88,8 @@ async def rotate_180(request_data: Dict[str, Any]):
             "metadata": metadata  # Keep original metadata
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Rotation error: {str(e)}")
         logger.error(traceback.format_exc())
@@ -73,34 +101,153 @@ async def rotate_180(request_data: Dict[str, Any]):
             },
             status_code=500)
 
-@router.get("/slice/{slice_number}")
-async def get_slice(slice_number: int, image_id: str):
-    """Retrieve a specific slice of a 3D image."""
-    try:
-        if image_id not in image_storage:
-            raise HTTPException(status_code=404, detail="Image not found")
+def _source_slice(data, slice_number, view=None):
+    """
+    Slice slice_number of stored image data, held as (rows, cols, slices)
+    or a list of slices, as seen through the image's view if it has one.
+    """
+    if view is not None:
+        return view_slice(data, view, slice_number)
+    if isinstance(data, np.ndarray):
+        if data.ndim == 2:
+            if slice_number != 0:
+                raise IndexError(slice_number)
+            return data
+        return data[:, :, slice_number]
+    return np.asarray(data[slice_number])
 
-        image_data = image_storage[image_id]
-        slices = image_data.get("normalized_slices")
-        if slices is None or slice_number < 0 or slice_number >= len(slices):
-            raise HTTPException(status_code=400, detail="Invalid slice number")
 
-        slice_data = slices[slice_number]
+def _slice_count(image_data):
+    if image_data.get("view") is not None:
+        return image_data["view"]["shape"][2]
+    data = image_data["data"]
+    if isinstance(data, np.ndarray):
+        return data.shape[2] if data.ndim == 3 else 1
+    return len(data)
+
+
+def _render_key(image_id, image_data):
+    """
+    Cache key prefix for renders of a stored image.
+
+    The version keeps renders of data another worker has since replaced
+    from being served; the view is a plain field that changes without one.
+    """
+    view = image_data.get("view")
+    view_key = None if view is None else tuple(tuple(view[key]) for key in sorted(view))
+    return image_id, image_data["version"], view_key
+
+
+def _resolve_window(image_data, window_center, window_width):
+    """Fill in the image's current window for any setting not given."""
+    if window_center is None:
+        window_center = image_data["window_center"]
+    if window_width is None:
+        window_width = image_data["window_width"]
+    window_center, window_width = float(window_center), float(window_width)
+    if window_width <= 0:
+        raise ValueError("Window width must be positive")
+    return window_center, window_width
+
 
-        # Convert slice to a base64 image
-        import io
-        from PIL import Image
-        import base64
+def render_slice(image_id, slice_number, window_center=None, window_width=None):
+    """
+    Return one slice of a stored image as uint8 at the given window.
 
-        img_byte_arr = io.BytesIO()
-        Image.fromarray(slice_data).save(img_byte_arr, format="PNG")
-        img_base64 = base64.b64encode(img_byte_arr.getvalue()).decode("utf-8")
+    Defaults to the image's current window. Slices are rendered on demand
+    and kept in rendered_slice_cache.
+    """
+    image_data = image_storage[image_id]
+    window_center, window_width = _resolve_window(image_data, window_center, window_width)
 
+    if slice_number < 0 or slice_number >= _slice_count(image_data):
+        raise IndexError(f"Slice {slice_number} out of range")
+
+    view = image_data.get("view")
+
+    def render():
+        slice_data = _source_slice(image_data["data"], slice_number, view)
+        return window_level_to_uint8(slice_data, window_center, window_width)
+
+    key = _render_key(image_id, image_data) + (slice_number, window_center, window_width)
+    return rendered_slice_cache.get_or_load(key, render)
+
+
+def encode_stored_slice(image_id, slice_number, window_center=None, window_width=None,
+                        encoding="png", compress_level=None, optimize=False):
+    """
+    Return (encoded bytes, (rows, cols)) of one slice of a stored image.
+
+    The slice is rendered and encoded the first time it is requested with
+    these settings and then served from encoded_slice_cache.
+    """
+    image_data = image_storage[image_id]
+    window_center, window_width = _resolve_window(image_data, window_center, window_width)
+    key = _render_key(image_id, image_data) + (slice_number, window_center, window_width,
+                                                encoding, compress_level, optimize)
+
+    def encode():
+        rendered = render_slice(image_id, slice_number, window_center, window_width)
+        return encode_slice(rendered, encoding, compress_level, optimize), tuple(rendered.shape)
+
+    return encoded_slice_cache.get_or_load(key, encode)
+
+
+def discard_rendered_slices(image_id):
+    """Drop the cached renders and encodings of an image, e.g. after its data changed."""
+    for cache in (rendered_slice_cache, encoded_slice_cache):
+        cache.discard_where(lambda key: key[0] == image_id)
+
+
+@router.get("/slice/{slice_number}")
+async def get_slice(slice_number: int, image_id: str, window_center: float = None,
+                    window_width: float = None, encoding: str = "png",
+                    compress_level: int = None, optimize: bool = False, format: str = "json"):
+    """
+    Retrieve a specific slice of a 3D image.
+
+    Rendered at window_center/window_width when given, otherwise at the
+    image's current window, and encoded as png (compress_level 0-9 or
+    optimize), lossless webp or raw uint8. Encoded slices are cached, so
+    each is encoded once per setting. With format=json the slice is
+    returned as a data URL (raw: base64 plus dimensions); with
+    format=binary the encoded bytes are the response body.
+    """
+    try:
+        validate_response_format(format)
+        validate_slice_encoding(encoding, compress_level)
+        if image_id not in image_storage:
+            raise HTTPException(status_code=404, detail="Image not found")
+
+        try:
+            encoded, shape = await run_blocking(
+                "render", encode_stored_slice, image_id, slice_number, window_center, window_width,
+                encoding, compress_level, optimize
+            )
+        except (IndexError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid slice request: {str(e)}")
+
+        if format == "binary":
+            return Response(
+                content=encoded,
+                media_type=SLICE_MEDIA_TYPES[encoding],
+                headers={"X-Image-Shape": ",".join(str(dim) for dim in shape), "X-Image-Dtype": "uint8"}
+            )
+
+        encoded_base64 = base64.b64encode(encoded).decode("utf-8")
+        if encoding == "raw":
+            return {
+                "status": "success",
+                "slice": encoded_base64,
+                "dimensions": list(shape)
+            }
         return {
             "status": "success",
-            "slice": f"data:image/png;base64,{img_base64}",
+            "slice": f"data:{SLICE_MEDIA_TYPES[encoding]};base64,{encoded_base64}",
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error retrieving slice: {e}", exc_info=True)
         raise HTTPException(
@@ -108,34 +255,63 @@ async def get_slice(slice_number: int, image_id: str):
             detail="An error occurred while retrieving the slice")
 
 
+@router.get("/window-presets")
+async def get_window_presets(image_id: str):
+    """Return the window presets of a stored image, estimating them once."""
+    if image_id not in image_storage:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    image_data = image_storage[image_id]
+    presets = image_data.get("window_presets")
+    if presets is None:
+        data = image_data.get("data")
+        if data is None:
+            raise HTTPException(status_code=404, detail="Image data not found")
+        presets = await run_blocking("render", estimate_window_presets, np.asarray(data))
+        image_storage.update(image_id, window_presets=presets)
+
+    return {
+        "status": "success",
+        "window_presets": presets
+    }
+
+
 @router.post("/window-level")
-async def update_window_level(image_id: str, window_center: int,
-                              window_width: int):
-    """Apply window-level adjustments to an image."""
+async def update_window_level(image_id: str, window_center: float,
+                              window_width: float, slice_number: int = None):
+    """
+    Set the window/level of an image.
+
+    Nothing is re-rendered eagerly: /slice renders each slice at the new
+    window when it is requested. With slice_number, that slice is rendered
+    right away and returned as raw uint8 values.
+    """
     try:
         if image_id not in image_storage:
             raise HTTPException(status_code=404, detail="Image not found")
+        if window_width <= 0:
+            raise HTTPException(status_code=400, detail="Window width must be positive")
 
         image_data = image_storage[image_id]
-        data = image_data.get("data")
-        if data is None:
+        if image_data.get("data") is None:
             raise HTTPException(status_code=404, detail="Image data not found")
 
-        updated_slices = []
-        for slice_data in data:
-            updated_slice = apply_window_level(slice_data, window_center,
-                                               window_width)
-            updated_slices.append(updated_slice)
-
-        # Update normalized slices in storage
-        image_storage[image_id]["normalized_slices"] = updated_slices
-        image_storage[image_id]["window_center"] = window_center
-        image_storage[image_id]["window_width"] = window_width
+        image_storage.update(image_id, window_center=window_center, window_width=window_width)
 
-        return {
+        response = {
             "status": "success",
             "message": "Window-level updated successfully"
         }
+        if slice_number is not None:
+            try:
+                rendered = await run_blocking("render", render_slice, image_id, slice_number)
+            except IndexError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid slice number: {str(e)}")
+            response["slice"] = base64.b64encode(rendered.tobytes()).decode("utf-8")
+            response["dimensions"] = list(rendered.shape)
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating window-level: {e}", exc_info=True)
         raise HTTPException(
@@ -143,38 +319,79 @@ async def update_window_level(image_id: str, window_center: int,
             detail="An error occurred while updating window-level")
 
 
-@router.post("/rotate")
-async def rotate_image(image_id: str, angle: int):
-    """Rotate an image by a specified angle."""
+def update_view(image_id, operations):
+    """
+    Compose view operations (see apply_view_operations) onto a stored
+    image's view and return the new view with the shape and voxel
+    dimensions it shows.
+
+    Only the view is stored: the volume is left as it is and every slice
+    is served through the view, so this costs the same for any volume size.
+    """
+    image_data = image_storage.get(image_id)
+    if image_data is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    data = image_data.get("data")
+    if data is None:
+        raise HTTPException(status_code=404, detail="Image data not found")
+
+    source_shape = volume_shape(data)
+    current = image_data.get("view") or identity_view(source_shape)
     try:
-        if image_id not in image_storage:
-            raise HTTPException(status_code=404, detail="Image not found")
-
-        image_data = image_storage[image_id]
-        data = image_data.get("data")
-        if data is None:
-            raise HTTPException(status_code=404, detail="Image data not found")
+        view = apply_view_operations(current, operations, source_shape)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Renders are keyed by the view, so slices rendered through the old one are not served
+    image_storage.update(image_id, view=view, total_slices=view["shape"][2])
+    logger.info(f"View of image {image_id} is now {view}")
+    return _view_summary(image_data, view)
+
+
+def _view_summary(image_data, view):
+    voxel_dimensions = image_data.get("voxel_dimensions")
+    return {
+        "view": view,
+        "dimensions": view["shape"][:2],
+        "total_slices": view["shape"][2],
+        "voxel_dimensions": view_spacing(voxel_dimensions, view) if voxel_dimensions else None
+    }
+
+
+@router.get("/view")
+async def get_view(image_id: str):
+    """Return the view of a stored image, see /view."""
+    image_data = image_storage.get(image_id)
+    if image_data is None or image_data.get("data") is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    view = image_data.get("view") or identity_view(volume_shape(image_data["data"]))
+    return {"status": "success", **_view_summary(image_data, view)}
+
+
+@router.post("/view")
+async def set_view(image_id: str, request_data: Dict[str, Any]):
+    """
+    Change the orientation or extent of a stored image.
+
+    "operations" is a list of rotate (by multiples of 90 degrees in the
+    rows/cols plane), flip, permute, crop and reset operations, applied in
+    order to the image's current view (see apply_view_operations). Slices
+    and registrations by image_id then see the image through its view;
+    the stored volume itself is never rewritten.
+    """
+    operations = request_data.get("operations")
+    if not isinstance(operations, list):
+        raise HTTPException(status_code=400, detail="operations must be a list")
+    view = await run_blocking("transform", update_view, image_id, operations)
+    return {"status": "success", **view}
 
-        # Rotate each slice
-        rotated_slices = []
-        for slice_data in data:
-            rotated_slice = np.rot90(slice_data, k=angle // 90)
-            rotated_slices.append(rotated_slice)
 
-        # Update storage
-        image_storage[image_id]["data"] = rotated_slices
-        image_storage[image_id]["normalized_slices"] = rotated_slices
-
-        return {"status": "success", "message": "Image rotated successfully"}
-    except Exception as e:
-        logger.error(f"Error rotating image: {e}", exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail="An error occurred while rotating the image")
-
-# In-memory storage for images
-image_storage = {}
+@router.post("/rotate")
+async def rotate_image(image_id: str, angle: int):
+    """Rotate an image by a multiple of 90 degrees in the rows/cols plane, by updating its view."""
+    view = await run_blocking("transform", update_view, image_id, [{"op": "rotate", "angle": angle}])
+    return {"status": "success", "message": "Image rotated successfully", **view}
 
-def apply_window_level(slice_data, window_center, window_width):
-    # Placeholder for window-level adjustment logic.  Replace with actual implementation.
-    return slice_data
\ No newline at end of file
+# Uploaded images, shared with the other workers through IMAGE_STORE_DIR
+image_storage = ImageStore()
+image_storage.add_release_hook(discard_rendered_slices)
@@ -1,92 +1,297 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import SimpleITK as sitk
+import asyncio
 import logging
 import traceback
+import threading
 import base64
-from ..utils.image_processing import register_images
+import json
+import time
+import uuid
+import os
+from ..utils.image_processing import (
+    REGISTRATION_PRESETS, BSPLINE_SAMPLING_PERCENTAGE, displacement_magnitude, estimate_bspline_transform,
+    estimate_rigid_transform, estimate_window_presets, registration_pyramid, resample_to_fixed,
+    validate_registration_preset
+)
+from ..utils.transform_cache import transform_cache, transform_key, volume_digest
+from ..utils.view_transform import as_volume, view_array, view_digest, view_spacing, volume_shape
+from ..config import (
+    REGISTRATION_PRESET, REGISTRATION_BATCH_CONCURRENCY, REGISTRATION_BATCH_MAX_IMAGES,
+    REGISTRATION_BSPLINE_GRID_SIZE, REGISTRATION_BSPLINE_MAX_GRID_SIZE, REGISTRATION_BSPLINE_SHRINK,
+    REGISTRATION_BSPLINE_ITERATIONS
+)
+from ..utils.executor import run_blocking
+from ..utils.registration_jobs import registration_jobs
+from .directory import load_image_volume
+from .image import image_storage
+from .session import request_session
 
 router = APIRouter(tags=["registration"])
 logger = logging.getLogger(__name__)
 
-@router.post("/api/registration")
-async def register_images_endpoint(request_data: Dict[str, Any]):
+REGISTRATION_MODES = ("rigid", "deformable")
+
+# Upper bound of a request's bspline_iterations
+_MAX_BSPLINE_ITERATIONS = 500
+
+def _decode_inline_volume(image_data, label):
+    """Decode a volume sent as base64 float32 slices into a slice-major array and its voxel dimensions."""
+    metadata = image_data["metadata"]
+    width, height = metadata["dimensions"]
+
+    # Process each slice
+    slices = []
+    for slice_data in image_data["data"]:
+        try:
+            binary_data = base64.b64decode(slice_data)
+            pixels = np.frombuffer(binary_data, dtype=np.float32)
+            slice_array = pixels.reshape((height, width))
+            slices.append(slice_array)
+        except Exception as e:
+            logger.error(f"Error processing {label} image slice: {str(e)}")
+            raise
+
+    # Get voxel dimensions from metadata
+    return np.stack(slices), metadata.get('voxel_dimensions', [1.0, 1.0, 1.0])
+
+def _is_reference(image_data):
+    return "image_id" in image_data or "path" in image_data
+
+def _referenced_volume(image_data):
+    """
+    Slice-major view, voxel dimensions and content hash of a stored image
+    (image_id), as seen through its view, or of a file or DICOM series
+    directory under the images directory (path).
+    """
+    if "image_id" in image_data:
+        stored = image_storage.get(image_data["image_id"])
+        if stored is None:
+            raise HTTPException(status_code=404, detail=f"Image not found: {image_data['image_id']}")
+        data = stored["data"]
+        voxel_dims = stored.get("voxel_dimensions") or [1.0, 1.0, 1.0]
+        digest = stored.get("content_hash")
+        view = stored.get("view")
+        if view is not None:
+            # Register the image as it is shown; content_hash is that of the stored volume
+            if digest:
+                digest = view_digest(digest, view, volume_shape(data))
+            data = view_array(as_volume(data), view)
+            voxel_dims = view_spacing(voxel_dims, view)
+        digest = digest or volume_digest(data, voxel_dims)
+    else:
+        data, metadata = load_image_volume(image_data["path"], image_data.get("series_uid"))
+        voxel_dims = metadata.get("voxel_dimensions") or [1.0, 1.0, 1.0]
+        digest = volume_digest(data, voxel_dims)
+
+    if isinstance(data, list):
+        # Already a list of 2D slices
+        array = np.stack(data)
+    elif data.ndim == 2:
+        array = data[np.newaxis]
+    else:
+        # (rows, cols, slices) -> (slices, rows, cols), without copying
+        array = np.moveaxis(data, 2, 0)
+    return array, [float(v) for v in voxel_dims], digest
+
+def _store_registered_volume(registered_array, voxel_dimensions, session_id):
+    """Keep a slice-major volume on the fixed image's grid in image_storage and return its id and metadata."""
+    data = np.ascontiguousarray(np.moveaxis(registered_array.astype(np.float32, copy=False), 0, 2))
+    window_presets = estimate_window_presets(data)
+    image_id = str(uuid.uuid4())
+    fields = {
+        "window_width": float(window_presets["auto"]["window_width"]),
+        "window_center": float(window_presets["auto"]["window_center"]),
+        "total_slices": int(data.shape[2]),
+        "data_min": float(np.min(data)),
+        "data_max": float(np.max(data)),
+        "window_presets": window_presets,
+        "voxel_dimensions": voxel_dimensions
+    }
+    image_storage.put(image_id, {
+        "data": data,
+        "content_hash": volume_digest(data, voxel_dimensions),
+        **fields
+    }, session_id=session_id)
+    logger.info(f"Stored registered volume as {image_id}")
+    return image_id, {"dimensions": [int(data.shape[0]), int(data.shape[1])], **fields}
+
+class _PreparedVolume:
+    """
+    One side of a registration, ready for SimpleITK; see _register_request for the accepted forms.
+
+    voxel_dimensions are in the (rows, cols, slices) order of image
+    metadata, whether sent inline or read from the stored image; spacing
+    is the same in the (x, y, z) = (cols, rows, slices) order of SimpleITK.
+    """
+
+    def __init__(self, image_data, label):
+        self.referenced = _is_reference(image_data)
+        if self.referenced:
+            array, self.voxel_dimensions, self.digest = _referenced_volume(image_data)
+            self.dimensions = None
+        else:
+            array, voxel_dims = _decode_inline_volume(image_data, label)
+            self.voxel_dimensions = [float(v) for v in voxel_dims]
+            self.digest = volume_digest(array, self.voxel_dimensions)
+            self.dimensions = image_data["metadata"]["dimensions"]
+        self.spacing = [self.voxel_dimensions[1], self.voxel_dimensions[0], self.voxel_dimensions[2]]
+        logger.info(f"{label.capitalize()} image shape: {array.shape}, spacing: {self.spacing}")
+
+        # Convert to SimpleITK image for registration; stored integer volumes become float32 only here
+        self.image = sitk.GetImageFromArray(np.asarray(array, dtype=np.float32))
+        self.image.SetSpacing(self.spacing)
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def levels(self, preset, threads=None):
+        """Registration pyramid of the image for a preset, built once and shared by every registration."""
+        with self._lock:
+            if preset not in self._levels:
+                self._levels[preset] = registration_pyramid(self.image, preset, threads)
+            return self._levels[preset]
+
+def _deformable_settings(request_data):
+    """B-spline settings of a deformable request, None for a rigid one."""
+    if request_data.get("mode", "rigid") != "deformable":
+        return None
+    return {
+        "grid_size": request_data.get("grid_size", REGISTRATION_BSPLINE_GRID_SIZE),
+        "shrink_factor": REGISTRATION_BSPLINE_SHRINK,
+        "iterations": request_data.get("bspline_iterations", REGISTRATION_BSPLINE_ITERATIONS),
+        "sampling_percentage": BSPLINE_SAMPLING_PERCENTAGE
+    }
+
+def _registration_parameters(preset, deformable=None):
+    """Everything besides the two volumes that determines a registration's transform."""
+    parameters = {"mode": "rigid", "preset": preset, "settings": REGISTRATION_PRESETS[preset]}
+    if deformable is not None:
+        parameters.update(mode="deformable", bspline=deformable)
+    return parameters
+
+def _cached_transform(transform_id, use_cache):
+    """(transform, report) cached under transform_id, or None."""
+    if not use_cache:
+        return None
     try:
-        logger.info("Starting image registration process")
+        transform, report = transform_cache.get(transform_id)
+    except KeyError:
+        return None
+    logger.info(f"Reusing cached transform {transform_id}")
+    return transform, {**report, "cached": True}
 
-        # Extract and validate data from request
-        if 'fixed_image' not in request_data or 'moving_image' not in request_data:
-            raise HTTPException(status_code=400, detail="Missing fixed or moving image data")
-
-        fixed_data = request_data["fixed_image"]
-        moving_data = request_data["moving_image"]
-
-        # Get dimensions and metadata from request
-        fixed_metadata = fixed_data["metadata"]
-        moving_metadata = moving_data["metadata"]
-
-        fixed_width, fixed_height = fixed_metadata["dimensions"]
-        moving_width, moving_height = moving_metadata["dimensions"]
-
-        # Process each slice for fixed image
-        fixed_slices = []
-        for slice_data in fixed_data["data"]:
-            try:
-                binary_data = base64.b64decode(slice_data)
-                pixels = np.frombuffer(binary_data, dtype=np.float32)
-                slice_array = pixels.reshape((fixed_height, fixed_width))
-                fixed_slices.append(slice_array)
-            except Exception as e:
-                logger.error(f"Error processing fixed image slice: {str(e)}")
-                raise
-
-        # Process each slice for moving image
-        moving_slices = []
-        for slice_data in moving_data["data"]:
-            try:
-                binary_data = base64.b64decode(slice_data)
-                pixels = np.frombuffer(binary_data, dtype=np.float32)
-                slice_array = pixels.reshape((moving_height, moving_width))
-                moving_slices.append(slice_array)
-            except Exception as e:
-                logger.error(f"Error processing moving image slice: {str(e)}")
-                raise
-
-        # Convert to 3D numpy arrays
-        fixed_array = np.stack(fixed_slices)
-        moving_array = np.stack(moving_slices)
-
-        # Get voxel dimensions from metadata
-        fixed_voxel_dims = fixed_metadata.get('voxel_dimensions', [1.0, 1.0, 1.0])
-        moving_voxel_dims = moving_metadata.get('voxel_dimensions', [1.0, 1.0, 1.0])
-
-        # Update metadata with voxel dimensions as spacing
-        fixed_metadata['spacing'] = fixed_voxel_dims
-        moving_metadata['spacing'] = moving_voxel_dims
-
-        logger.info(f"Fixed image voxel dimensions: {fixed_voxel_dims}")
-        logger.info(f"Moving image voxel dimensions: {moving_voxel_dims}")
-
-        # Convert to SimpleITK images for registration
-        fixed_image = sitk.GetImageFromArray(fixed_array)
-        moving_image = sitk.GetImageFromArray(moving_array)
-
-        # Set physical spacing for both images
-        fixed_image.SetSpacing(fixed_voxel_dims)
-        moving_image.SetSpacing(moving_voxel_dims)
-
-        # Process registration with metadata
-        registered_array = register_images(
-            fixed_array, 
-            moving_array, 
-            fixed_image, 
-            moving_image,
-            fixed_metadata,
-            moving_metadata
+def _cache_transform(transform_id, transform, report, progress):
+    # A stopped registration is not the transform these parameters produce
+    if progress is None or not progress.cancelled:
+        transform_cache.put(transform_id, transform, report)
+    return transform, {**report, "cached": False}
+
+def _transform_for(request_data, fixed, moving, progress=None, threads=None):
+    """
+    Return (transform_id, transform, report) for a request.
+
+    An explicit transform_id applies that cached transform as is, e.g. one
+    computed for another sequence of the same moving scan. Otherwise the
+    transform is looked up by the content hashes of both volumes and the
+    parameters, and only optimized, then cached, when it is not found.
+    """
+    if request_data.get("transform_id"):
+        transform_id = request_data["transform_id"]
+        try:
+            transform, report = transform_cache.get(transform_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Transform not found: {transform_id}")
+        logger.info(f"Applying cached transform {transform_id}")
+        return transform_id, transform, {**report, "cached": True}
+
+    start = time.perf_counter()
+    preset = request_data.get("preset", REGISTRATION_PRESET)
+    use_cache = request_data.get("use_cache", True)
+    deformable = _deformable_settings(request_data)
+    if deformable is not None:
+        transform_id = transform_key(fixed.digest, moving.digest, _registration_parameters(preset, deformable))
+        cached = _cached_transform(transform_id, use_cache)
+        if cached is not None:
+            return (transform_id, *cached)
+
+    observer = progress.observe if progress is not None else None
+    rigid_id = transform_key(fixed.digest, moving.digest, _registration_parameters(preset))
+    cached = _cached_transform(rigid_id, use_cache)
+    if cached is not None:
+        rigid, rigid_report = cached
+    else:
+        if progress is not None:
+            progress.update(stage="rigid")
+        rigid, rigid_report = estimate_rigid_transform(
+            fixed.image, moving.image, preset,
+            observer=observer,
+            threads=threads,
+            fixed_levels=fixed.levels(preset, threads)
         )
+        rigid, rigid_report = _cache_transform(rigid_id, rigid, rigid_report, progress)
+    if deformable is None:
+        return rigid_id, rigid, rigid_report
+
+    # The B-spline starts from the rigid result, cached or not
+    if progress is not None:
+        progress.update(stage="deformable")
+    transform, _, bspline_report = estimate_bspline_transform(
+        fixed.image, moving.image, rigid,
+        grid_size=deformable["grid_size"],
+        shrink_factor=deformable["shrink_factor"],
+        iterations=deformable["iterations"],
+        observer=observer,
+        threads=threads
+    )
+    report = {
+        "mode": "deformable",
+        "preset": preset,
+        "threads": threads or sitk.ProcessObject.GetGlobalDefaultNumberOfThreads(),
+        "final_metric_value": bspline_report["final_metric_value"],
+        "stop_condition": bspline_report["stop_condition"],
+        "seconds": time.perf_counter() - start,
+        "rigid": rigid_report,
+        "bspline": bspline_report
+    }
+    return (transform_id, *_cache_transform(transform_id, transform, report, progress))
 
+def _store_displacement(transform, fixed, session_id, threads=None):
+    """
+    Keep the displacement magnitude, in mm, of a deformable transform's
+    B-spline over the fixed image's grid in image_storage.
+    """
+    bspline = sitk.CompositeTransform(transform).GetNthTransform(1)
+    magnitude = displacement_magnitude(bspline, fixed.image, threads)
+    image_id, metadata = _store_registered_volume(magnitude, fixed.voxel_dimensions, session_id)
+    return {
+        "image_id": image_id,
+        "metadata": metadata,
+        "max_mm": float(magnitude.max()),
+        "mean_mm": float(magnitude.mean())
+    }
+
+def _register_prepared(request_data, fixed, moving, progress=None, session_id=None, threads=None):
+    """Register prepared volumes and build the response; see _register_request."""
+    transform_id, transform, report = _transform_for(request_data, fixed, moving, progress, threads)
+    report["transform_id"] = transform_id
+    if progress is not None and (progress.cancelled or progress.check_cancelled()):
+        # Cancelled during or right after the optimization: nothing is resampled or stored
+        return {"success": False, "state": "cancelled", "registration": report}
+    registered_array = resample_to_fixed(moving.image, fixed.image, transform, threads)
+
+    if fixed.referenced or moving.referenced:
+        image_id, metadata = _store_registered_volume(registered_array, fixed.voxel_dimensions, session_id)
+        response = {
+            "success": True,
+            "image_id": image_id,
+            "metadata": metadata,
+            "registration": report
+        }
+    else:
         # Convert registered results back to base64
         registered_data = []
         for i in range(registered_array.shape[0]):
@@ -94,19 +299,127 @@ async def register_images_endpoint(request_data: Dict[str, Any]):
             encoded_bytes = base64.b64encode(slice_data.tobytes())
             registered_data.append(encoded_bytes.decode('utf-8'))
 
-        logger.info("Registration completed successfully")
-
-        return JSONResponse({
+        fixed_width, fixed_height = fixed.dimensions
+        response = {
             "success": True,
             "data": registered_data,
             "metadata": {
                 "dimensions": [int(fixed_width), int(fixed_height)],
-                "voxel_dimensions": fixed_voxel_dims,  # Include voxel dimensions in response
+                "voxel_dimensions": fixed.voxel_dimensions,  # Include voxel dimensions in response
                 "min_value": float(np.min(registered_array)),
                 "max_value": float(np.max(registered_array))
-            }
-        })
+            },
+            "registration": report
+        }
+
+    if report.get("mode") == "deformable":
+        response["displacement"] = _store_displacement(transform, fixed, session_id, threads)
+    return response
+
+def _register_request(request_data, progress=None, session_id=None):
+    """
+    Register the images of a registration request.
+
+    Each image is either sent inline as base64 float32 slices or
+    referenced by "image_id" (an uploaded image) or "path" (a file or DICOM
+    series directory, with an optional "series_uid"). When either is a
+    reference, the registered volume is kept in image_storage, owned by
+    session_id, and only its new image_id and metadata are returned;
+    otherwise it is returned inline as before.
+
+    Transforms are cached on disk (see _transform_for); the response's
+    transform_id can be sent back to apply the same transform to other
+    volumes, and "use_cache": false forces a new optimization.
+
+    "mode": "deformable" adds a B-spline stage on top of the rigid one,
+    with an optional "grid_size" (mesh cells per axis) and
+    "bspline_iterations". Its displacement magnitude is always kept in
+    image_storage and returned as "displacement". "threads" limits the
+    SimpleITK threads of the registration.
+
+    Runs in a worker process or a job thread, so it takes and returns
+    plain data only. progress, when given, is the JobProgress of a job.
+    """
+    fixed = _PreparedVolume(request_data["fixed_image"], "fixed")
+    moving = _PreparedVolume(request_data["moving_image"], "moving")
+    return _register_prepared(request_data, fixed, moving, progress, session_id, request_data.get("threads"))
+
+def _register_batch(request_data, emit, session_id=None):
+    """
+    Register every moving image of a batch request against its fixed image.
+
+    The fixed image is prepared once, and its pyramid built once, for all
+    of them. Up to REGISTRATION_BATCH_CONCURRENCY registrations run at
+    once, and the CPUs are split evenly between them through SimpleITK's
+    per-filter thread counts, unless the request sets "threads". emit(line) is called with each result as it
+    finishes and with a final {"done": true} summary.
+    """
+    start = time.perf_counter()
+    moving_images = request_data["moving_images"]
+    concurrency = max(1, min(len(moving_images), REGISTRATION_BATCH_CONCURRENCY))
+    threads = request_data.get("threads") or max(1, (os.cpu_count() or 1) // concurrency)
+    summary = {"done": True, "count": len(moving_images), "succeeded": 0,
+               "concurrency": concurrency, "threads_per_registration": threads}
+    summary_lock = threading.Lock()
 
+    def register_one(index, image_data):
+        try:
+            moving = _PreparedVolume(image_data, f"moving #{index}")
+            result = _register_prepared(request_data, fixed, moving, session_id=session_id, threads=threads)
+            with summary_lock:
+                summary["succeeded"] += 1
+        except HTTPException as e:
+            result = {"success": False, "error": e.detail}
+        except Exception as e:
+            logger.error(f"Batch registration of moving image {index} failed: {str(e)}", exc_info=True)
+            result = {"success": False, "error": str(e)}
+        emit({"index": index, **result})
+
+    try:
+        fixed = _PreparedVolume(request_data["fixed_image"], "fixed")
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="registration-batch") as pool:
+            for future in [pool.submit(register_one, index, image_data)
+                           for index, image_data in enumerate(moving_images)]:
+                future.result()
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        logger.error(f"Batch registration failed: {detail}")
+        summary["error"] = detail
+    finally:
+        summary["seconds"] = time.perf_counter() - start
+        emit(summary)
+
+@router.post("/api/registration")
+async def register_images_endpoint(request_data: Dict[str, Any], request: Request):
+    """
+    Register moving_image onto fixed_image and return the result.
+
+    Images may be sent inline or referenced by image_id or path (see
+    _register_request); with references no pixel data crosses HTTP and
+    the result is kept server-side under a new image_id owned by the
+    caller's session. "preset" (fast, balanced, accurate or full) picks
+    the multi-resolution schedule; the per-level iterations, metric and
+    timing are returned in "registration". "mode": "deformable" refines
+    the rigid result with a B-spline and also returns the image_id of its
+    displacement magnitude.
+    """
+    try:
+        logger.info("Starting image registration process")
+
+        # Extract and validate data from request
+        _validate_registration_request(request_data)
+
+        session_id = await request_session(request)
+        result = await run_blocking(
+            "registration", _register_request, request_data, session_id=session_id, process=True
+        )
+
+        logger.info("Registration completed successfully")
+
+        return JSONResponse(result)
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Registration error: {str(e)}")
         logger.error(traceback.format_exc())
@@ -114,4 +427,132 @@ async def register_images_endpoint(request_data: Dict[str, Any]):
             "success": False,
             "error": str(e),
             "detail": "Registration failed"
-        }, status_code=500)
\ No newline at end of file
+        }, status_code=500)
+
+def _validate_image_spec(image_data, name):
+    if not isinstance(image_data, dict) or not (_is_reference(image_data) or 'data' in image_data):
+        raise HTTPException(status_code=400, detail=f"{name} needs data, an image_id or a path")
+    if "image_id" in image_data and image_data["image_id"] not in image_storage:
+        raise HTTPException(status_code=404, detail=f"Image not found: {image_data['image_id']}")
+
+def _validate_registration_request(request_data):
+    if 'fixed_image' not in request_data or 'moving_image' not in request_data:
+        raise HTTPException(status_code=400, detail="Missing fixed or moving image data")
+    for key in ('fixed_image', 'moving_image'):
+        _validate_image_spec(request_data[key], key)
+    _validate_options(request_data)
+
+def _validate_options(request_data):
+    """Check the preset, mode, B-spline settings and thread count of a request."""
+    try:
+        validate_registration_preset(request_data.get("preset", REGISTRATION_PRESET))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if request_data.get("mode", "rigid") not in REGISTRATION_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported registration mode: {request_data['mode']}. Expected one of {', '.join(REGISTRATION_MODES)}"
+        )
+    limits = {
+        "grid_size": REGISTRATION_BSPLINE_MAX_GRID_SIZE,
+        "bspline_iterations": _MAX_BSPLINE_ITERATIONS,
+        "threads": os.cpu_count() or 1
+    }
+    for key, limit in limits.items():
+        value = request_data.get(key)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= limit):
+            raise HTTPException(status_code=400, detail=f"{key} must be an integer between 1 and {limit}")
+
+def _job_status(job_id):
+    try:
+        return registration_jobs.status(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Registration job not found")
+
+@router.post("/api/registration/jobs", status_code=202)
+async def submit_registration_job(request_data: Dict[str, Any], request: Request):
+    """
+    Start a registration in the background.
+
+    Takes the same body as /api/registration and returns a job_id right
+    away. Poll /api/registration/jobs/{job_id} for the optimizer iteration
+    and metric value, fetch .../result once it has succeeded, and DELETE
+    the job to cancel it.
+    """
+    _validate_registration_request(request_data)
+    session_id = await request_session(request)
+    job_id = await run_blocking(
+        "jobs", registration_jobs.submit, _register_request, request_data, session_id=session_id
+    )
+    return {"success": True, "job_id": job_id, "state": "queued"}
+
+@router.get("/api/registration/jobs/{job_id}")
+async def get_registration_job(job_id: str):
+    """Return the state and progress of a registration job."""
+    return {"success": True, **_job_status(job_id)}
+
+@router.get("/api/registration/jobs/{job_id}/result")
+async def get_registration_job_result(job_id: str):
+    """Return the result of a succeeded registration job; 409 while it is not."""
+    status = _job_status(job_id)
+    if status["state"] != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Registration job is {status['state']}")
+    return JSONResponse(await run_blocking("registration", registration_jobs.result, job_id))
+
+@router.delete("/api/registration/jobs/{job_id}")
+async def cancel_registration_job(job_id: str):
+    """Cancel a queued or running registration job."""
+    try:
+        status = registration_jobs.cancel(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Registration job not found")
+    return {"success": True, **status}
+
+@router.post("/api/registration/batch")
+async def register_batch_endpoint(request_data: Dict[str, Any], request: Request):
+    """
+    Register many moving images against one fixed image.
+
+    Takes "fixed_image" and a list of "moving_images", each in any form
+    /api/registration accepts, plus its other options. Results
+    are streamed as NDJSON, one line per moving image as soon as it is
+    done ({"index": i, ...} like an /api/registration response), then a
+    {"done": true, ...} summary. The whole batch counts as one
+    registration against the executor limits.
+    """
+    if 'fixed_image' not in request_data or not isinstance(request_data.get('moving_images'), list):
+        raise HTTPException(status_code=400, detail="Missing fixed_image or moving_images list")
+    if not 0 < len(request_data['moving_images']) <= REGISTRATION_BATCH_MAX_IMAGES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"moving_images must hold between 1 and {REGISTRATION_BATCH_MAX_IMAGES} images"
+        )
+    _validate_image_spec(request_data['fixed_image'], 'fixed_image')
+    for index, image_data in enumerate(request_data['moving_images']):
+        _validate_image_spec(image_data, f"moving_images[{index}]")
+    _validate_options(request_data)
+
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue()
+
+    def emit(line):
+        loop.call_soon_threadsafe(lines.put_nowait, line)
+
+    session_id = await request_session(request)
+    batch = asyncio.ensure_future(run_blocking(
+        "registration", _register_batch, request_data, emit, session_id=session_id
+    ))
+    # Let the executor admit or reject the batch before the response starts
+    await asyncio.sleep(0)
+    if batch.done() and batch.exception() is not None:
+        raise batch.exception()
+
+    async def stream():
+        while True:
+            line = await lines.get()
+            yield json.dumps(line) + "\n"
+            if line.get("done"):
+                break
+        await batch
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -1,23 +1,96 @@
-from fastapi import APIRouter, Response
-import uuid
+from fastapi import APIRouter, HTTPException, Request, Response
+from app.config import SESSION_COOKIE_SAMESITE, SESSION_COOKIE_SECURE
+from app.routes.image import image_storage
+from app.utils.executor import run_blocking
+from app.utils.image_store import SessionStore
 
 router = APIRouter()
 
-# Session store
-SESSION_STORE = {}
+# Session store, kept in the image store registry so every worker sees the same sessions.
+# Sessions own the images uploaded with them and release them when they expire.
+SESSION_STORE = SessionStore(image_storage)
+
+SESSION_COOKIE = "session_id"
+
+
+def _create_session():
+    return SESSION_STORE.create({"user_id": 123, "preferences": {"theme": "dark"}})
+
+
+def _cookie_settings(request: Request):
+    """Secure and SameSite of the session cookie for a request."""
+    if SESSION_COOKIE_SECURE == "auto":
+        secure = request.url.scheme == "https"
+    else:
+        secure = SESSION_COOKIE_SECURE == "true"
+    # Browsers drop SameSite=None cookies that are not Secure
+    secure = secure or SESSION_COOKIE_SAMESITE == "none"
+    return {"httponly": True, "secure": secure, "samesite": SESSION_COOKIE_SAMESITE}
+
+
+def _set_session_cookie(request: Request, response: Response, session_id):
+    response.set_cookie(key=SESSION_COOKIE, value=session_id, **_cookie_settings(request))
+
+
+async def request_session(request: Request):
+    """
+    Return the live session of a request's cookie, or None.
+
+    The registry is only read, in a worker thread, when the session has
+    not been seen for a few seconds (see SessionStore.touch).
+    """
+    session_id = request.cookies.get(SESSION_COOKIE)
+    if not session_id:
+        return None
+    if not SESSION_STORE.touch_due(session_id) or await run_blocking("session", SESSION_STORE.touch, session_id):
+        return session_id
+    return None
+
+
+async def ensure_session(request: Request, response: Response):
+    """Return the request's session, creating one (and its cookie) if it has none or it expired."""
+    session_id = await request_session(request)
+    if session_id is None:
+        session_id = await run_blocking("session", _create_session)
+        _set_session_cookie(request, response, session_id)
+    return session_id
+
 
 @router.get("/set-session")
-async def set_session(response: Response):
+async def set_session(request: Request, response: Response):
     # Generate session ID
-    session_id = str(uuid.uuid4())
-    SESSION_STORE[session_id] = {"user_id": 123, "preferences": {"theme": "dark"}}
+    session_id = await run_blocking("session", _create_session)
 
     # Set cookie
-    response.set_cookie(
-        key="session_id",
-        value=session_id,
-        httponly=True,
-        secure=True,
-        samesite="none"
-    )
+    _set_session_cookie(request, response, session_id)
     return {"message": "Session created", "session_id": session_id}
+
+
+@router.post("/close-study")
+async def close_study(request: Request, image_id: str = None):
+    """
+    Release the images uploaded in this session, or only image_id.
+
+    Pixel data and cached renders of the released
+    images are dropped right away; the session itself stays open.
+    """
+    session_id = await request_session(request)
+    if session_id is None:
+        raise HTTPException(status_code=401, detail="No active session")
+    try:
+        # Unlinks the released images' files, so it runs off the event loop
+        released = await run_blocking("session", SESSION_STORE.close_study, session_id, image_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Image not found in this session")
+    return {"status": "success", "released": released}
+
+
+@router.post("/end-session")
+async def end_session(request: Request, response: Response):
+    """End the session and release every image uploaded in it."""
+    session_id = await request_session(request)
+    if session_id is None:
+        raise HTTPException(status_code=401, detail="No active session")
+    released = await run_blocking("session", SESSION_STORE.end, session_id)
+    response.delete_cookie(SESSION_COOKIE, **_cookie_settings(request))
+    return {"status": "success", "released": released}
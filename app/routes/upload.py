@@ -1,17 +1,22 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from app.config import UPLOAD_DIR, SUPPORTED_EXTENSIONS
-from app.routes.image import image_storage
-from app.utils.image_processing import normalize_data, precompute_normalized_slices
-from app.utils.image_processing import calculate_optimal_window_settings
+from fastapi import APIRouter, HTTPException, Request, Response
+from app.config import UPLOAD_DIR, SUPPORTED_EXTENSIONS, PNG_COMPRESSION
+from app.routes.image import encode_stored_slice, image_storage
+from app.routes.session import ensure_session
+from app.utils.image_processing import normalize_data
+from app.utils.image_processing import estimate_window_presets
+from app.utils.upload_streaming import UPLOAD_OPENAPI_EXTRA, receive_upload
+from app.utils.caching import content_cache_key, load_cached_volume
+from app.utils.executor import run_blocking
+from app.utils.slice_encoding import PNG_COMPRESSION_PRESETS, encode_in_parallel, validate_png_compression
+from app.utils.file_handling import read_nifti_data
+from app.utils.transform_cache import volume_digest
 import gc
 import nibabel as nib
 import pydicom
 from PIL import Image
 import numpy as np
-import io
 import base64
 import os
-import tempfile
 import uuid
 import logging
 
@@ -21,197 +26,238 @@ logger = logging.getLogger(__name__)
 #if file_extension not in ALLOWED_FILE_EXTENSIONS:
 #   raise ValueError("Unsupported file type")
 
-@router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    temp_file = None
-    try:
-        # Validate file extension
-        filename = file.filename.lower()
-        valid_extensions = SUPPORTED_EXTENSIONS
-        
-        # Special handling for .nii.gz files
-        if filename.endswith('.nii.gz'):
-            suffix = '.nii.gz'
-        else:
-            suffix = os.path.splitext(filename)[1]
+def _decode_upload(file_path, suffix):
+    """
+    Decode an uploaded file into an array and its slice count.
+
+    Integer data keeps its stored type, so it is windowed through the
+    integer lookup table of window_level_to_uint8; anything else is
+    converted to float32.
+    """
+    data = None
+    total_slices = 1
+    voxel_dimensions = [1.0, 1.0, 1.0]
+    
+    # Try loading as NIfTI first
+    if suffix in ['.nii', '.gz']:
+        logger.info("Loading NIfTI file")
+        try:
+            img = nib.load(file_path)
+            # Log NIfTI header information
+            logger.info(f"NIfTI header: shape={img.shape}, affine={img.affine.shape}, datatype={img.get_data_dtype()}")
+            
+            data = read_nifti_data(img, keep_integers=True)
+            logger.info(f"Original data shape: {data.shape}, dtype: {data.dtype}, min: {data.min()}, max: {data.max()}")
+            
+            # Ensure data is at least 2D
+            if len(data.shape) < 2:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid NIfTI data: Expected 2D or 3D data, but got {len(data.shape)}D data with shape {data.shape}"
+                )
             
-        if not any(filename.endswith(ext) for ext in valid_extensions):
+            # Handle different dimensionalities
+            if len(data.shape) == 2:
+                # 2D data: Keep as is
+                total_slices = 1
+                logger.info("Processing as 2D image")
+            elif len(data.shape) == 3:
+                # Check if any dimension is 1, which might need squeezing
+                if 1 in data.shape:
+                    logger.info(f"Found singleton dimension in shape {data.shape}")
+                    data = np.squeeze(data)
+                    logger.info(f"After squeezing: {data.shape}")
+                    total_slices = 1 if len(data.shape) == 2 else data.shape[2]
+                else:
+                    # Regular 3D data
+                    total_slices = data.shape[2]
+                    logger.info("Processing as 3D volume")
+            elif len(data.shape) == 4:
+                # 4D data: Take first volume
+                logger.info("4D data detected, taking first volume")
+                data = data[:, :, :, 0]
+                total_slices = data.shape[2]
+            else:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Unsupported NIfTI dimensionality: {len(data.shape)}D with shape {data.shape}"
+                )
+            
+            logger.info(f"Final processed data shape: {data.shape}, total_slices: {total_slices}")
+
+            zooms = img.header.get_zooms()
+            voxel_dimensions = [float(zooms[i]) if i < len(zooms) else 1.0 for i in range(3)]
+            
+            img.uncache()
+            del img
+            gc.collect()
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing NIfTI file", exc_info=True)
             raise HTTPException(
                 status_code=400,
-                detail=f"Unsupported file type. Supported formats are: {', '.join(valid_extensions)}"
+                detail=f"Failed to load NIfTI file: {str(e)}"
             )
-
-        # Log file information
-        logger.info(f"Receiving file: {filename}")
         
-        # Create a temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    elif suffix == '.dcm':
+        logger.info("Loading DICOM file")
+        try:
+            dcm = pydicom.dcmread(file_path)
+            data = dcm.pixel_array.copy()
+            if hasattr(dcm, 'PixelSpacing'):
+                voxel_dimensions[:2] = [float(dcm.PixelSpacing[0]), float(dcm.PixelSpacing[1])]
+            if hasattr(dcm, 'SliceThickness'):
+                voxel_dimensions[2] = float(dcm.SliceThickness)
+            del dcm
+            gc.collect()
+        except Exception as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Failed to load DICOM file: {str(e)}"
+            )
         
+    else:
+        logger.info("Loading standard image file")
         try:
-            # Write the uploaded file content
-            content = await file.read()
-            if not content:
+            img = Image.open(file_path)
+            data = np.array(img)
+            img.close()
+            del img
+            if len(data.shape) == 3 and data.shape[2] in [3, 4]:  # RGB or RGBA
+                data = np.mean(data, axis=2)
+        except Exception as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Failed to load image file: {str(e)}"
+            )
+    
+    if data is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Failed to load image data: No data was extracted from the file"
+        )
+    
+    if data.size == 0:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid image: Image contains no data"
+        )
+    
+    logger.info(f"Data shape: {data.shape}, dtype: {data.dtype}")
+    
+    if np.issubdtype(data.dtype, np.integer):
+        # Native byte order, as the lookup table indexes the raw values
+        data = data.astype(data.dtype.newbyteorder('='), copy=False)
+    else:
+        data = data.astype(np.float32, copy=False)
+
+    return data, {
+        "total_slices": total_slices,
+        "voxel_dimensions": voxel_dimensions,
+        "content_hash": volume_digest(data, voxel_dimensions)
+    }
+
+def _process_upload(file_path, suffix, digest):
+    """Decode an upload (or reuse its cached volume) and compute its statistics."""
+    data, decoded = load_cached_volume(
+        content_cache_key("api-upload", digest, suffix),
+        lambda: _decode_upload(file_path, suffix)
+    )
+    # Calculate optimal window settings, plus the other presets from the same histogram
+    window_presets = estimate_window_presets(data)
+    return (data, decoded["total_slices"], window_presets, float(np.min(data)), float(np.max(data)),
+            decoded["voxel_dimensions"], decoded["content_hash"])
+
+def _encode_all_slices(image_id, total_slices, png_compression):
+    """
+    PNG data URLs of every slice, in order.
+
+    Slices are encoded in parallel through the slice cache, so /api/slice
+    requests with the same settings reuse them.
+    """
+    settings = PNG_COMPRESSION_PRESETS[png_compression]
+
+    def encode(i):
+        encoded, _ = encode_stored_slice(
+            image_id, i, compress_level=settings["compress_level"], optimize=settings["optimize"]
+        )
+        return f"data:image/png;base64,{base64.b64encode(encoded).decode('utf-8')}"
+
+    return encode_in_parallel(encode, total_slices)
+
+@router.post("/upload", openapi_extra=UPLOAD_OPENAPI_EXTRA)
+async def upload_file(request: Request, http_response: Response, include_slices: bool = False,
+                      png_compression: str = PNG_COMPRESSION):
+    """
+    Upload and process an image file.
+
+    The body is streamed to disk in chunks and rejected with 413 once it
+    passes MAX_UPLOAD_SIZE. .nii.gz files are decompressed while they arrive.
+    Only the volume and its statistics are computed here; slices are
+    rendered and encoded when /api/slice requests them. include_slices=true
+    also returns every slice as a PNG data URL in "slices", encoded in
+    parallel; png_compression (speed, balanced or ratio) picks the PNG
+    settings.
+
+    The image belongs to the caller's session (one is started if the
+    request has none) and is released when the session expires or the
+    study is closed.
+    """
+    validate_png_compression(png_compression)
+    session_id = await ensure_session(request, http_response)
+    upload = None
+    try:
+        upload = await receive_upload(request, gunzip=True)
+        suffix = upload.suffix
+
+        # Log file information
+        logger.info(f"Receiving file: {upload.filename}")
+
+        try:
+            if upload.bytes_received == 0:
                 raise HTTPException(status_code=400, detail="Empty file uploaded")
-            
-            temp_file.write(content)
-            temp_file.flush()
-            temp_file.close()
-            
+
             image_id = str(uuid.uuid4())
             logger.info(f"Processing file with ID: {image_id}")
             
             try:
-                data = None
-                total_slices = 1
-                
-                # Try loading as NIfTI first
-                if suffix in ['.nii', '.gz']:
-                    logger.info("Loading NIfTI file")
-                    try:
-                        img = nib.load(temp_file.name)
-                        # Log NIfTI header information
-                        logger.info(f"NIfTI header: shape={img.shape}, affine={img.affine.shape}, datatype={img.get_data_dtype()}")
-                        
-                        data = img.get_fdata()
-                        data = np.array(data, copy=True)
-                        logger.info(f"Original data shape: {data.shape}, dtype: {data.dtype}, min: {data.min()}, max: {data.max()}")
-                        
-                        # Ensure data is at least 2D
-                        if len(data.shape) < 2:
-                            raise HTTPException(
-                                status_code=400,
-                                detail=f"Invalid NIfTI data: Expected 2D or 3D data, but got {len(data.shape)}D data with shape {data.shape}"
-                            )
-                        
-                        # Handle different dimensionalities
-                        if len(data.shape) == 2:
-                            # 2D data: Keep as is
-                            total_slices = 1
-                            logger.info("Processing as 2D image")
-                        elif len(data.shape) == 3:
-                            # Check if any dimension is 1, which might need squeezing
-                            if 1 in data.shape:
-                                logger.info(f"Found singleton dimension in shape {data.shape}")
-                                data = np.squeeze(data)
-                                logger.info(f"After squeezing: {data.shape}")
-                                total_slices = 1 if len(data.shape) == 2 else data.shape[2]
-                            else:
-                                # Regular 3D data
-                                total_slices = data.shape[2]
-                                logger.info("Processing as 3D volume")
-                        elif len(data.shape) == 4:
-                            # 4D data: Take first volume
-                            logger.info("4D data detected, taking first volume")
-                            data = data[:, :, :, 0]
-                            total_slices = data.shape[2]
-                        else:
-                            raise HTTPException(
-                                status_code=400,
-                                detail=f"Unsupported NIfTI dimensionality: {len(data.shape)}D with shape {data.shape}"
-                            )
-                        
-                        logger.info(f"Final processed data shape: {data.shape}, total_slices: {total_slices}")
-                        
-                        img.uncache()
-                        del img
-                        gc.collect()
-                    except HTTPException:
-                        raise
-                    except Exception as e:
-                        logger.error(f"Error processing NIfTI file", exc_info=True)
-                        raise HTTPException(
-                            status_code=400,
-                            detail=f"Failed to load NIfTI file: {str(e)}"
-                        )
-                    
-                elif suffix == '.dcm':
-                    logger.info("Loading DICOM file")
-                    try:
-                        dcm = pydicom.dcmread(temp_file.name)
-                        data = dcm.pixel_array.copy()
-                        del dcm
-                        gc.collect()
-                    except Exception as e:
-                        raise HTTPException(
-                            status_code=400,
-                            detail=f"Failed to load DICOM file: {str(e)}"
-                        )
-                    
-                else:
-                    logger.info("Loading standard image file")
-                    try:
-                        img = Image.open(temp_file.name)
-                        data = np.array(img)
-                        img.close()
-                        del img
-                        if len(data.shape) == 3 and data.shape[2] in [3, 4]:  # RGB or RGBA
-                            data = np.mean(data, axis=2)
-                    except Exception as e:
-                        raise HTTPException(
-                            status_code=400,
-                            detail=f"Failed to load image file: {str(e)}"
-                        )
-                
-                if data is None:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Failed to load image data: No data was extracted from the file"
-                    )
-                
-                if data.size == 0:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Invalid image: Image contains no data"
-                    )
-                
-                logger.info(f"Data shape: {data.shape}, dtype: {data.dtype}")
-                
-                # Convert data to float32 for processing
-                data = data.astype(np.float32)
-                
-                # Calculate optimal window settings
-                window_width, window_center = calculate_optimal_window_settings(data)
+                (data, total_slices, window_presets, data_min, data_max,
+                 voxel_dimensions, content_hash) = await run_blocking(
+                    "upload", _process_upload, upload.path, suffix, upload.sha256
+                )
+                window_width = window_presets["auto"]["window_width"]
+                window_center = window_presets["auto"]["window_center"]
                 logger.info(f"Window settings - Width: {window_width}, Center: {window_center}")
                 
-                # Precompute normalized slices with consistent normalization
-                normalized_slices, data_min, data_max = precompute_normalized_slices(data)
-                logger.info(f"Normalized {len(normalized_slices)} slices")
-                
-                if not normalized_slices:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Failed to normalize image data"
-                    )
-                
-                # Convert normalized slices to base64
-                all_slices = []
-                for i, normalized in enumerate(normalized_slices):
-                    img_byte_arr = io.BytesIO()
-                    Image.fromarray(normalized).save(img_byte_arr, format='PNG', optimize=True)
-                    img_base64 = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
-                    all_slices.append(f"data:image/png;base64,{img_base64}")
-                    logger.info(f"Processed slice {i+1}/{len(normalized_slices)}")
-                
-                # Store data in memory
-                image_storage[image_id] = {
+                # Store data in the shared image store
+                image_storage.put(image_id, {
                     'data': data,
                     'window_width': float(window_width),
                     'window_center': float(window_center),
                     'total_slices': total_slices,
                     'data_min': float(data_min),
                     'data_max': float(data_max),
-                    'normalized_slices': normalized_slices
-                }
+                    'window_presets': window_presets,
+                    'voxel_dimensions': voxel_dimensions,
+                    'content_hash': content_hash
+                }, session_id=session_id)
                 
                 logger.info("Successfully processed and stored image")
-                return {
+                response = {
                     "status": "success",
-                    "slices": all_slices,
                     "image_id": image_id,
                     "total_slices": total_slices,
                     "window_width": float(window_width),
-                    "window_center": float(window_center)
+                    "window_center": float(window_center),
+                    "window_presets": window_presets
                 }
+                if include_slices:
+                    # Encoded through the slice cache, so later /api/slice requests reuse them
+                    response["slices"] = await run_blocking(
+                        "render", _encode_all_slices, image_id, total_slices, png_compression
+                    )
+                return response
 
             except HTTPException:
                 raise
@@ -232,22 +278,9 @@ async def upload_file(file: UploadFile = File(...)):
             )
         
     finally:
-        if temp_file and os.path.exists(temp_file.name):
+        if upload and os.path.exists(upload.path):
             try:
-                os.unlink(temp_file.name)
+                os.unlink(upload.path)
                 logger.info("Cleaned up temporary file")
             except Exception as e:
                 logger.error(f"Error cleaning up temp file: {str(e)}")
-
-
-
-def process_nifti_file(file_path):
-    img = nib.load(file_path)
-    data = img.get_fdata()
-    return data
-
-def process_dicom_file(file_path):
-    dcm = pydicom.dcmread(file_path)
-    return dcm.pixel_array
-
-
@@ -1,3 +1,5 @@
  # Import utilities for easier access
 from .file_handling import process_file, process_nifti_file, process_dicom_file, process_image_file
-from .image_processing import normalize_data, precompute_normalized_slices, apply_window_level
+from .file_handling import read_nifti_data, LazyNiftiVolume
+from .image_processing import normalize_data, apply_window_level, window_level_to_uint8
+from .dicom_series import load_dicom_series, scan_series
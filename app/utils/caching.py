@@ -0,0 +1,201 @@
+import os
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+from app.config import VOLUME_CACHE_MAX_BYTES, RENDERED_SLICE_CACHE_MAX_BYTES, ENCODED_SLICE_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# All caches by name, for reporting
+_caches = {}
+
+
+def value_nbytes(value):
+    """Estimate the memory held by a cached value (arrays, bytes and containers of them)."""
+    if isinstance(value, np.memmap):
+        # Pages of a memory map belong to the page cache, not to us
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(value_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(value_nbytes(item) for item in value)
+    return 0
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache bounded by a byte budget.
+
+    Keeps hit, miss and eviction counters. Values larger than the whole
+    budget are returned to the caller but not cached.
+    """
+
+    def __init__(self, name, max_bytes):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+        _caches[name] = self
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes=None):
+        if nbytes is None:
+            nbytes = value_nbytes(value)
+        if nbytes > self.max_bytes:
+            logger.info(f"{self.name}: value of {nbytes} bytes exceeds the cache budget, not caching")
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached value for key, calling loader() on a miss.
+
+        Concurrent misses for the same key wait for a single load. A loader
+        result of None is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    # Loaded by another request while we waited
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+            try:
+                value = loader()
+                if value is not None:
+                    self.put(key, value)
+                return value
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self.current_bytes -= entry[1]
+            return entry[0]
+
+    def discard_where(self, predicate):
+        """Remove every entry whose key matches predicate(key). Returns the count removed."""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self.current_bytes -= self._entries.pop(key)[1]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+def cache_stats():
+    """Counters of every cache in the process, by name."""
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+# Decoded volumes shared by /api/load, /upload and /api/upload
+volume_cache = LRUCache("volumes", VOLUME_CACHE_MAX_BYTES)
+
+# uint8 slices rendered for a window, keyed by (image_id, slice, center, width)
+rendered_slice_cache = LRUCache("rendered_slices", RENDERED_SLICE_CACHE_MAX_BYTES)
+
+# Encoded slices, keyed like rendered_slice_cache plus the encoder settings
+encoded_slice_cache = LRUCache("encoded_slices", ENCODED_SLICE_CACHE_MAX_BYTES)
+
+
+def file_cache_key(file_path):
+    """Cache key for a file on disk; changes whenever the file is rewritten."""
+    stat = os.stat(file_path)
+    return ("file", os.path.realpath(file_path), stat.st_mtime_ns, stat.st_size)
+
+
+def content_cache_key(namespace, digest, suffix):
+    """
+    Cache key for uploaded content identified by its hash.
+
+    The namespace separates decoders that produce different arrays from
+    the same bytes.
+    """
+    return ("content", namespace, digest, suffix)
+
+
+def load_cached_volume(key, loader):
+    """
+    Return (data, metadata) for a volume, decoding it at most once.
+
+    loader() must return (data, metadata) or (None, None). Cached arrays
+    are made read-only because every caller shares the same buffer.
+    """
+    def load():
+        data, metadata = loader()
+        if data is None:
+            return None
+        if isinstance(data, np.ndarray):
+            data.flags.writeable = False
+        return data, metadata
+
+    result = volume_cache.get_or_load(key, load)
+    if result is None:
+        return None, None
+    data, metadata = result
+    return data, dict(metadata)
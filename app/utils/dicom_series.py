@@ -0,0 +1,165 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pydicom
+from pydicom.errors import InvalidDicomError
+from app.config import DICOM_LOAD_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+class SeriesFile:
+    """Header fields of one DICOM file needed to place it in its series."""
+
+    def __init__(self, path, ds):
+        self.path = path
+        self.series_uid = str(ds.SeriesInstanceUID)
+        self.rows = int(ds.Rows)
+        self.columns = int(ds.Columns)
+        self.instance_number = int(ds.get('InstanceNumber', 0) or 0)
+        self.position = [float(v) for v in ds.ImagePositionPatient] if 'ImagePositionPatient' in ds else None
+        self.orientation = [float(v) for v in ds.ImageOrientationPatient] if 'ImageOrientationPatient' in ds else None
+        self.pixel_spacing = [float(v) for v in ds.PixelSpacing] if 'PixelSpacing' in ds else [1.0, 1.0]
+        self.slice_thickness = float(ds.SliceThickness) if ds.get('SliceThickness') else None
+        self.spacing_between_slices = float(ds.SpacingBetweenSlices) if ds.get('SpacingBetweenSlices') else None
+        self.modality = str(ds.get('Modality', ''))
+        self.description = str(ds.get('SeriesDescription', ''))
+
+
+def _read_header(path):
+    """Read a file's header without pixel data; None if it is not an image DICOM file."""
+    try:
+        ds = pydicom.dcmread(path, stop_before_pixels=True)
+        if 'SeriesInstanceUID' not in ds or 'Rows' not in ds or 'Columns' not in ds:
+            return None
+        # Multi-frame files are volumes of their own, not slices of a series
+        if int(ds.get('NumberOfFrames', 1) or 1) > 1:
+            return None
+        return SeriesFile(path, ds)
+    except (InvalidDicomError, OSError, AttributeError, ValueError):
+        return None
+
+
+def _list_files(directory):
+    with os.scandir(directory) as entries:
+        return sorted(entry.path for entry in entries
+                      if entry.is_file() and not entry.name.startswith('.'))
+
+
+def scan_series(directory, max_workers=DICOM_LOAD_WORKERS):
+    """Group the DICOM files in a directory by SeriesInstanceUID, reading headers only."""
+    paths = _list_files(directory)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        headers = [h for h in pool.map(_read_header, paths) if h is not None]
+
+    series = {}
+    for header in headers:
+        series.setdefault(header.series_uid, []).append(header)
+    logger.info(f"Found {len(series)} series in {len(headers)} DICOM files under {directory}")
+    return series
+
+
+def describe_series(series):
+    """Summaries of scanned series, largest first."""
+    summaries = [
+        {
+            "series_uid": uid,
+            "modality": files[0].modality,
+            "description": files[0].description,
+            "total_slices": len(files),
+            "dimensions": [files[0].rows, files[0].columns]
+        }
+        for uid, files in series.items()
+    ]
+    return sorted(summaries, key=lambda s: s["total_slices"], reverse=True)
+
+
+def _sort_slices(files):
+    """
+    Order slices along the slice normal and return (files, slice spacing).
+
+    Positions are projected onto the normal of ImageOrientationPatient, so
+    spacing comes from the actual slice positions rather than SliceThickness.
+    Falls back to InstanceNumber when positions are missing.
+    """
+    first = files[0]
+    if first.orientation is not None and all(f.position is not None for f in files):
+        row_cosines = np.array(first.orientation[:3])
+        col_cosines = np.array(first.orientation[3:])
+        normal = np.cross(row_cosines, col_cosines)
+        distances = [float(np.dot(normal, f.position)) for f in files]
+        order = np.argsort(distances)
+        files = [files[i] for i in order]
+        sorted_distances = np.array(distances)[order]
+        if len(files) > 1:
+            gaps = np.diff(sorted_distances)
+            gaps = gaps[gaps > 1e-6]
+            if len(gaps):
+                return files, float(np.median(gaps))
+    else:
+        files = sorted(files, key=lambda f: f.instance_number)
+
+    fallback = first.spacing_between_slices or first.slice_thickness or 1.0
+    return files, float(fallback)
+
+
+def _decode_into(volume, index, path):
+    """Decode one file's pixel data, rescaled, into volume[index]."""
+    ds = pydicom.dcmread(path)
+    pixels = ds.pixel_array
+    slope = float(ds.get('RescaleSlope', 1) or 1)
+    intercept = float(ds.get('RescaleIntercept', 0) or 0)
+    out = volume[index]
+    out[...] = pixels
+    if slope != 1:
+        out *= slope
+    if intercept != 0:
+        out += intercept
+
+
+def load_dicom_series(directory, series_uid=None, max_workers=DICOM_LOAD_WORKERS):
+    """
+    Assemble a DICOM series from a directory of single-slice files.
+
+    Headers are read first to group and sort the files, then pixel data is
+    decoded across a thread pool straight into one preallocated volume. With
+    no series_uid the series with the most slices is loaded.
+
+    Returns (data, metadata) with data shaped (rows, cols, slices) like the
+    other loaders.
+    """
+    series = scan_series(directory, max_workers=max_workers)
+    if not series:
+        raise ValueError(f"No DICOM image files found in {directory}")
+
+    if series_uid is None:
+        series_uid = max(series, key=lambda uid: len(series[uid]))
+    elif series_uid not in series:
+        raise KeyError(f"Series {series_uid} not found in {directory}")
+
+    files, slice_spacing = _sort_slices(series[series_uid])
+    rows, columns = files[0].rows, files[0].columns
+    if any(f.rows != rows or f.columns != columns for f in files):
+        raise ValueError(f"Series {series_uid} mixes slice sizes")
+
+    # Slice-major so each worker writes one contiguous block
+    volume = np.empty((len(files), rows, columns), dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(_decode_into, volume, i, f.path) for i, f in enumerate(files)]
+        for future in futures:
+            future.result()
+
+    data = volume[0] if len(files) == 1 else np.moveaxis(volume, 0, 2)
+    metadata = {
+        "dimensions": [rows, columns],
+        "total_slices": len(files),
+        "min_value": float(np.min(volume)),
+        "max_value": float(np.max(volume)),
+        "voxel_dimensions": [files[0].pixel_spacing[0], files[0].pixel_spacing[1], slice_spacing],
+        "series_uid": series_uid,
+        "modality": files[0].modality,
+        "series": describe_series(series)
+    }
+    logger.info(f"Loaded series {series_uid}: {len(files)} slices of {rows}x{columns}")
+    return data, metadata
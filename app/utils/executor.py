@@ -0,0 +1,183 @@
+import asyncio
+import functools
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from fastapi import HTTPException
+from app.config import (
+    EXECUTOR_THREAD_WORKERS, EXECUTOR_PROCESS_WORKERS, EXECUTOR_LIMITS, EXECUTOR_RETRY_AFTER
+)
+
+logger = logging.getLogger(__name__)
+
+# Limits of operations not listed in EXECUTOR_LIMITS, as (concurrency, queue depth)
+DEFAULT_LIMITS = (EXECUTOR_THREAD_WORKERS, 4 * EXECUTOR_THREAD_WORKERS)
+
+
+def parse_limits(spec):
+    """Parse "name=concurrency:queue,..." into {name: (concurrency, queue)}."""
+    limits = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, values = item.partition('=')
+        concurrency, _, queue = values.partition(':')
+        limits[name.strip()] = (max(1, int(concurrency)), max(0, int(queue or 0)))
+    return limits
+
+
+class Operation:
+    """
+    Admission control for one kind of heavy work.
+
+    At most concurrency calls run at once and at most max_queue more wait
+    for a slot; anything beyond that is rejected straight away with 503 so
+    the client can retry instead of piling onto the worker.
+    """
+
+    def __init__(self, name, concurrency, max_queue):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(self, pool, func):
+        if self.running + self.waiting >= self.concurrency + self.max_queue:
+            self.rejected += 1
+            logger.warning(f"Rejecting {self.name}: {self.running} running, {self.waiting} queued")
+            raise HTTPException(
+                status_code=503,
+                detail=f"Server busy with {self.name} requests, retry shortly",
+                headers={"Retry-After": str(EXECUTOR_RETRY_AFTER)}
+            )
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, func)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+
+class _ProcessHTTPError(Exception):
+    """Picklable stand-in for an HTTPException raised in a worker process."""
+
+    def __init__(self, status_code, detail, headers):
+        super().__init__(status_code, detail, headers)
+        self.status_code = status_code
+        self.detail = detail
+        self.headers = headers
+
+
+def _call_in_process(func):
+    # HTTPException cannot be unpickled, and a failed unpickle breaks the whole pool
+    try:
+        return func()
+    except HTTPException as e:
+        raise _ProcessHTTPError(e.status_code, e.detail, e.headers)
+
+
+class WorkerPools:
+    """
+    Thread and process pools that run blocking work off the event loop.
+
+    Threads suit NumPy, PIL, nibabel and SimpleITK calls that release the
+    GIL; the process pool is for pure-Python or GIL-bound work and is only
+    started on first use. Arguments of process work must be picklable.
+    Every operation gets its own thread pool sized to its concurrency, so
+    a burst of one kind of work never queues another behind it.
+    """
+
+    def __init__(self, thread_workers=EXECUTOR_THREAD_WORKERS, process_workers=EXECUTOR_PROCESS_WORKERS,
+                 limits=EXECUTOR_LIMITS):
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self.limits = parse_limits(limits)
+        self._threads = {}
+        self._processes = None
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def operation(self, name):
+        with self._lock:
+            if name not in self._operations:
+                concurrency, max_queue = self.limits.get(name, DEFAULT_LIMITS)
+                self._operations[name] = Operation(name, concurrency, max_queue)
+            return self._operations[name]
+
+    def _thread_pool(self, operation):
+        with self._lock:
+            if operation.name not in self._threads:
+                self._threads[operation.name] = ThreadPoolExecutor(
+                    max_workers=operation.concurrency, thread_name_prefix=f"worker-{operation.name}"
+                )
+            return self._threads[operation.name]
+
+    def _process_pool(self):
+        with self._lock:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(max_workers=self.process_workers)
+            return self._processes
+
+    async def run(self, operation, func, *args, process=False, **kwargs):
+        """
+        Run func(*args, **kwargs) in a pool under the limits of operation.
+
+        Raises HTTPException 503 with Retry-After when the operation is
+        saturated. process=True uses the process pool when one is configured.
+        """
+        call = functools.partial(func, *args, **kwargs)
+        operation = self.operation(operation)
+        if not (process and self.process_workers > 0):
+            return await operation.run(self._thread_pool(operation), call)
+        try:
+            return await operation.run(
+                self._process_pool(), functools.partial(_call_in_process, call)
+            )
+        except _ProcessHTTPError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers)
+
+    def stats(self):
+        with self._lock:
+            operations = dict(self._operations)
+        return {
+            "thread_workers": sum(op.concurrency for op in operations.values()),
+            "process_workers": self.process_workers,
+            "operations": {name: op.stats() for name, op in operations.items()}
+        }
+
+    def shutdown(self):
+        with self._lock:
+            pools = list(self._threads.values())
+        for pool in pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+
+
+worker_pools = WorkerPools()
+
+
+async def run_blocking(operation, func, *args, process=False, **kwargs):
+    """Shortcut for worker_pools.run()."""
+    return await worker_pools.run(operation, func, *args, process=process, **kwargs)
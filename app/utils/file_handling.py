@@ -1,4 +1,6 @@
 import nibabel as nib
+from nibabel.openers import ImageOpener
+from nibabel.volumeutils import apply_read_scaling
 import pydicom
 import numpy as np
 from PIL import Image
@@ -44,3 +46,135 @@ def process_image_file(file_path):
     if data.ndim == 3:  # Convert RGB to grayscale if needed
         data = np.mean(data, axis=2)
     return data
+
+def read_nifti_data(img, keep_integers=False):
+    """
+    Read NIfTI voxel data as float32.
+
+    Reads through the array proxy so no float64 copy of the volume is made.
+    Only the first time point of 4D data is read. With keep_integers,
+    integer data stored without scaling keeps its type (in native byte
+    order) instead, at a fraction of the memory.
+    """
+    slicer = (slice(None),) * min(len(img.shape), 3) + (0,) * max(len(img.shape) - 3, 0)
+    dtype = img.get_data_dtype()
+    unscaled = getattr(img.dataobj, "slope", 1.0) == 1.0 and getattr(img.dataobj, "inter", 0.0) == 0.0
+    if keep_integers and np.issubdtype(dtype, np.integer) and unscaled:
+        return np.asarray(img.dataobj[slicer], dtype=dtype.newbyteorder('='))
+    return np.asarray(img.dataobj[slicer], dtype=np.float32)
+
+# Suffixes of files nibabel decompresses while reading
+_COMPRESSED_SUFFIXES = tuple(ext for ext in ImageOpener.compress_ext_map if ext)
+
+class LazyNiftiVolume:
+    """
+    Header-only handle on a NIfTI file that reads slices on demand.
+
+    Uncompressed .nii files are memory-mapped. Compressed files can only
+    be decompressed from the start, so their slices are read from one
+    forward-only stream: reading them in order decompresses the file once,
+    and only going back to an earlier slice starts over. The full volume
+    is never materialized.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = str(file_path)
+        self.img = nib.load(self.file_path, mmap=True)
+        self.header = self.img.header
+
+        shape = self.img.shape
+        if len(shape) < 2:
+            raise ValueError(f"Expected 2D or 3D NIfTI data, got shape {shape}")
+        self.dimensions = [int(shape[0]), int(shape[1])]
+        self.total_slices = int(shape[2]) if len(shape) > 2 else 1
+        # Time points and higher dimensions are fixed at their first index
+        self._extra_index = (0,) * max(len(shape) - 3, 0)
+        self.compressed = self.file_path.lower().endswith(_COMPRESSED_SUFFIXES)
+        self._stream = None
+        self._next_index = 0
+
+        zooms = self.header.get_zooms()
+        self.voxel_dimensions = [
+            float(zooms[0]),
+            float(zooms[1]),
+            float(zooms[2]) if len(zooms) > 2 else 1.0
+        ]
+
+    @property
+    def shape(self):
+        """Shape of the volume as (rows, cols, slices)."""
+        return (self.dimensions[0], self.dimensions[1], self.total_slices)
+
+    @property
+    def dtype(self):
+        return self.header.get_data_dtype()
+
+    def get_slice(self, index):
+        """Read a single slice as a float32 array of shape (rows, cols)."""
+        if index < 0 or index >= self.total_slices:
+            raise IndexError(f"Slice {index} out of range (0-{self.total_slices - 1})")
+        if self.compressed:
+            return self._read_streamed(index)
+        if len(self.img.shape) == 2:
+            slicer = (slice(None), slice(None))
+        else:
+            slicer = (slice(None), slice(None), index) + self._extra_index
+        return np.asarray(self.img.dataobj[slicer], dtype=np.float32)
+
+    def _read_streamed(self, index):
+        """Read slice index of a compressed file, continuing the open stream when it is not behind."""
+        proxy = self.img.dataobj
+        rows, cols = self.dimensions
+        slice_bytes = rows * cols * proxy.dtype.itemsize
+        if self._stream is None or index < self._next_index:
+            self.close()
+            self._stream = ImageOpener(self.file_path)
+            self._stream.seek(proxy.offset)
+            self._next_index = 0
+        if index > self._next_index:
+            # Slices are stored one after the other (Fortran order), so skipping is reading ahead
+            self._stream.seek((index - self._next_index) * slice_bytes, 1)
+        raw = np.frombuffer(self._stream.read(slice_bytes), dtype=proxy.dtype).reshape((rows, cols), order="F")
+        self._next_index = index + 1
+        if self._next_index == self.total_slices:
+            self.close()
+        return np.asarray(apply_read_scaling(raw, proxy.slope, proxy.inter), dtype=np.float32)
+
+    def iter_slices(self):
+        for index in range(self.total_slices):
+            yield self.get_slice(index)
+
+    def close(self):
+        """Close the decompression stream of a compressed file, if one is open."""
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def get_preview(self, in_plane_stride, slice_stride):
+        """
+        Read every in_plane_stride-th row/column of every slice_stride-th slice.
+
+        Only the sampled voxels are converted to float32, so the result costs
+        a fraction of the full volume; the shape is (rows, cols, slices) or
+        (rows, cols) for 2D data.
+        """
+        rows = cols = slice(None, None, in_plane_stride)
+        if len(self.img.shape) == 2:
+            slicer = (rows, cols)
+        else:
+            slicer = (rows, cols, slice(None, None, slice_stride)) + self._extra_index
+        return np.asarray(self.img.dataobj[slicer], dtype=np.float32)
+
+    def metadata(self):
+        """Metadata available from the header alone."""
+        cal_min = float(self.header['cal_min'])
+        cal_max = float(self.header['cal_max'])
+        has_range = cal_max > cal_min
+        return {
+            "dimensions": self.dimensions,
+            "total_slices": self.total_slices,
+            "dtype": str(self.dtype),
+            "min_value": cal_min if has_range else None,
+            "max_value": cal_max if has_range else None,
+            "voxel_dimensions": self.voxel_dimensions
+        }
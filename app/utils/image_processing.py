@@ -1,13 +1,344 @@
 import numpy as np
 import logging
+import time
 import SimpleITK as sitk
 import traceback
+from app.config import WINDOW_HISTOGRAM_BINS, WINDOW_SAMPLE_MAX_VOXELS
 
 logger = logging.getLogger(__name__)
 
+# Multi-resolution settings of each registration preset. Level i averages
+# the images over shrink_factors[i] voxels and smooths them by
+# smoothing_sigmas[i] mm; "full" is a single full-resolution level.
+# gradient_filters precomputes gradient images of both volumes for the
+# metric, as the baseline "full" registration always did; with sparse
+# sampling the coarse presets compute gradients at the sampled points.
+REGISTRATION_PRESETS = {
+    "fast": {
+        "shrink_factors": [4, 2],
+        "smoothing_sigmas": [2.0, 1.0],
+        "iterations": 100,
+        "sampling_percentage": 0.05,
+        "histogram_bins": 32,
+        "gradient_filters": False
+    },
+    "balanced": {
+        "shrink_factors": [4, 2, 1],
+        "smoothing_sigmas": [2.0, 1.0, 0.0],
+        "iterations": 100,
+        "sampling_percentage": 0.02,
+        "histogram_bins": 50,
+        "gradient_filters": False
+    },
+    "accurate": {
+        "shrink_factors": [8, 4, 2, 1],
+        "smoothing_sigmas": [3.0, 2.0, 1.0, 0.0],
+        "iterations": 100,
+        "sampling_percentage": 0.05,
+        "histogram_bins": 50,
+        "gradient_filters": False
+    },
+    "full": {
+        "shrink_factors": [1],
+        "smoothing_sigmas": [0.0],
+        "iterations": 200,
+        "sampling_percentage": 0.01,
+        "histogram_bins": 50,
+        "gradient_filters": True
+    }
+}
+
+# Fraction of voxels sampled by the B-spline metric of deformable registration
+BSPLINE_SAMPLING_PERCENTAGE = 0.1
+
+def validate_registration_preset(preset):
+    if preset not in REGISTRATION_PRESETS:
+        raise ValueError(
+            f"Unsupported registration preset: {preset}. Expected one of {', '.join(REGISTRATION_PRESETS)}"
+        )
+
+def _with_threads(image_filter, threads):
+    """Limit a SimpleITK filter to threads threads; None keeps the global default."""
+    if threads:
+        image_filter.SetNumberOfThreads(threads)
+    return image_filter
+
+def pyramid_level(image: sitk.Image, shrink_factor: int, smoothing_sigma: float, threads: int = None) -> sitk.Image:
+    """
+    One level of a registration pyramid: image averaged over shrink_factor
+    voxel bins, then smoothed by smoothing_sigma mm.
+
+    Shrinking first keeps the smoothing cost proportional to the level's
+    size rather than the full volume's. Axes too short to shrink that far
+    are shrunk less.
+    """
+    factors = [max(1, min(shrink_factor, size // 4)) for size in image.GetSize()]
+    if max(factors) > 1:
+        shrink = _with_threads(sitk.BinShrinkImageFilter(), threads)
+        shrink.SetShrinkFactors(factors)
+        image = shrink.Execute(image)
+    if smoothing_sigma > 0:
+        smoothing = _with_threads(sitk.SmoothingRecursiveGaussianImageFilter(), threads)
+        smoothing.SetSigma(smoothing_sigma)
+        image = smoothing.Execute(image)
+    return image
+
+def registration_pyramid(image: sitk.Image, preset: str, threads: int = None) -> list:
+    """The pyramid levels of image for a preset, e.g. to share one fixed image between registrations."""
+    settings = REGISTRATION_PRESETS[preset]
+    return [
+        pyramid_level(image, shrink_factor, smoothing_sigma, threads)
+        for shrink_factor, smoothing_sigma in zip(settings["shrink_factors"], settings["smoothing_sigmas"])
+    ]
+
+def _rigid_registration_method(settings, transform, threads=None):
+    """Registration method optimizing transform in place with the metric and optimizer of a preset."""
+    registration_method = _with_threads(sitk.ImageRegistrationMethod(), threads)
+
+    # Set up similarity metric - using Mutual Information for robustness
+    registration_method.SetMetricAsMattesMutualInformation(numberOfHistogramBins=settings["histogram_bins"])
+    registration_method.SetMetricSamplingStrategy(registration_method.RANDOM)
+    registration_method.SetMetricSamplingPercentage(settings["sampling_percentage"])
+    registration_method.SetMetricUseFixedImageGradientFilter(settings["gradient_filters"])
+    registration_method.SetMetricUseMovingImageGradientFilter(settings["gradient_filters"])
+
+    # Set the interpolator
+    registration_method.SetInterpolator(sitk.sitkLinear)
+
+    # Set up optimizer with more iterations and finer control
+    registration_method.SetOptimizerAsGradientDescent(
+        learningRate=1.0,
+        numberOfIterations=settings["iterations"],
+        convergenceMinimumValue=1e-7,  # More strict convergence
+        convergenceWindowSize=10
+    )
+    registration_method.SetOptimizerScalesFromPhysicalShift()
+
+    # Set the initial transform and enable optimization of transform parameters
+    registration_method.SetInitialTransform(transform, inPlace=True)
+
+    # Set up transform to optimize
+    registration_method.SetMovingInitialTransform(sitk.TranslationTransform(3))
+    registration_method.SetFixedInitialTransform(sitk.TranslationTransform(3))
+    return registration_method
+
+def estimate_rigid_transform(fixed_image: sitk.Image, moving_image: sitk.Image,
+                             preset: str = "full", observer=None, threads: int = None,
+                             fixed_levels: list = None):
+    """
+    Optimize a rigid Euler3D transform mapping fixed_image onto moving_image.
+
+    The optimization runs coarse to fine over the levels of the preset,
+    each level starting from the transform of the previous one. observer,
+    if given, is called as observer(method, level) on every optimizer
+    iteration; returning True stops the registration, skipping the
+    remaining levels. threads limits every SimpleITK filter involved.
+    fixed_levels, from registration_pyramid, saves rebuilding the fixed
+    image's pyramid when it is registered against several moving images.
+
+    Returns:
+        (transform, report) where report holds the preset, the final
+        metric value, the stop condition and the iterations, metric
+        value and seconds of each level.
+    """
+    validate_registration_preset(preset)
+    settings = REGISTRATION_PRESETS[preset]
+
+    # Set up initial transform with physical space consideration
+    transform = sitk.Euler3DTransform(sitk.CenteredTransformInitializer(
+        fixed_image,
+        moving_image,
+        sitk.Euler3DTransform(),
+        sitk.CenteredTransformInitializerFilter.GEOMETRY
+    ))
+
+    logger.info(f"Starting registration optimization with preset {preset}...")
+    start = time.perf_counter()
+    levels = []
+    stopped = False
+    registration_method = None
+
+    for index, (shrink_factor, smoothing_sigma) in enumerate(
+            zip(settings["shrink_factors"], settings["smoothing_sigmas"])):
+        level_start = time.perf_counter()
+        if fixed_levels is not None:
+            fixed_level = fixed_levels[index]
+        else:
+            fixed_level = pyramid_level(fixed_image, shrink_factor, smoothing_sigma, threads)
+        moving_level = pyramid_level(moving_image, shrink_factor, smoothing_sigma, threads)
+        registration_method = _rigid_registration_method(settings, transform, threads)
+        level = {
+            "level": index,
+            "shrink_factor": shrink_factor,
+            "smoothing_sigma": smoothing_sigma,
+            "size": list(fixed_level.GetSize()),
+            "iterations": 0,
+            "metric_value": None
+        }
+
+        # Add observers to print iteration info
+        def command_iteration(method, level=level, index=index):
+            nonlocal stopped
+            logger.debug(f"Iteration: {method.GetOptimizerIteration()}")
+            logger.debug(f"Metric value: {method.GetMetricValue()}")
+            level["iterations"] = method.GetOptimizerIteration() + 1
+            level["metric_value"] = method.GetMetricValue()
+            if observer is not None and observer(method, index):
+                stopped = True
+                method.StopRegistration()
+
+        registration_method.AddCommand(sitk.sitkIterationEvent,
+                                       lambda method=registration_method: command_iteration(method))
+
+        # Perform registration
+        registration_method.Execute(fixed_level, moving_level)
+        level["seconds"] = time.perf_counter() - level_start
+        levels.append(level)
+        logger.info(f"Registration level {index} (shrink {shrink_factor}): "
+                    f"{level['iterations']} iterations in {level['seconds']:.2f}s")
+        if stopped:
+            logger.info("Registration stopped by its observer")
+            break
+
+    report = {
+        "preset": preset,
+        "final_metric_value": registration_method.GetMetricValue(),
+        "stop_condition": "Stopped by observer" if stopped else registration_method.GetOptimizerStopConditionDescription(),
+        "seconds": time.perf_counter() - start,
+        "levels": levels
+    }
+    logger.info(f"Registration completed in {report['seconds']:.2f}s")
+    return transform, report
+
+def _bspline_registration_method(transform, iterations, threads=None):
+    """Registration method optimizing a B-spline transform in place."""
+    registration_method = _with_threads(sitk.ImageRegistrationMethod(), threads)
+    registration_method.SetMetricAsMattesMutualInformation(numberOfHistogramBins=32)
+    # ITK evaluates the B-spline's parameter Jacobian densely, so each
+    # iteration costs sampled points x control points: keep both small
+    registration_method.SetMetricSamplingStrategy(registration_method.RANDOM)
+    registration_method.SetMetricSamplingPercentage(BSPLINE_SAMPLING_PERCENTAGE)
+    registration_method.SetMetricUseFixedImageGradientFilter(False)
+    registration_method.SetMetricUseMovingImageGradientFilter(False)
+    registration_method.SetInterpolator(sitk.sitkLinear)
+    registration_method.SetOptimizerAsLBFGSB(
+        gradientConvergenceTolerance=1e-5,
+        numberOfIterations=iterations,
+        maximumNumberOfCorrections=5,
+        maximumNumberOfFunctionEvaluations=4 * iterations,
+        costFunctionConvergenceFactor=1e7
+    )
+    registration_method.SetInitialTransform(transform, inPlace=True)
+    return registration_method
+
+def estimate_bspline_transform(fixed_image: sitk.Image, moving_image: sitk.Image, rigid_transform,
+                               grid_size: int = 4, shrink_factor: int = 4, iterations: int = 30,
+                               observer=None, threads: int = None):
+    """
+    Optimize a B-spline deformation on top of a rigid transform.
+
+    The deformation has grid_size mesh cells per axis over the fixed
+    image and is optimized on two levels, the images shrunk by twice
+    shrink_factor and then by shrink_factor (see pyramid_level). At each
+    level the moving image is first resampled through rigid_transform, so
+    the B-spline only models what the rigid transform leaves over.
+    observer and threads work as in estimate_rigid_transform.
+
+    Returns:
+        (transform, bspline, report): the composite applying the B-spline
+        and then rigid_transform, the B-spline alone, and a report with the
+        grid, the final metric value, the stop condition and the
+        iterations, metric value and seconds of each level.
+    """
+    logger.info(f"Starting B-spline registration: grid {grid_size}, shrink {shrink_factor}")
+    start = time.perf_counter()
+    levels = []
+    stopped = False
+    bspline = None
+    registration_method = None
+
+    for index, level_shrink in enumerate([2 * shrink_factor, shrink_factor]):
+        level_start = time.perf_counter()
+        fixed_level = pyramid_level(fixed_image, level_shrink, 0.0, threads)
+        moving_level = _with_threads(sitk.ResampleImageFilter(), threads)
+        moving_level.SetReferenceImage(fixed_level)
+        moving_level.SetTransform(rigid_transform)
+        moving_level.SetInterpolator(sitk.sitkLinear)
+        moving_level.SetOutputPixelType(sitk.sitkFloat32)
+        moving_level = moving_level.Execute(pyramid_level(moving_image, level_shrink, 0.0, threads))
+        if bspline is None:
+            bspline = sitk.BSplineTransformInitializer(fixed_level, [grid_size] * 3, order=3)
+        registration_method = _bspline_registration_method(bspline, iterations, threads)
+        level = {
+            "level": index,
+            "shrink_factor": level_shrink,
+            "size": list(fixed_level.GetSize()),
+            "iterations": 0,
+            "metric_value": None
+        }
+
+        def command_iteration(method, level=level, index=index):
+            nonlocal stopped
+            level["iterations"] = method.GetOptimizerIteration() + 1
+            level["metric_value"] = method.GetMetricValue()
+            if observer is not None and observer(method, index):
+                stopped = True
+                method.StopRegistration()
+
+        registration_method.AddCommand(sitk.sitkIterationEvent,
+                                       lambda method=registration_method: command_iteration(method))
+        registration_method.Execute(fixed_level, moving_level)
+        level["seconds"] = time.perf_counter() - level_start
+        levels.append(level)
+        logger.info(f"B-spline level {index} (shrink {level_shrink}): "
+                    f"{level['iterations']} iterations in {level['seconds']:.2f}s")
+        if stopped:
+            logger.info("B-spline registration stopped by its observer")
+            break
+
+    report = {
+        "grid_size": grid_size,
+        "shrink_factor": shrink_factor,
+        "iterations": iterations,
+        "final_metric_value": registration_method.GetMetricValue(),
+        "stop_condition": "Stopped by observer" if stopped else registration_method.GetOptimizerStopConditionDescription(),
+        "seconds": time.perf_counter() - start,
+        "levels": levels
+    }
+    logger.info(f"B-spline registration completed in {report['seconds']:.2f}s")
+    # CompositeTransform applies its last transform first
+    return sitk.CompositeTransform([rigid_transform, bspline]), bspline, report
+
+def displacement_magnitude(transform, reference_image: sitk.Image, threads: int = None) -> np.ndarray:
+    """Length in mm of the displacement of transform at every voxel of reference_image, slice-major float32."""
+    to_field = _with_threads(sitk.TransformToDisplacementFieldFilter(), threads)
+    to_field.SetReferenceImage(reference_image)
+    to_field.SetOutputPixelType(sitk.sitkVectorFloat64)
+    field = to_field.Execute(transform)
+    magnitude = sitk.VectorMagnitude(field)
+    return sitk.GetArrayFromImage(magnitude).astype(np.float32)
+
+def resample_to_fixed(moving_image: sitk.Image, fixed_image: sitk.Image, transform,
+                      threads: int = None) -> np.ndarray:
+    """Resample moving_image onto the grid of fixed_image through transform, as a numpy array."""
+    # Apply transform to moving image with proper resampling
+    resampler = _with_threads(sitk.ResampleImageFilter(), threads)
+    resampler.SetReferenceImage(fixed_image)
+    resampler.SetTransform(transform)
+    resampler.SetInterpolator(sitk.sitkLinear)
+    resampler.SetDefaultPixelValue(0.0)
+    resampler.SetOutputPixelType(moving_image.GetPixelID())
+    registered_image = resampler.Execute(moving_image)
+
+    # Convert back to numpy array
+    registered_array = sitk.GetArrayFromImage(registered_image)
+    logger.info(f"Registered image shape: {registered_array.shape}")
+    return registered_array
+
 def register_images(fixed_array: np.ndarray, moving_array: np.ndarray,
                    fixed_image: sitk.Image, moving_image: sitk.Image,
-                   fixed_metadata: dict = None, moving_metadata: dict = None) -> np.ndarray:
+                   fixed_metadata: dict = None, moving_metadata: dict = None,
+                   observer=None, preset: str = "full", report: dict = None) -> np.ndarray:
     """
     Register the moving image to the fixed image using SimpleITK.
 
@@ -18,6 +349,10 @@ def register_images(fixed_array: np.ndarray, moving_array: np.ndarray,
         moving_image: Image to be registered as SimpleITK image
         fixed_metadata: Metadata for fixed image including spacing/thickness
         moving_metadata: Metadata for moving image including spacing/thickness
+        observer: Optional callable taking the registration method and level,
+            called on every optimizer iteration; returning True stops it
+        preset: Name of the REGISTRATION_PRESETS entry to optimize with
+        report: Optional dict, updated with the report of estimate_rigid_transform
 
     Returns:
         Registered image as numpy array
@@ -38,106 +373,120 @@ def register_images(fixed_array: np.ndarray, moving_array: np.ndarray,
             moving_image.SetSpacing(moving_spacing)
             logger.info(f"Set moving image spacing: {moving_spacing}")
 
-        # Initialize the registration method
-        registration_method = sitk.ImageRegistrationMethod()
-
-        # Set up similarity metric - using Mutual Information for robustness
-        registration_method.SetMetricAsMattesMutualInformation(numberOfHistogramBins=50)
-        registration_method.SetMetricSamplingStrategy(registration_method.RANDOM)
-        registration_method.SetMetricSamplingPercentage(0.01)
-
-        # Set the interpolator
-        registration_method.SetInterpolator(sitk.sitkLinear)
-
-        # Set up optimizer with more iterations and finer control
-        registration_method.SetOptimizerAsGradientDescent(
-            learningRate=1.0,
-            numberOfIterations=200,  # Increased iterations
-            convergenceMinimumValue=1e-7,  # More strict convergence
-            convergenceWindowSize=10
+        final_transform, registration_report = estimate_rigid_transform(
+            fixed_image, moving_image, preset, observer
         )
-        registration_method.SetOptimizerScalesFromPhysicalShift()
-
-        # Set up initial transform with physical space consideration
-        initial_transform = sitk.CenteredTransformInitializer(
-            fixed_image,
-            moving_image,
-            sitk.Euler3DTransform(),
-            sitk.CenteredTransformInitializerFilter.GEOMETRY
-        )
-
-        # Set the initial transform and enable optimization of transform parameters
-        registration_method.SetInitialTransform(initial_transform, inPlace=True)
+        if report is not None:
+            report.update(registration_report)
 
-        # Set up transform to optimize
-        registration_method.SetMovingInitialTransform(sitk.TranslationTransform(3))
-        registration_method.SetFixedInitialTransform(sitk.TranslationTransform(3))
-
-        # Add observers to print iteration info
-        def command_iteration(method):
-            logger.debug(f"Iteration: {method.GetOptimizerIteration()}")
-            logger.debug(f"Metric value: {method.GetMetricValue()}")
-
-        registration_method.AddCommand(sitk.sitkIterationEvent, lambda: command_iteration(registration_method))
-
-        logger.info("Starting registration optimization...")
-
-        # Perform registration
-        final_transform = registration_method.Execute(fixed_image, moving_image)
-        logger.info("Registration completed")
-
-        # Apply transform to moving image with proper resampling
-        registered_image = sitk.Resample(
-            moving_image,
-            fixed_image,
-            final_transform,
-            sitk.sitkLinear,
-            0.0,
-            moving_image.GetPixelID()
-        )
-
-        # Convert back to numpy array
-        registered_array = sitk.GetArrayFromImage(registered_image)
-        logger.info(f"Registered image shape: {registered_array.shape}")
-
-        return registered_array
+        return resample_to_fixed(moving_image, fixed_image, final_transform)
 
     except Exception as e:
         logger.error(f"Registration failed: {str(e)}")
         logger.error(traceback.format_exc())
         raise Exception(f"Registration failed: {str(e)}")
 
-def calculate_optimal_window_settings(image_data):
-    """Calculate optimal window width and center based on dynamic histogram analysis."""
-    # Convert to float64 for precise calculations
-    data = image_data.astype(np.float64)
+# Percentile pairs that bound each window preset; "auto" is the default window
+WINDOW_PRESETS = {
+    "auto": (2, 98),
+    "narrow": (5, 95),
+    "wide": (0.5, 99.5),
+    "full": (0, 100)
+}
+
+def _iter_window_blocks(data):
+    """Yield the 2D slices of data, or data itself when it is 2D."""
+    if data.ndim == 3:
+        for i in range(data.shape[2]):
+            yield data[:, :, i]
+    else:
+        yield data
+
+def _finite_range(data):
+    """Min and max over the finite values of data, or None if there are none."""
+    low, high = np.inf, -np.inf
+    for block in _iter_window_blocks(data):
+        block_min, block_max = block.min(), block.max()
+        if not np.isfinite(block_min) or not np.isfinite(block_max):
+            block = block[np.isfinite(block)]
+            if block.size == 0:
+                continue
+            block_min, block_max = block.min(), block.max()
+        low, high = min(low, float(block_min)), max(high, float(block_max))
+    if low > high:
+        return None
+    return low, high
+
+def window_histogram(data, bins=WINDOW_HISTOGRAM_BINS, max_voxels=WINDOW_SAMPLE_MAX_VOXELS):
+    """
+    Fixed-bin histogram of the finite values of data, built one slice at a time.
 
-    # Handle 1D data first
-    if len(data.shape) == 1:
+    Returns (counts, edges), or (None, None) when data holds no finite values.
+    Volumes with more than max_voxels voxels are sampled along the rows,
+    so only about max_voxels values are counted.
+    """
+    if data.ndim == 1:
         size = int(np.sqrt(data.shape[0]))
         data = data.reshape(size, size)
         logger.info(f"Reshaped 1D data to 2D for window calculation: {data.shape}")
 
-    # Remove any NaN or infinite values
-    data = data[np.isfinite(data)]
-
-    if len(data) == 0:
-        return data.max() - data.min(), (data.max() + data.min()) / 2
-
-    # Calculate dynamic percentiles
-    p2 = np.percentile(data, 2)
-    p98 = np.percentile(data, 98)
-
-    # Window width is the range between percentiles
-    window_width = p98 - p2
-
-    # Window center is the midpoint
-    window_center = (p98 + p2) / 2
+    if max_voxels and data.size > max_voxels:
+        stride = -(-data.size // max_voxels)
+        data = data[::stride]
+        logger.info(f"Sampling one row in {stride} for window estimation")
+
+    value_range = _finite_range(data)
+    if value_range is None:
+        return None, None
+    low, high = value_range
+    if high == low:
+        # A constant image is a single zero-width bin
+        count = sum(int(np.count_nonzero(block == low)) for block in _iter_window_blocks(data))
+        return np.array([count]), np.array([low, high])
+
+    counts = np.zeros(bins, dtype=np.int64)
+    for block in _iter_window_blocks(data):
+        # Values outside the range, including NaN and inf, are not counted
+        block_counts, edges = np.histogram(block, bins=bins, range=(low, high))
+        counts += block_counts
+    return counts, edges
+
+def histogram_percentiles(counts, edges, percentiles):
+    """Read percentiles off a histogram's CDF, interpolating linearly inside a bin."""
+    cdf = np.cumsum(counts)
+    total = cdf[-1]
+    values = []
+    for q in percentiles:
+        target = total * q / 100.0
+        index = min(int(np.searchsorted(cdf, target)), len(counts) - 1)
+        below = cdf[index - 1] if index > 0 else 0
+        fraction = (target - below) / counts[index] if counts[index] else 0.0
+        values.append(float(edges[index] + fraction * (edges[index + 1] - edges[index])))
+    return values
+
+def estimate_window_presets(image_data, presets=WINDOW_PRESETS):
+    """
+    Window width and center of every preset from a single histogram pass.
 
-    # Ensure minimum window width
-    window_width = max(window_width, np.finfo(float).eps)
+    Returns a dict mapping preset name to {"window_width", "window_center"}.
+    """
+    counts, edges = window_histogram(image_data)
+    result = {}
+    for name, (low_percentile, high_percentile) in presets.items():
+        if counts is None:
+            window_width, window_center = 1.0, 0.0
+        else:
+            low, high = histogram_percentiles(counts, edges, (low_percentile, high_percentile))
+            # Ensure minimum window width
+            window_width = max(high - low, np.finfo(float).eps)
+            window_center = (high + low) / 2
+        result[name] = {"window_width": float(window_width), "window_center": float(window_center)}
+    return result
 
-    return float(window_width), float(window_center)
+def calculate_optimal_window_settings(image_data):
+    """Calculate window width and center from the 2nd and 98th percentiles of a histogram."""
+    auto = estimate_window_presets(image_data, {"auto": WINDOW_PRESETS["auto"]})["auto"]
+    return auto["window_width"], auto["window_center"]
 
 def apply_window_level(data, window_center, window_width, output_range=(0, 255)):
     """
@@ -206,51 +555,53 @@ def normalize_data(data):
 
     return normalized, data_min, data_max
 
-def precompute_normalized_slices(data, display_range=(0, 255)):
+# Size of the float32 temporary used per block of slices on the float path
+WINDOW_BLOCK_BYTES = 64 * 1024 * 1024
+
+def _window_lut(dtype, window_center, window_width, display_range):
     """
-    Pre-compute normalized slices for 3D data using dynamic windowing.
-    Preserves original bit depth in calculations.
+    Lookup table mapping every value of an 8/16-bit integer dtype to its display value.
+
+    The table is ordered by the unsigned view of the dtype, so signed data
+    can be looked up through data.view(uint8/uint16) without a conversion.
     """
-    # Handle reshaping of 1D data first
-    if len(data.shape) == 1:
-        size = int(np.sqrt(data.shape[0]))
-        data = data.reshape(size, size)
-        logger.info(f"Reshaped 1D data to 2D: {data.shape}")
+    unsigned = np.dtype(f"uint{dtype.itemsize * 8}")
+    values = np.arange(np.iinfo(unsigned).max + 1, dtype=unsigned).view(dtype).astype(np.float64)
+    lut = window_level_to_uint8(values, window_center, window_width, display_range=display_range)
+    return lut, unsigned
 
-    # Calculate window settings based on the entire volume
-    window_width, window_center = calculate_optimal_window_settings(data)
+def window_level_to_uint8(data, window_center, window_width, out=None, display_range=(0, 255)):
+    """
+    Window a whole 2D/3D array into uint8, with the semantics of apply_window_level.
 
-    # Store original data range
-    data_min = float(data.min())
-    data_max = float(data.max())
+    Zero-valued (background) pixels map to display_range[0]. 8/16-bit integer
+    data goes through a lookup table indexed by the pixel value; anything
+    else is windowed in float32 a block of slices at a time. out, if given,
+    must be a uint8 array of data's shape and is filled in place.
+    """
+    if out is None:
+        out = np.empty(data.shape, dtype=np.uint8)
+    low, high = display_range
 
-    normalized_slices = []
+    if np.issubdtype(data.dtype, np.integer) and data.dtype.itemsize <= 2:
+        lut, unsigned = _window_lut(data.dtype, window_center, window_width, display_range)
+        np.take(lut, data.view(unsigned), out=out, mode='clip')
+        return out
 
-    # Handle different dimensionalities
-    if len(data.shape) == 3:
-        # For 3D data, process each slice
-        for i in range(data.shape[2]):
-            slice_data = data[:, :, i]
-            # Normalize to display range while preserving precision
-            normalized = apply_window_level(
-                slice_data, 
-                window_center, 
-                window_width,
-                output_range=display_range
-            )
-            normalized_slices.append(normalized.astype(np.uint8))
-
-    elif len(data.shape) == 2:
-        # For 2D data, process single slice
-        normalized = apply_window_level(
-            data,
-            window_center,
-            window_width,
-            output_range=display_range
-        )
-        normalized_slices.append(normalized.astype(np.uint8))
+    window_min = window_center - window_width / 2
+    scale = np.float32((high - low) / window_width)
+    offset = np.float32(low - window_min * (high - low) / window_width)
+    if data.ndim == 3:
+        step = max(1, WINDOW_BLOCK_BYTES // (data.shape[0] * data.shape[1] * 4))
+        blocks = [np.s_[:, :, i:i + step] for i in range(0, data.shape[2], step)]
     else:
-        raise ValueError(f"Unexpected data dimensionality: {len(data.shape)}D after reshaping")
-
-    # Also return the original data range for reconstruction
-    return normalized_slices, data_min, data_max
\ No newline at end of file
+        blocks = [np.s_[...]]
+    for block in blocks:
+        source = data[block]
+        values = source.astype(np.float32)
+        values *= scale
+        values += offset
+        np.clip(values, low, high, out=values)
+        np.copyto(values, low, where=(source == 0))
+        np.copyto(out[block], values, casting='unsafe')
+    return out
@@ -0,0 +1,538 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from app.config import IMAGE_STORE_MAX_BYTES, IMAGE_STORE_TTL_SECONDS, IMAGE_STORE_DIR, SESSION_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    image_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    fields TEXT NOT NULL,
+    arrays TEXT NOT NULL,
+    nbytes INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    session_id TEXT
+);
+CREATE INDEX IF NOT EXISTS images_last_access ON images (last_access);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+"""
+
+# Seconds between sweeps for entries past their TTL
+_SWEEP_INTERVAL = 30
+
+# last_access is only written back when it is older than this, to keep reads cheap
+_TOUCH_INTERVAL = 5
+
+
+# Columns added to the images table after it was first created
+_IMAGE_MIGRATIONS = {
+    "session_id": "ALTER TABLE images ADD COLUMN session_id TEXT"
+}
+
+
+@contextmanager
+def _connect(db_path):
+    """Open a connection to the registry, committing on success and always closing it."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _create_schema(db_path):
+    with _connect(db_path) as conn:
+        conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(images)")}
+        for column, statement in _IMAGE_MIGRATIONS.items():
+            if column not in columns:
+                conn.execute(statement)
+        conn.execute("CREATE INDEX IF NOT EXISTS images_session ON images (session_id)")
+
+
+def _is_slice_list(value):
+    return isinstance(value, list) and len(value) > 0 and all(isinstance(v, np.ndarray) for v in value)
+
+
+class ImageStore:
+    """
+    Uploaded images shared by every worker process on the host.
+
+    Each image's arrays are written once as .npy files under root and
+    memory-mapped read-only by whichever worker serves the image, so the
+    pixel buffers live in the page cache and are never copied between
+    workers. The remaining fields (window settings, presets, ...) and the
+    bookkeeping live in a SQLite registry next to them.
+
+    Values read back are dicts like the ones stored. Changes must go
+    through update() so other workers see them; updates that replace an
+    array bump the entry's version. When the arrays a worker has mapped pass max_bytes,
+    it unmaps the least recently used images, which stay on disk and are
+    mapped again on their next access; images idle for ttl_seconds
+    expire. Images stored with a session_id belong to that session and
+    are released with it (see SessionStore); reading one counts as
+    activity of its session.
+    """
+
+    def __init__(self, root=IMAGE_STORE_DIR, max_bytes=IMAGE_STORE_MAX_BYTES,
+                 ttl_seconds=IMAGE_STORE_TTL_SECONDS, session_ttl_seconds=SESSION_TTL_SECONDS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # TTL of the sessions owning images, so reading an image does not revive an expired session
+        self.session_ttl_seconds = session_ttl_seconds
+        self.db_path = os.path.join(root, "registry.db")
+        self.expirations = 0
+        self.evictions = 0
+        # image_id -> {"version", "nbytes", "arrays"}, least recently used first
+        self._mapped = OrderedDict()
+        self._release_hooks = []
+        self._lock = threading.RLock()
+        self._last_sweep = 0.0
+        os.makedirs(root, exist_ok=True)
+        _create_schema(self.db_path)
+
+    def add_release_hook(self, hook):
+        """Call hook(image_id) whenever this worker removes or drops an entry, e.g. to clear derived caches."""
+        self._release_hooks.append(hook)
+
+    def _image_dir(self, image_id):
+        return os.path.join(self.root, image_id)
+
+    def _write_arrays(self, image_id, version, fields):
+        """Write the array fields to .npy files and return (scalar fields, array kinds, bytes written)."""
+        directory = self._image_dir(image_id)
+        os.makedirs(directory, exist_ok=True)
+        scalars, arrays, nbytes = {}, {}, 0
+        for key, value in fields.items():
+            if isinstance(value, np.ndarray) or _is_slice_list(value):
+                kind = "list" if isinstance(value, list) else "array"
+                array = np.stack(value) if kind == "list" else value
+                # Versioned names, so workers that still map the old file keep a valid mapping
+                path = os.path.join(directory, f"{key}.{version}.npy")
+                tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+                np.save(tmp_path, array)
+                os.replace(tmp_path, path)
+                arrays[key] = kind
+                nbytes += array.nbytes
+            else:
+                scalars[key] = value
+        return scalars, arrays, nbytes
+
+    def _map_arrays(self, image_id, row):
+        arrays = {}
+        for key, kind in json.loads(row["arrays"]).items():
+            mapped = np.load(os.path.join(self._image_dir(image_id), f"{key}.{row['version']}.npy"), mmap_mode='r')
+            # Lists of slices stay lists, now of memory-mapped views
+            arrays[key] = list(mapped) if kind == "list" else mapped
+        return arrays
+
+    def __setitem__(self, image_id, fields):
+        self.put(image_id, fields)
+
+    def put(self, image_id, fields, session_id=None):
+        """Store an image, owned by session_id when given."""
+        version = int(time.time() * 1000)
+        scalars, arrays, nbytes = self._write_arrays(image_id, version, fields)
+        now = time.time()
+        with _connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO images "
+                "(image_id, version, fields, arrays, nbytes, created, last_access, session_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (image_id, version, json.dumps(scalars), json.dumps(arrays), nbytes, now, now, session_id)
+            )
+        with self._lock:
+            self._mapped.pop(image_id, None)
+        self._sweep_expired()
+
+    def update(self, image_id, **changes):
+        """
+        Change fields of a stored image; None removes a field.
+
+        Changes to scalar fields only are written to the registry and
+        leave the arrays, the version and cached renders alone. Changing
+        an array rewrites it under a new version and releases this
+        worker's mapping.
+        """
+        with _connect(self.db_path) as conn:
+            # Take the write lock before reading, so concurrent updates cannot overwrite each other
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT * FROM images WHERE image_id = ?", (image_id,)).fetchone()
+            if row is None:
+                raise KeyError(image_id)
+            fields = json.loads(row["fields"])
+            arrays = json.loads(row["arrays"])
+            if not any(key in arrays or isinstance(value, np.ndarray) or _is_slice_list(value)
+                       for key, value in changes.items()):
+                for key, value in changes.items():
+                    if value is None:
+                        fields.pop(key, None)
+                    else:
+                        fields[key] = value
+                conn.execute("UPDATE images SET fields = ?, last_access = ? WHERE image_id = ?",
+                             (json.dumps(fields), time.time(), image_id))
+                return
+            version = row["version"] + 1
+            new_fields = {key: value for key, value in changes.items() if value is not None}
+            scalars, new_arrays, written = self._write_arrays(image_id, version, new_fields)
+            # Arrays that did not change are linked under the new version
+            for key, kind in arrays.items():
+                if key in changes:
+                    continue
+                old_path = os.path.join(self._image_dir(image_id), f"{key}.{row['version']}.npy")
+                new_path = os.path.join(self._image_dir(image_id), f"{key}.{version}.npy")
+                try:
+                    os.link(old_path, new_path)
+                except OSError:
+                    shutil.copyfile(old_path, new_path)
+                new_arrays[key] = kind
+            for key in changes:
+                fields.pop(key, None)
+            fields.update(scalars)
+            nbytes = sum(os.path.getsize(os.path.join(self._image_dir(image_id), f"{key}.{version}.npy"))
+                         for key in new_arrays)
+            conn.execute(
+                "UPDATE images SET version = ?, fields = ?, arrays = ?, nbytes = ?, last_access = ? "
+                "WHERE image_id = ?",
+                (version, json.dumps(fields), json.dumps(new_arrays), nbytes, time.time(), image_id)
+            )
+        self._unlink_version(image_id, row["version"])
+        with self._lock:
+            self._mapped.pop(image_id, None)
+        self._release(image_id)
+
+    def _unlink_version(self, image_id, version):
+        directory = self._image_dir(image_id)
+        suffix = f".{version}.npy"
+        for name in os.listdir(directory):
+            if name.endswith(suffix):
+                os.unlink(os.path.join(directory, name))
+
+    def __getitem__(self, image_id):
+        self._sweep_expired()
+        with _connect(self.db_path) as conn:
+            row = conn.execute("SELECT * FROM images WHERE image_id = ?", (image_id,)).fetchone()
+            if row is None:
+                self._drop_mapping(image_id)
+                raise KeyError(image_id)
+            now = time.time()
+            if now - row["last_access"] > _TOUCH_INTERVAL:
+                conn.execute("UPDATE images SET last_access = ? WHERE image_id = ?", (now, image_id))
+                # Viewing an image keeps the session that owns it alive, but never revives an expired one
+                if row["session_id"] is not None:
+                    cutoff = now - self.session_ttl_seconds if self.session_ttl_seconds else 0
+                    conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = ? AND last_access >= ?",
+                                 (now, row["session_id"], cutoff))
+
+        with self._lock:
+            mapped = self._mapped.get(image_id)
+            if mapped is not None and mapped["version"] == row["version"]:
+                self._mapped.move_to_end(image_id)
+            else:
+                mapped = None
+        if mapped is None:
+            mapped = {"version": row["version"], "nbytes": row["nbytes"], "arrays": self._map_arrays(image_id, row)}
+            with self._lock:
+                self._mapped[image_id] = mapped
+                self._mapped.move_to_end(image_id)
+            self._enforce_budget()
+        # Scalar fields are read fresh every time, as updates to them keep the version
+        fields = json.loads(row["fields"])
+        fields.update(mapped["arrays"])
+        fields["version"] = row["version"]
+        return fields
+
+    def __contains__(self, image_id):
+        with _connect(self.db_path) as conn:
+            return conn.execute("SELECT 1 FROM images WHERE image_id = ?", (image_id,)).fetchone() is not None
+
+    def __len__(self):
+        with _connect(self.db_path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def get(self, image_id, default=None):
+        try:
+            return self[image_id]
+        except KeyError:
+            return default
+
+    def __delitem__(self, image_id):
+        if not self._remove(image_id):
+            raise KeyError(image_id)
+
+    def pop(self, image_id, default=None):
+        value = self.get(image_id, default)
+        self._remove(image_id)
+        return value
+
+    def _drop_mapping(self, image_id):
+        with self._lock:
+            dropped = self._mapped.pop(image_id, None) is not None
+        if dropped:
+            self._release(image_id)
+
+    def _release(self, image_id):
+        for hook in self._release_hooks:
+            try:
+                hook(image_id)
+            except Exception as e:
+                logger.error(f"Release hook failed for {image_id}: {str(e)}")
+
+    def session_images(self, session_id):
+        """Return the ids of the images owned by a session."""
+        with _connect(self.db_path) as conn:
+            return [row["image_id"] for row in conn.execute(
+                "SELECT image_id FROM images WHERE session_id = ?", (session_id,))]
+
+    def release_session(self, session_id):
+        """Remove every image owned by a session and return their ids."""
+        image_ids = self.session_images(session_id)
+        for image_id in image_ids:
+            self._remove(image_id)
+        return image_ids
+
+    def _remove(self, image_id):
+        """Remove an image from the registry and disk. Returns whether it existed."""
+        with _connect(self.db_path) as conn:
+            removed = conn.execute("DELETE FROM images WHERE image_id = ?", (image_id,)).rowcount > 0
+        # Workers that still map the files keep valid mappings until they drop them
+        shutil.rmtree(self._image_dir(image_id), ignore_errors=True)
+        with self._lock:
+            self._mapped.pop(image_id, None)
+        self._release(image_id)
+        return removed
+
+    def _sweep_expired(self):
+        now = time.time()
+        if now - self._last_sweep < _SWEEP_INTERVAL:
+            return
+        self.sweep()
+
+    def sweep(self):
+        """
+        Remove images idle past the TTL and unmap images other workers removed.
+
+        Mappings of removed images keep their pages alive, so every worker
+        runs this periodically rather than only when an image is requested.
+        """
+        now = time.time()
+        self._last_sweep = now
+        with _connect(self.db_path) as conn:
+            live = {row["image_id"] for row in conn.execute("SELECT image_id FROM images")}
+        with self._lock:
+            stale = [image_id for image_id in self._mapped if image_id not in live]
+        for image_id in stale:
+            self._drop_mapping(image_id)
+        if not self.ttl_seconds:
+            return
+        with _connect(self.db_path) as conn:
+            expired = [row["image_id"] for row in conn.execute(
+                "SELECT image_id FROM images WHERE last_access < ?", (now - self.ttl_seconds,))]
+        for image_id in expired:
+            logger.info(f"Image {image_id} expired after {self.ttl_seconds}s idle")
+            self._remove(image_id)
+            self.expirations += 1
+
+    def _enforce_budget(self):
+        """
+        Unmap least recently used images until the arrays mapped here fit the budget.
+
+        Only the mapping is dropped: the files and registry entry stay, so
+        the image is mapped again the next time it is requested. The most
+        recently used image is always kept mapped.
+        """
+        with self._lock:
+            total = sum(mapped["nbytes"] for mapped in self._mapped.values())
+            while total > self.max_bytes and len(self._mapped) > 1:
+                image_id, mapped = self._mapped.popitem(last=False)
+                total -= mapped["nbytes"]
+                self.evictions += 1
+                logger.info(f"Unmapping image {image_id} to stay within {self.max_bytes} bytes")
+
+    def stats(self):
+        with _connect(self.db_path) as conn:
+            rows = conn.execute(
+                "SELECT image_id, version, nbytes, created, last_access, session_id FROM images").fetchall()
+        with self._lock:
+            mapped = set(self._mapped)
+            mapped_bytes = sum(entry["nbytes"] for entry in self._mapped.values())
+        return {
+            "entries": len(rows),
+            "stored_bytes": sum(row["nbytes"] for row in rows),
+            "mapped_bytes": mapped_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "root": self.root,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "images": {
+                row["image_id"]: {
+                    "stored_bytes": row["nbytes"],
+                    "version": row["version"],
+                    "mapped_here": row["image_id"] in mapped,
+                    "session_id": row["session_id"],
+                    "created": row["created"],
+                    "last_access": row["last_access"]
+                }
+                for row in rows
+            }
+        }
+
+
+class SessionStore:
+    """
+    Sessions kept in the image store's registry, so every worker sees the same sessions.
+
+    A session owns the images uploaded with it. Sessions idle for longer
+    than ttl_seconds expire, and expiring or ending a session releases its
+    images the same way closing the study does.
+    """
+
+    def __init__(self, image_store, ttl_seconds=SESSION_TTL_SECONDS):
+        self.image_store = image_store
+        self.ttl_seconds = ttl_seconds
+        self.db_path = image_store.db_path
+        self.expirations = 0
+        self._touched = {}
+        _create_schema(self.db_path)
+
+    def create(self, data):
+        session_id = str(uuid.uuid4())
+        self[session_id] = data
+        return session_id
+
+    def __setitem__(self, session_id, data):
+        now = time.time()
+        with _connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, created, last_access) VALUES (?, ?, ?, ?)",
+                (session_id, json.dumps(data), now, now)
+            )
+
+    def _live_row(self, conn, session_id, columns="*"):
+        return conn.execute(
+            f"SELECT {columns} FROM sessions WHERE session_id = ? AND last_access >= ?",
+            (session_id, self._expiry_cutoff())
+        ).fetchone()
+
+    def _expiry_cutoff(self):
+        return time.time() - self.ttl_seconds if self.ttl_seconds else 0
+
+    def __getitem__(self, session_id):
+        with _connect(self.db_path) as conn:
+            row = self._live_row(conn, session_id, "data")
+            if row is None:
+                raise KeyError(session_id)
+            conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (time.time(), session_id))
+        return json.loads(row["data"])
+
+    def __contains__(self, session_id):
+        with _connect(self.db_path) as conn:
+            return self._live_row(conn, session_id, "1") is not None
+
+    def get(self, session_id, default=None):
+        try:
+            return self[session_id]
+        except KeyError:
+            return default
+
+    def touch_due(self, session_id):
+        """Whether touch() would write the session back rather than return right away."""
+        return time.time() - self._touched.get(session_id, 0) >= _TOUCH_INTERVAL
+
+    def touch(self, session_id):
+        """Mark a session as active; returns False if it does not exist or has expired."""
+        now = time.time()
+        if not self.touch_due(session_id):
+            return True
+        with _connect(self.db_path) as conn:
+            alive = conn.execute(
+                "UPDATE sessions SET last_access = ? WHERE session_id = ? AND last_access >= ?",
+                (now, session_id, self._expiry_cutoff())
+            ).rowcount > 0
+        if alive:
+            self._touched[session_id] = now
+        else:
+            self._touched.pop(session_id, None)
+        return alive
+
+    def close_study(self, session_id, image_id=None):
+        """
+        Release the images of a session, or only image_id if given.
+
+        Returns the released ids. Raises KeyError if image_id is not owned
+        by the session.
+        """
+        if image_id is None:
+            return self.image_store.release_session(session_id)
+        if image_id not in self.image_store.session_images(session_id):
+            raise KeyError(image_id)
+        self.image_store._remove(image_id)
+        return [image_id]
+
+    def end(self, session_id):
+        """Delete a session and release its images; returns the released ids."""
+        with _connect(self.db_path) as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self._touched.pop(session_id, None)
+        return self.image_store.release_session(session_id)
+
+    def __delitem__(self, session_id):
+        if session_id not in self:
+            raise KeyError(session_id)
+        self.end(session_id)
+
+    def sweep(self):
+        """End every session idle past the TTL."""
+        now = time.time()
+        self._touched = {sid: at for sid, at in self._touched.items() if now - at < _TOUCH_INTERVAL}
+        if not self.ttl_seconds:
+            return
+        with _connect(self.db_path) as conn:
+            expired = [row["session_id"] for row in conn.execute(
+                "SELECT session_id FROM sessions WHERE last_access < ?", (self._expiry_cutoff(),))]
+        for session_id in expired:
+            released = self.end(session_id)
+            self.expirations += 1
+            logger.info(f"Session {session_id} expired after {self.ttl_seconds}s idle, "
+                        f"released {len(released)} images")
+
+    def stats(self):
+        with _connect(self.db_path) as conn:
+            sessions = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {
+            "sessions": sessions,
+            "ttl_seconds": self.ttl_seconds,
+            "expirations": self.expirations
+        }
+
+
+def reap_expired(image_store, session_store, interval):
+    """Sweep expired sessions and images every interval seconds; run in a daemon thread per worker."""
+    while True:
+        time.sleep(interval)
+        try:
+            session_store.sweep()
+            image_store.sweep()
+        except Exception as e:
+            logger.error(f"Image store sweep failed: {str(e)}")
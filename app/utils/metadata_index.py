@@ -0,0 +1,332 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+import nibabel as nib
+import pydicom
+from PIL import Image
+from app.config import DATABASE_URL, SUPPORTED_EXTENSIONS, INDEX_REFRESH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    format TEXT,
+    shape TEXT,
+    ndim INTEGER,
+    dtype TEXT,
+    voxel_width REAL,
+    voxel_height REAL,
+    voxel_depth REAL,
+    modality TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS images_directory ON images (directory, name);
+CREATE INDEX IF NOT EXISTS images_modality ON images (modality);
+CREATE INDEX IF NOT EXISTS images_dtype ON images (dtype);
+CREATE INDEX IF NOT EXISTS images_size ON images (size);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    name TEXT NOT NULL,
+    scanned_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent, name);
+"""
+
+_COLUMNS = ("path", "directory", "name", "mtime_ns", "size", "format", "shape", "ndim",
+            "dtype", "voxel_width", "voxel_height", "voxel_depth", "modality", "error")
+
+
+def _sqlite_path(url):
+    prefix = "sqlite:///"
+    if not url.startswith(prefix):
+        raise ValueError(f"Only sqlite DATABASE_URL values are supported, got {url}")
+    return url[len(prefix):]
+
+
+def _image_format(name):
+    lower = name.lower()
+    if lower.endswith(('.nii', '.nii.gz')):
+        return 'nifti'
+    if lower.endswith('.dcm'):
+        return 'dicom'
+    return 'standard'
+
+
+def _is_supported(name):
+    return any(name.lower().endswith(ext) for ext in SUPPORTED_EXTENSIONS)
+
+
+def _join(directory, name):
+    return f"{directory}/{name}" if directory else name
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def read_image_header(file_path):
+    """
+    Read shape, dtype, voxel dimensions and modality without decoding pixels.
+
+    Returns a dict with keys shape, dtype, voxel_dimensions and modality.
+    """
+    fmt = _image_format(file_path)
+    if fmt == 'nifti':
+        header = nib.load(file_path).header
+        zooms = header.get_zooms()
+        return {
+            "shape": [int(d) for d in header.get_data_shape()],
+            "dtype": str(header.get_data_dtype()),
+            "voxel_dimensions": [float(zooms[0]), float(zooms[1]), float(zooms[2]) if len(zooms) > 2 else 1.0],
+            "modality": None
+        }
+    if fmt == 'dicom':
+        ds = pydicom.dcmread(file_path, stop_before_pixels=True)
+        frames = int(ds.get('NumberOfFrames', 1) or 1)
+        shape = [int(ds.Rows), int(ds.Columns)] + ([frames] if frames > 1 else [])
+        bits = int(ds.get('BitsAllocated', 16))
+        signed = int(ds.get('PixelRepresentation', 0)) == 1
+        spacing = [float(v) for v in ds.PixelSpacing] if 'PixelSpacing' in ds else [1.0, 1.0]
+        thickness = float(ds.SliceThickness) if ds.get('SliceThickness') else 1.0
+        return {
+            "shape": shape,
+            "dtype": f"{'int' if signed else 'uint'}{bits}",
+            "voxel_dimensions": spacing + [thickness],
+            "modality": str(ds.get('Modality', '')) or None
+        }
+    with Image.open(file_path) as img:
+        width, height = img.size
+        dtype = {'I;16': 'uint16', 'I': 'int32', 'F': 'float32'}.get(img.mode, 'uint8')
+    return {
+        "shape": [height, width],
+        "dtype": dtype,
+        "voxel_dimensions": [1.0, 1.0, 1.0],
+        "modality": None
+    }
+
+
+class MetadataIndex:
+    """
+    Persistent SQLite index of the images directory.
+
+    Each supported file is stored with its shape, dtype, voxel dimensions,
+    modality and byte size. refresh() walks the tree with os.scandir and
+    only re-reads headers of files whose mtime or size changed.
+    """
+
+    def __init__(self, root, database_url=DATABASE_URL, refresh_seconds=INDEX_REFRESH_SECONDS):
+        self.root = root
+        self.db_path = _sqlite_path(database_url)
+        self.refresh_seconds = refresh_seconds
+        self._refresh_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Open a connection, committing on success and always closing it."""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def refresh(self, directory="", recursive=True, max_age=None):
+        """
+        Bring the index for directory (relative to root) up to date with the filesystem.
+
+        With max_age, directories scanned within the last max_age seconds are
+        not rescanned, though a recursive refresh still descends into them.
+        """
+        with self._refresh_lock:
+            start = time.time()
+            updated = 0
+            with self._connect() as conn:
+                pending = [directory]
+                while pending:
+                    current = pending.pop()
+                    row = conn.execute("SELECT scanned_at FROM directories WHERE path = ?", (current,)).fetchone()
+                    if max_age is not None and row is not None and start - row["scanned_at"] <= max_age:
+                        subdirectories = [row["path"] for row in conn.execute(
+                            "SELECT path FROM directories WHERE parent = ?", (current,))]
+                    else:
+                        subdirectories, count = self._refresh_directory(conn, current)
+                        updated += count
+                    if recursive:
+                        pending.extend(subdirectories)
+            logger.info(f"Indexed '{directory or '.'}' in {time.time() - start:.2f}s, {updated} files updated")
+            return updated
+
+    def refresh_if_stale(self, directory="", recursive=False):
+        """Rescan the directories under directory that were not scanned within refresh_seconds."""
+        return self.refresh(directory, recursive=recursive, max_age=self.refresh_seconds)
+
+    def _refresh_directory(self, conn, directory):
+        abs_dir = os.path.join(self.root, directory)
+        known = {
+            row["name"]: (row["mtime_ns"], row["size"])
+            for row in conn.execute("SELECT name, mtime_ns, size FROM images WHERE directory = ?", (directory,))
+        }
+        known_dirs = {
+            row["name"] for row in conn.execute("SELECT name FROM directories WHERE parent = ?", (directory,))
+        }
+
+        subdirectories = []
+        seen = set()
+        rows = []
+        try:
+            entries = list(os.scandir(abs_dir))
+        except FileNotFoundError:
+            entries = []
+
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                subdirectories.append(_join(directory, entry.name))
+                continue
+            if not entry.is_file() or not _is_supported(entry.name):
+                continue
+            seen.add(entry.name)
+            stat = entry.stat()
+            if known.get(entry.name) == (stat.st_mtime_ns, stat.st_size):
+                continue
+            rows.append(self._index_file(entry.path, directory, entry.name, stat))
+
+        if rows:
+            placeholders = ", ".join("?" for _ in _COLUMNS)
+            conn.executemany(
+                f"INSERT OR REPLACE INTO images ({', '.join(_COLUMNS)}) VALUES ({placeholders})",
+                rows
+            )
+        removed = [name for name in known if name not in seen]
+        conn.executemany("DELETE FROM images WHERE directory = ? AND name = ?",
+                         [(directory, name) for name in removed])
+
+        current_dirs = {os.path.basename(d) for d in subdirectories}
+        for name in known_dirs - current_dirs:
+            self._forget_directory(conn, _join(directory, name))
+
+        now = time.time()
+        parent = os.path.dirname(directory) if directory else None
+        conn.execute("INSERT OR REPLACE INTO directories (path, parent, name, scanned_at) VALUES (?, ?, ?, ?)",
+                     (directory, parent, os.path.basename(directory), now))
+        for sub in subdirectories:
+            conn.execute("INSERT OR IGNORE INTO directories (path, parent, name, scanned_at) VALUES (?, ?, ?, 0)",
+                         (sub, directory, os.path.basename(sub)))
+        return subdirectories, len(rows) + len(removed)
+
+    def _forget_directory(self, conn, directory):
+        like = _escape_like(directory) + '/%'
+        conn.execute("DELETE FROM images WHERE directory = ? OR directory LIKE ? ESCAPE '\\'", (directory, like))
+        conn.execute("DELETE FROM directories WHERE path = ? OR path LIKE ? ESCAPE '\\'", (directory, like))
+
+    def _index_file(self, file_path, directory, name, stat):
+        info = {"shape": None, "dtype": None, "voxel_dimensions": [None, None, None], "modality": None}
+        error = None
+        try:
+            info = read_image_header(file_path)
+        except Exception as e:
+            error = str(e)
+            logger.warning(f"Could not read header of {file_path}: {error}")
+        logger.debug(f"Indexed file: {file_path}")
+        voxel = info["voxel_dimensions"]
+        return (
+            _join(directory, name), directory, name, stat.st_mtime_ns, stat.st_size,
+            _image_format(name),
+            json.dumps(info["shape"]) if info["shape"] is not None else None,
+            len(info["shape"]) if info["shape"] is not None else None,
+            info["dtype"], voxel[0], voxel[1], voxel[2], info["modality"], error
+        )
+
+    def subdirectories(self, directory=""):
+        with self._connect() as conn:
+            return [row["name"] for row in conn.execute(
+                "SELECT name FROM directories WHERE parent = ? ORDER BY name", (directory,))]
+
+    def query(self, directory="", recursive=False, search=None, modality=None, dtype=None,
+              fmt=None, ndim=None, min_size=None, max_size=None, offset=0, limit=None):
+        """
+        Return (total, entries) of indexed files matching the filters.
+
+        Entries are ordered by path; offset and limit select one page.
+        """
+        clauses = []
+        params = []
+        if recursive:
+            if directory:
+                like = _escape_like(directory) + '/%'
+                clauses.append("(directory = ? OR directory LIKE ? ESCAPE '\\')")
+                params += [directory, like]
+        else:
+            clauses.append("directory = ?")
+            params.append(directory)
+        if search:
+            clauses.append("name LIKE ? ESCAPE '\\'")
+            params.append('%' + _escape_like(search) + '%')
+        for column, value in (("modality", modality), ("dtype", dtype), ("format", fmt), ("ndim", ndim)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if min_size is not None:
+            clauses.append("size >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            clauses.append("size <= ?")
+            params.append(max_size)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM images {where}", params).fetchone()[0]
+            sql = f"SELECT * FROM images {where} ORDER BY path"
+            page_params = list(params)
+            if limit is not None:
+                sql += " LIMIT ? OFFSET ?"
+                page_params += [limit, offset]
+            elif offset:
+                sql += " LIMIT -1 OFFSET ?"
+                page_params.append(offset)
+            rows = conn.execute(sql, page_params).fetchall()
+
+        return total, [self._entry(row) for row in rows]
+
+    @staticmethod
+    def _entry(row):
+        return {
+            "path": row["path"],
+            "name": row["name"],
+            "directory": row["directory"],
+            "format": row["format"],
+            "size": row["size"],
+            "shape": json.loads(row["shape"]) if row["shape"] else None,
+            "dtype": row["dtype"],
+            "voxel_dimensions": [row["voxel_width"], row["voxel_height"], row["voxel_depth"]],
+            "modality": row["modality"],
+            "error": row["error"]
+        }
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_metadata_index(root):
+    """Return the process-wide index for an images root, creating it on first use."""
+    root = os.path.realpath(root)
+    with _indexes_lock:
+        if root not in _indexes:
+            _indexes[root] = MetadataIndex(root)
+        return _indexes[root]
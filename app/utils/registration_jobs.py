@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from app.config import (
+    REGISTRATION_JOB_DIR, REGISTRATION_JOB_WORKERS, REGISTRATION_JOB_QUEUE,
+    REGISTRATION_JOB_TTL_SECONDS, REGISTRATION_JOB_STALE_SECONDS, EXECUTOR_RETRY_AFTER
+)
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    iteration INTEGER NOT NULL DEFAULT 0,
+    metric_value REAL,
+    progress TEXT NOT NULL DEFAULT '{}',
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    heartbeat REAL
+);
+"""
+
+# Columns added to the jobs table after it was first created
+_JOB_MIGRATIONS = {
+    "heartbeat": "ALTER TABLE jobs ADD COLUMN heartbeat REAL"
+}
+
+# Job states; the last three are final
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINAL_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# Seconds between progress writes to the registry, and between checks for a cancel request
+_PROGRESS_INTERVAL = 0.5
+
+
+class JobProgress:
+    """
+    Progress reporting handed to a running job.
+
+    observe(method, level) is meant as the registration's iteration
+    observer: it records the level, optimizer iteration and metric value
+    and returns True, stopping the registration, once the job has been
+    cancelled.
+    """
+
+    def __init__(self, jobs, job_id):
+        self.jobs = jobs
+        self.job_id = job_id
+        self.cancelled = False
+        self.iteration = 0
+        self.metric_value = None
+        self.details = {}
+        self._last_write = 0.0
+
+    def observe(self, method, level=0):
+        self.iteration = method.GetOptimizerIteration()
+        self.metric_value = method.GetMetricValue()
+        self.details["level"] = level
+        now = time.monotonic()
+        if now - self._last_write < _PROGRESS_INTERVAL:
+            return self.cancelled
+        self._last_write = now
+        self.cancelled = self.jobs._write_progress(self.job_id, self.iteration, self.metric_value, self.details)
+        if self.cancelled:
+            logger.info(f"Stopping registration job {self.job_id} on request")
+        return self.cancelled
+
+    def check_cancelled(self):
+        """Write progress and check for a cancel request right away, e.g. before an expensive stage."""
+        self._last_write = time.monotonic()
+        self.cancelled = self.jobs._write_progress(self.job_id, self.iteration, self.metric_value, self.details)
+        return self.cancelled
+
+    def update(self, **details):
+        """Record extra progress fields, e.g. the current resolution level."""
+        self.details.update(details)
+
+
+class RegistrationJobs:
+    """
+    Registrations run as background jobs.
+
+    Jobs run in a bounded thread pool of the worker that accepted them
+    (SimpleITK releases the GIL while it optimizes), at most max_queue of
+    them waiting. Their state, progress and results are kept under root,
+    so any worker can report on or cancel any job. Finished jobs are
+    dropped after ttl_seconds; running jobs that report no progress for
+    stale_seconds, such as those of a worker that was restarted, are
+    marked failed.
+    """
+
+    def __init__(self, root=REGISTRATION_JOB_DIR, workers=REGISTRATION_JOB_WORKERS,
+                 max_queue=REGISTRATION_JOB_QUEUE, ttl_seconds=REGISTRATION_JOB_TTL_SECONDS,
+                 stale_seconds=REGISTRATION_JOB_STALE_SECONDS):
+        self.root = root
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.db_path = os.path.join(root, "jobs.db")
+        self.active = 0
+        self.rejected = 0
+        self._pool = None
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, statement in _JOB_MIGRATIONS.items():
+                if column not in columns:
+                    conn.execute(statement)
+
+    @contextmanager
+    def _connect(self):
+        """Open a connection, committing on success and always closing it."""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _result_path(self, job_id):
+        return os.path.join(self.root, f"{job_id}.json")
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue func(*args, progress=JobProgress, **kwargs) and return the job id.
+
+        func must return JSON-serializable data. Raises 503 when this
+        worker already has workers + max_queue jobs in flight. Blocks on
+        the registry, so call it from a worker thread.
+        """
+        self.sweep()
+        with self._lock:
+            if self.active >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail="Too many registration jobs in progress, retry shortly",
+                    headers={"Retry-After": str(EXECUTOR_RETRY_AFTER)}
+                )
+            self.active += 1
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="registration-job")
+
+        job_id = str(uuid.uuid4())
+        with self._connect() as conn:
+            conn.execute("INSERT INTO jobs (job_id, state, created) VALUES (?, ?, ?)", (job_id, QUEUED, time.time()))
+        self._pool.submit(self._run, job_id, func, args, kwargs)
+        logger.info(f"Queued registration job {job_id}")
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        try:
+            now = time.time()
+            with self._connect() as conn:
+                started = conn.execute(
+                    "UPDATE jobs SET state = ?, started = ?, heartbeat = ? WHERE job_id = ? AND state = ?",
+                    (RUNNING, now, now, job_id, QUEUED)
+                ).rowcount > 0
+            if not started:
+                # Cancelled while it was queued
+                return
+
+            progress = JobProgress(self, job_id)
+            try:
+                result = func(*args, progress=progress, **kwargs)
+            except Exception as e:
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                logger.error(f"Registration job {job_id} failed: {detail}", exc_info=True)
+                self._finish(job_id, FAILED, progress, error=str(detail))
+                return
+
+            if progress.cancelled or self._cancel_requested(job_id):
+                self._finish(job_id, CANCELLED, progress)
+                return
+            tmp_path = f"{self._result_path(job_id)}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(result, f)
+            os.replace(tmp_path, self._result_path(job_id))
+            self._finish(job_id, SUCCEEDED, progress)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def _finish(self, job_id, state, progress, error=None):
+        """Move a running job to a final state; a job already failed by sweep() keeps its state."""
+        with self._connect() as conn:
+            finished = conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, iteration = ?, metric_value = ?, progress = ?, finished = ? "
+                "WHERE job_id = ? AND state = ?",
+                (state, error, int(progress.iteration), progress.metric_value, json.dumps(progress.details),
+                 time.time(), job_id, RUNNING)
+            ).rowcount > 0
+        if finished:
+            logger.info(f"Registration job {job_id} {state}")
+        else:
+            logger.warning(f"Registration job {job_id} ended as {state} after it was no longer running")
+
+    def _write_progress(self, job_id, iteration, metric_value, details):
+        """Store a job's progress and return whether it has been cancelled."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET iteration = ?, metric_value = ?, progress = ?, heartbeat = ? WHERE job_id = ?",
+                (int(iteration), None if metric_value is None else float(metric_value), json.dumps(details),
+                 time.time(), job_id)
+            )
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def _cancel_requested(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def status(self, job_id):
+        """Return the state and progress of a job; raises KeyError for unknown jobs."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(job_id)
+        end = row["finished"] or time.time()
+        return {
+            "job_id": job_id,
+            "state": row["state"],
+            "iteration": row["iteration"],
+            "metric_value": row["metric_value"],
+            "progress": json.loads(row["progress"]),
+            "error": row["error"],
+            "cancel_requested": bool(row["cancel_requested"]),
+            "created": row["created"],
+            "started": row["started"],
+            "finished": row["finished"],
+            "elapsed_seconds": end - row["started"] if row["started"] else None
+        }
+
+    def result(self, job_id):
+        """Return the result of a succeeded job, or None if it has not succeeded."""
+        if self.status(job_id)["state"] != SUCCEEDED:
+            return None
+        with open(self._result_path(job_id)) as f:
+            return json.load(f)
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. Queued jobs never start; running jobs stop at their
+        next optimizer iteration. Returns the job's status afterwards.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                raise KeyError(job_id)
+            if row["state"] not in FINAL_STATES:
+                conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ?", (job_id,))
+                conn.execute(
+                    "UPDATE jobs SET state = ?, finished = ? WHERE job_id = ? AND state = ?",
+                    (CANCELLED, now, job_id, QUEUED)
+                )
+        return self.status(job_id)
+
+    def sweep(self):
+        """
+        Fail running jobs that stopped reporting progress, and drop jobs
+        that finished more than ttl_seconds ago, with their results.
+        """
+        now = time.time()
+        if self.stale_seconds:
+            with self._connect() as conn:
+                stale = conn.execute(
+                    "UPDATE jobs SET state = ?, error = ?, finished = ? "
+                    "WHERE state = ? AND COALESCE(heartbeat, started) < ?",
+                    (FAILED, "Registration stopped reporting progress", now, RUNNING, now - self.stale_seconds)
+                ).rowcount
+            if stale:
+                logger.warning(f"Marked {stale} stale registration jobs failed")
+        if not self.ttl_seconds:
+            return
+        cutoff = now - self.ttl_seconds
+        with self._connect() as conn:
+            expired = [row["job_id"] for row in conn.execute(
+                "SELECT job_id FROM jobs WHERE finished IS NOT NULL AND finished < ?", (cutoff,))]
+            conn.execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?", (cutoff,))
+        for job_id in expired:
+            try:
+                os.unlink(self._result_path(job_id))
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._connect() as conn:
+            states = {row["state"]: row["count"] for row in conn.execute(
+                "SELECT state, COUNT(*) AS count FROM jobs GROUP BY state")}
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "active_here": self.active,
+            "rejected": self.rejected,
+            "jobs": states
+        }
+
+
+registration_jobs = RegistrationJobs()
@@ -0,0 +1,273 @@
+import os
+import json
+import queue
+import hashlib
+import threading
+import logging
+import numpy as np
+import nibabel as nib
+from app.config import SIDECAR_CACHE_DIR, SIDECAR_CONVERTER_WORKERS
+from app.utils.file_handling import read_nifti_data
+
+logger = logging.getLogger(__name__)
+
+# Source formats worth converting: decompression and float conversion dominate their load time
+SIDECAR_EXTENSIONS = ('.nii', '.nii.gz')
+
+# Bump when the sidecar layout changes so old sidecars are rebuilt
+SIDECAR_VERSION = 1
+
+
+def _sidecar_paths(source_path):
+    digest = hashlib.sha1(os.path.realpath(source_path).encode('utf-8')).hexdigest()
+    base = os.path.join(SIDECAR_CACHE_DIR, digest)
+    return base + '.f32', base + '.json'
+
+
+def _source_signature(source_path):
+    stat = os.stat(source_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def is_convertible(path):
+    return path.lower().endswith(SIDECAR_EXTENSIONS)
+
+
+class SidecarVolume:
+    """
+    Memory-mapped float32 copy of a source volume.
+
+    The raw file holds the slices in order, each stored row-major, so a
+    slice is one contiguous read and the whole file can be streamed as-is.
+    Offers the same slice interface as LazyNiftiVolume.
+    """
+
+    def __init__(self, raw_path, header):
+        self.header = header
+        self.dimensions = list(header["dimensions"])
+        self.total_slices = header["total_slices"]
+        self.voxel_dimensions = header["voxel_dimensions"]
+        self.slices = np.memmap(
+            raw_path,
+            dtype='<f4',
+            mode='r',
+            shape=(self.total_slices, self.dimensions[0], self.dimensions[1])
+        )
+
+    @property
+    def shape(self):
+        """Shape of the volume as (rows, cols, slices)."""
+        return (self.dimensions[0], self.dimensions[1], self.total_slices)
+
+    @property
+    def data(self):
+        """The volume as a (rows, cols, slices) view, like the decoded source."""
+        if self.total_slices == 1 and self.header["ndim"] == 2:
+            return self.slices[0]
+        return np.moveaxis(self.slices, 0, 2)
+
+    def get_slice(self, index):
+        if index < 0 or index >= self.total_slices:
+            raise IndexError(f"Slice {index} out of range (0-{self.total_slices - 1})")
+        return self.slices[index]
+
+    def iter_slices(self):
+        for index in range(self.total_slices):
+            yield self.slices[index]
+
+    def get_preview(self, in_plane_stride, slice_stride):
+        """Copy every in_plane_stride-th row/column of every slice_stride-th slice."""
+        sampled = self.slices[::slice_stride, ::in_plane_stride, ::in_plane_stride]
+        if self.total_slices == 1 and self.header["ndim"] == 2:
+            return np.array(sampled[0])
+        return np.array(np.moveaxis(sampled, 0, 2))
+
+    def metadata(self):
+        return {
+            "dimensions": self.dimensions,
+            "total_slices": self.total_slices,
+            "dtype": self.header["source_dtype"],
+            "min_value": self.header["min_value"],
+            "max_value": self.header["max_value"],
+            "voxel_dimensions": self.voxel_dimensions
+        }
+
+
+def open_sidecar(source_path):
+    """Return a SidecarVolume for source_path, or None if there is no up-to-date sidecar."""
+    raw_path, header_path = _sidecar_paths(source_path)
+    try:
+        with open(header_path) as f:
+            header = json.load(f)
+        mtime_ns, size = _source_signature(source_path)
+    except (OSError, ValueError):
+        return None
+
+    if (header.get("version") != SIDECAR_VERSION
+            or header.get("source_mtime_ns") != mtime_ns
+            or header.get("source_size") != size):
+        logger.info(f"Sidecar for {source_path} is stale, removing it")
+        remove_sidecar(source_path)
+        return None
+
+    try:
+        return SidecarVolume(raw_path, header)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Unreadable sidecar for {source_path}: {str(e)}")
+        return None
+
+
+def load_sidecar(source_path):
+    """Return (data, metadata) served from the sidecar, or (None, None) on a miss."""
+    volume = open_sidecar(source_path)
+    if volume is None:
+        return None, None
+    metadata = volume.metadata()
+    return volume.data, {
+        "dimensions": metadata["dimensions"],
+        "min_value": metadata["min_value"],
+        "max_value": metadata["max_value"],
+        "voxel_dimensions": metadata["voxel_dimensions"]
+    }
+
+
+def remove_sidecar(source_path):
+    for path in _sidecar_paths(source_path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def convert_to_sidecar(source_path):
+    """
+    Write the float32 sidecar for a NIfTI file.
+
+    The raw data and the JSON header are written to temporary names and
+    renamed into place, header last, so readers never see a partial sidecar.
+    """
+    os.makedirs(SIDECAR_CACHE_DIR, exist_ok=True)
+    raw_path, header_path = _sidecar_paths(source_path)
+    mtime_ns, size = _source_signature(source_path)
+
+    # Drop any stale header first so readers miss instead of deleting the new data
+    try:
+        os.unlink(header_path)
+    except FileNotFoundError:
+        pass
+
+    img = nib.load(source_path)
+    data = read_nifti_data(img)
+    ndim = data.ndim
+    slices = data[np.newaxis] if ndim == 2 else np.moveaxis(data, 2, 0)
+
+    tmp_raw = f"{raw_path}.{os.getpid()}.tmp"
+    out = np.memmap(tmp_raw, dtype='<f4', mode='w+', shape=slices.shape)
+    out[:] = slices
+    out.flush()
+    del out
+
+    zooms = img.header.get_zooms()
+    header = {
+        "version": SIDECAR_VERSION,
+        "source": os.path.realpath(source_path),
+        "source_mtime_ns": mtime_ns,
+        "source_size": size,
+        "source_dtype": str(img.get_data_dtype()),
+        "ndim": ndim,
+        "dimensions": [int(slices.shape[1]), int(slices.shape[2])],
+        "total_slices": int(slices.shape[0]),
+        "min_value": float(np.min(data)),
+        "max_value": float(np.max(data)),
+        "voxel_dimensions": [
+            float(zooms[0]),
+            float(zooms[1]),
+            float(zooms[2]) if len(zooms) > 2 else 1.0
+        ]
+    }
+    tmp_header = f"{header_path}.{os.getpid()}.tmp"
+    with open(tmp_header, 'w') as f:
+        json.dump(header, f)
+
+    os.replace(tmp_raw, raw_path)
+    os.replace(tmp_header, header_path)
+    logger.info(f"Wrote sidecar for {source_path} ({data.nbytes} bytes)")
+
+
+class SidecarConverter:
+    """
+    Background worker threads that convert source files to sidecars.
+
+    Files are queued at most once at a time. A file is skipped if its
+    sidecar became up to date while it waited in the queue.
+    """
+
+    def __init__(self, workers=SIDECAR_CONVERTER_WORKERS):
+        self.workers = workers
+        self.converted = 0
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"sidecar-converter-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def schedule(self, source_path):
+        source_path = os.path.realpath(source_path)
+        if not is_convertible(source_path):
+            return
+        with self._lock:
+            if source_path in self._pending:
+                return
+            self._pending.add(source_path)
+        self._queue.put(source_path)
+        self.start()
+
+    def scan(self, root):
+        """Queue every convertible file under root that lacks an up-to-date sidecar."""
+        count = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if is_convertible(filename) and open_sidecar(path) is None:
+                    self.schedule(path)
+                    count += 1
+        logger.info(f"Queued {count} files under {root} for sidecar conversion")
+        return count
+
+    def _run(self):
+        while True:
+            source_path = self._queue.get()
+            try:
+                if os.path.exists(source_path) and open_sidecar(source_path) is None:
+                    convert_to_sidecar(source_path)
+                    self.converted += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Sidecar conversion failed for {source_path}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._pending.discard(source_path)
+                self._queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "converted": self.converted,
+            "failed": self.failed,
+            "pending": pending,
+            "cache_dir": SIDECAR_CACHE_DIR
+        }
+
+
+sidecar_converter = SidecarConverter()
@@ -0,0 +1,76 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from PIL import Image
+from app.config import SLICE_ENCODE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Encodings a rendered uint8 slice can be sent in
+SLICE_ENCODINGS = ("png", "webp", "raw")
+
+SLICE_MEDIA_TYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "raw": "application/octet-stream"
+}
+
+
+# PNG settings trading encoding speed for compression ratio
+PNG_COMPRESSION_PRESETS = {
+    "speed": {"compress_level": 1, "optimize": False},
+    "balanced": {"compress_level": 6, "optimize": False},
+    "ratio": {"compress_level": None, "optimize": True}
+}
+
+# PIL releases the GIL while compressing, so slices encode in parallel on threads
+_encode_pool = ThreadPoolExecutor(max_workers=SLICE_ENCODE_WORKERS, thread_name_prefix="slice-encode")
+
+
+def validate_png_compression(preset):
+    """Raise a 400 error for an unknown PNG compression preset."""
+    if preset not in PNG_COMPRESSION_PRESETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported compression '{preset}'. Supported: {', '.join(PNG_COMPRESSION_PRESETS)}"
+        )
+
+
+def encode_in_parallel(encode, count):
+    """Return [encode(0), ..., encode(count - 1)], computed across the slice encoding threads."""
+    return list(_encode_pool.map(encode, range(count)))
+
+
+def validate_slice_encoding(encoding, compress_level=None):
+    """Raise a 400 error for an unknown encoding or PNG compression level."""
+    if encoding not in SLICE_ENCODINGS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported encoding '{encoding}'. Supported encodings: {', '.join(SLICE_ENCODINGS)}"
+        )
+    if compress_level is not None and not 0 <= compress_level <= 9:
+        raise HTTPException(status_code=400, detail="compress_level must be between 0 and 9")
+
+
+def encode_slice(slice_data, encoding="png", compress_level=None, optimize=False):
+    """
+    Encode a 2D uint8 slice.
+
+    png uses zlib compress_level (PIL's default of 6 when None) or, with
+    optimize, PIL's slowest and smallest setting. webp is lossless. raw is
+    the row-major uint8 bytes, whose shape the caller sends separately.
+    """
+    if encoding == "raw":
+        return slice_data.tobytes()
+
+    buffer = io.BytesIO()
+    img = Image.fromarray(slice_data)
+    if encoding == "webp":
+        img.save(buffer, format="WEBP", lossless=True)
+    else:
+        options = {"optimize": optimize}
+        if compress_level is not None:
+            options["compress_level"] = compress_level
+        img.save(buffer, format="PNG", **options)
+    return buffer.getvalue()
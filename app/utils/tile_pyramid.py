@@ -0,0 +1,216 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+import numpy as np
+from PIL import Image
+from app.config import TILE_CACHE_DIR, TILE_SIZE, PYRAMID_MAX_PIXELS
+
+logger = logging.getLogger(__name__)
+
+# Bump when the pyramid layout changes so old pyramids are rebuilt
+PYRAMID_VERSION = 1
+
+# Rows of the finer level processed at once while downsampling
+_BAND_ROWS = 2048
+
+_build_locks = {}
+_build_locks_lock = threading.Lock()
+
+# Image.MAX_IMAGE_PIXELS is global, so decodes that raise it are serialized
+_pil_limit_lock = threading.Lock()
+
+
+def _pyramid_dir(source_path):
+    digest = hashlib.sha1(os.path.realpath(source_path).encode('utf-8')).hexdigest()
+    return os.path.join(TILE_CACHE_DIR, digest)
+
+
+def _source_signature(source_path):
+    stat = os.stat(source_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class TilePyramid:
+    """
+    Downsampled levels of a large 2D image, memory-mapped from disk.
+
+    Level 0 is full resolution and each further level halves both sides,
+    down to a level that fits in a single tile. Tiles are fixed-size
+    windows addressed by (level, x, y), counted from the top-left.
+    """
+
+    def __init__(self, directory, header):
+        self.header = header
+        self.tile_size = header["tile_size"]
+        self.levels = [
+            np.load(os.path.join(directory, f"level_{i}.npy"), mmap_mode='r')
+            for i in range(len(header["levels"]))
+        ]
+
+    def info(self):
+        return {
+            "tile_size": self.tile_size,
+            "dtype": self.header["dtype"],
+            "min_value": self.header["min_value"],
+            "max_value": self.header["max_value"],
+            "levels": [
+                {
+                    "level": i,
+                    "width": level["width"],
+                    "height": level["height"],
+                    "tiles_x": -(-level["width"] // self.tile_size),
+                    "tiles_y": -(-level["height"] // self.tile_size)
+                }
+                for i, level in enumerate(self.header["levels"])
+            ]
+        }
+
+    def read_tile(self, level, x, y):
+        """Return the tile as a view of the level; edge tiles may be smaller than tile_size."""
+        if level < 0 or level >= len(self.levels):
+            raise IndexError(f"Level {level} out of range (0-{len(self.levels) - 1})")
+        data = self.levels[level]
+        height, width = data.shape
+        ts = self.tile_size
+        if x < 0 or y < 0 or x * ts >= width or y * ts >= height:
+            raise IndexError(f"Tile ({x}, {y}) out of range for level {level}")
+        return data[y * ts:(y + 1) * ts, x * ts:(x + 1) * ts]
+
+    def tile_to_uint8(self, tile):
+        """Scale a tile to 8 bits using the value range of the whole image."""
+        if tile.dtype == np.uint8:
+            return np.ascontiguousarray(tile)
+        low, high = self.header["min_value"], self.header["max_value"]
+        scale = 255.0 / (high - low) if high > low else 0.0
+        scaled = (tile.astype(np.float32) - low) * scale
+        return np.clip(scaled, 0, 255).astype(np.uint8)
+
+
+def _downsample(src, dst):
+    """Average 2x2 blocks of src into dst, a band of rows at a time."""
+    height, width = src.shape
+    is_integer = np.issubdtype(dst.dtype, np.integer)
+    for start in range(0, height, _BAND_ROWS):
+        band = np.asarray(src[start:start + _BAND_ROWS], dtype=np.float32)
+        # Odd edges are padded by repeating the last row/column
+        if band.shape[0] % 2:
+            band = np.concatenate([band, band[-1:]], axis=0)
+        if band.shape[1] % 2:
+            band = np.concatenate([band, band[:, -1:]], axis=1)
+        reduced = band.reshape(band.shape[0] // 2, 2, band.shape[1] // 2, 2).mean(axis=(1, 3))
+        if is_integer:
+            reduced = np.rint(reduced)
+        dst[start // 2:start // 2 + reduced.shape[0]] = reduced
+
+
+def _read_full_resolution(source_path):
+    """Decode the source image as a 2D array, keeping 8/16-bit data as integers."""
+    with _pil_limit_lock:
+        previous_limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = PYRAMID_MAX_PIXELS
+        try:
+            with Image.open(source_path) as img:
+                if img.mode in ['RGB', 'RGBA', 'P', 'LA', '1']:
+                    img = img.convert('L')
+                if img.mode == 'L':
+                    return np.asarray(img, dtype=np.uint8)
+                if img.mode == 'I;16':
+                    return np.asarray(img, dtype=np.uint16)
+                return np.asarray(img, dtype=np.float32)
+        finally:
+            Image.MAX_IMAGE_PIXELS = previous_limit
+
+
+def build_pyramid(source_path, tile_size=TILE_SIZE):
+    """
+    Build and store all levels of the pyramid for source_path.
+
+    Each level is written as a .npy file that is later memory-mapped; the
+    JSON header is written last so a partial build is never used.
+    """
+    directory = _pyramid_dir(source_path)
+    os.makedirs(directory, exist_ok=True)
+    header_path = os.path.join(directory, "pyramid.json")
+    if os.path.exists(header_path):
+        os.unlink(header_path)
+
+    mtime_ns, size = _source_signature(source_path)
+    full = _read_full_resolution(source_path)
+    min_value, max_value = float(full.min()), float(full.max())
+    dtype = full.dtype
+
+    levels = []
+    current = np.lib.format.open_memmap(
+        os.path.join(directory, "level_0.npy"), mode='w+', dtype=full.dtype, shape=full.shape
+    )
+    current[:] = full
+    del full
+    levels.append({"width": int(current.shape[1]), "height": int(current.shape[0])})
+
+    while max(current.shape) > tile_size:
+        shape = ((current.shape[0] + 1) // 2, (current.shape[1] + 1) // 2)
+        next_level = np.lib.format.open_memmap(
+            os.path.join(directory, f"level_{len(levels)}.npy"), mode='w+', dtype=current.dtype, shape=shape
+        )
+        _downsample(current, next_level)
+        current.flush()
+        current = next_level
+        levels.append({"width": int(shape[1]), "height": int(shape[0])})
+    current.flush()
+    del current
+
+    header = {
+        "version": PYRAMID_VERSION,
+        "source_mtime_ns": mtime_ns,
+        "source_size": size,
+        "tile_size": tile_size,
+        "dtype": str(dtype),
+        "min_value": min_value,
+        "max_value": max_value,
+        "levels": levels
+    }
+    tmp_header = f"{header_path}.{os.getpid()}.tmp"
+    with open(tmp_header, 'w') as f:
+        json.dump(header, f)
+    os.replace(tmp_header, header_path)
+    logger.info(f"Built {len(levels)}-level pyramid for {source_path}")
+    return TilePyramid(directory, header)
+
+
+def open_pyramid(source_path, tile_size=TILE_SIZE):
+    """Return the stored pyramid for source_path, or None if it is missing or stale."""
+    directory = _pyramid_dir(source_path)
+    try:
+        with open(os.path.join(directory, "pyramid.json")) as f:
+            header = json.load(f)
+        mtime_ns, size = _source_signature(source_path)
+    except (OSError, ValueError):
+        return None
+    if (header.get("version") != PYRAMID_VERSION
+            or header.get("source_mtime_ns") != mtime_ns
+            or header.get("source_size") != size
+            or header.get("tile_size") != tile_size):
+        return None
+    try:
+        return TilePyramid(directory, header)
+    except (OSError, ValueError):
+        return None
+
+
+def get_pyramid(source_path, tile_size=TILE_SIZE):
+    """Open the pyramid for source_path, building it once if needed."""
+    pyramid = open_pyramid(source_path, tile_size)
+    if pyramid is not None:
+        return pyramid
+
+    key = os.path.realpath(source_path)
+    with _build_locks_lock:
+        lock = _build_locks.setdefault(key, threading.Lock())
+    with lock:
+        # Another request may have finished the build while we waited
+        pyramid = open_pyramid(source_path, tile_size)
+        if pyramid is None:
+            pyramid = build_pyramid(source_path, tile_size)
+        return pyramid
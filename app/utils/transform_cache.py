@@ -0,0 +1,122 @@
+import os
+import json
+import hashlib
+import uuid
+import logging
+import numpy as np
+import SimpleITK as sitk
+from app.config import TRANSFORM_CACHE_DIR, TRANSFORM_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+
+def volume_digest(data, spacing):
+    """
+    Content hash of a volume: its shape, dtype, spacing and voxel values.
+
+    data is an array or a list of 2D slices; it is hashed one sub-array
+    along the first axis at a time, so strided or memory-mapped volumes
+    are never copied whole.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    slices = data if isinstance(data, list) else [data[i] for i in range(data.shape[0])]
+    shape = [len(slices)] + list(np.shape(slices[0]))
+    digest.update(json.dumps({
+        "shape": shape,
+        "dtype": str(np.asarray(slices[0]).dtype),
+        "spacing": [float(s) for s in spacing]
+    }).encode())
+    for block in slices:
+        digest.update(np.ascontiguousarray(block).data)
+    return digest.hexdigest()
+
+
+def transform_key(fixed_digest, moving_digest, parameters):
+    """Cache key, and transform_id, of registering moving onto fixed with parameters."""
+    payload = json.dumps([fixed_digest, moving_digest, parameters], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+class TransformCache:
+    """
+    Registration transforms on disk, keyed by transform_key.
+
+    Each entry is a SimpleITK .tfm file plus a JSON file with the
+    registration report. Entries are touched when read, and the least
+    recently used ones are removed beyond max_entries.
+    """
+
+    def __init__(self, root=TRANSFORM_CACHE_DIR, max_entries=TRANSFORM_CACHE_MAX_ENTRIES):
+        self.root = root
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _paths(self, key):
+        # Keys are hex digests; anything else is not a cache entry
+        if not key or not all(c in "0123456789abcdef" for c in key):
+            raise KeyError(key)
+        base = os.path.join(self.root, key)
+        return f"{base}.tfm", f"{base}.json"
+
+    def get(self, key):
+        """Return (transform, report) for key; raises KeyError if it is not cached."""
+        transform_path, report_path = self._paths(key)
+        if not os.path.exists(transform_path):
+            self.misses += 1
+            raise KeyError(key)
+        try:
+            transform = sitk.ReadTransform(transform_path)
+            with open(report_path) as f:
+                report = json.load(f)
+        except (OSError, RuntimeError, ValueError):
+            self.misses += 1
+            raise KeyError(key)
+        os.utime(transform_path)
+        self.hits += 1
+        return transform, report
+
+    def put(self, key, transform, report):
+        transform_path, report_path = self._paths(key)
+        # Unique per writer: concurrent registrations can produce the same key
+        tmp_suffix = f".{uuid.uuid4().hex}.tmp"
+        # WriteTransform picks the format from the extension, so the temp name keeps it
+        tmp_transform = f"{transform_path[:-4]}{tmp_suffix}.tfm"
+        sitk.WriteTransform(transform, tmp_transform)
+        with open(report_path + tmp_suffix, "w") as f:
+            json.dump(report, f)
+        os.replace(report_path + tmp_suffix, report_path)
+        os.replace(tmp_transform, transform_path)
+        self._prune()
+
+    def _prune(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith(".tfm") and ".tmp" not in name:
+                path = os.path.join(self.root, name)
+                try:
+                    entries.append((os.path.getmtime(path), name[:-4]))
+                except FileNotFoundError:
+                    continue
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, key in entries[:len(entries) - self.max_entries]:
+            for path in self._paths(key):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            logger.info(f"Evicted cached transform {key}")
+
+    def stats(self):
+        return {
+            "entries": sum(1 for name in os.listdir(self.root) if name.endswith(".tfm") and ".tmp" not in name),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+transform_cache = TransformCache()
@@ -0,0 +1,145 @@
+import json
+import struct
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+BINARY_MEDIA_TYPE = "application/octet-stream"
+RESPONSE_FORMATS = ("json", "binary")
+
+# Headers the browser needs to read a binary volume response cross-origin
+BINARY_HEADERS = ["X-Image-Shape", "X-Image-Dtype", "X-Image-Metadata"]
+
+# Media type of the framed preview-then-full-resolution stream
+PROGRESSIVE_MEDIA_TYPE = "application/x-progressive-volume"
+
+# Number of slices sent per chunk of a binary response
+SLICES_PER_CHUNK = 8
+
+
+def validate_response_format(response_format):
+    """Raise a 400 error for an unknown response format."""
+    if response_format not in RESPONSE_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported format '{response_format}'. Supported formats: {', '.join(RESPONSE_FORMATS)}"
+        )
+
+
+def to_slice_major(data):
+    """
+    Return the image as a C-contiguous float32 array of shape (slices, rows, cols).
+
+    Slice i matches data[:, :, i] of a 3D volume. This copies the whole
+    volume unless its slices already lie one after another in memory, so
+    it is only meant for small volumes such as previews; responses stream
+    larger volumes with iter_volume_bytes.
+    """
+    if data.ndim == 2:
+        data = data[np.newaxis]
+    else:
+        data = np.moveaxis(data, 2, 0)
+    return np.ascontiguousarray(data, dtype=np.float32)
+
+
+def iter_volume_bytes(data, slices_per_chunk=SLICES_PER_CHUNK):
+    """
+    Yield the little-endian float32 bytes of a 2D image or (rows, cols, slices)
+    volume, slice after slice, a few slices at a time.
+
+    Only one chunk of slices is converted at once, so the volume is never
+    copied whole whatever its memory layout or dtype.
+    """
+    if data.ndim == 2:
+        data = data[:, :, np.newaxis]
+    chunk = np.empty((min(slices_per_chunk, data.shape[2]),) + data.shape[:2], dtype='<f4')
+    for start in range(0, data.shape[2], slices_per_chunk):
+        block = data[:, :, start:start + slices_per_chunk]
+        out = chunk[:block.shape[2]]
+        np.copyto(out, np.moveaxis(block, 2, 0), casting='unsafe')
+        yield out.tobytes()
+
+
+def _binary_headers(shape, metadata, headers=None):
+    response_headers = {
+        "Content-Length": str(int(np.prod(shape)) * 4),
+        "X-Image-Shape": ",".join(str(dim) for dim in shape),
+        "X-Image-Dtype": "float32",
+        "X-Image-Metadata": json.dumps(metadata),
+        "Cache-Control": "no-cache",
+    }
+    if headers:
+        response_headers.update(headers)
+    return response_headers
+
+
+def binary_volume_response(data, metadata, headers=None):
+    """
+    Stream an image volume as raw little-endian float32 slices.
+
+    The body is the slices concatenated in order, each stored row-major.
+    Shape (slices, rows, cols), dtype and the JSON metadata are sent in
+    response headers so the client can allocate its buffer up front.
+    """
+    shape = (1,) + data.shape if data.ndim == 2 else (data.shape[2],) + data.shape[:2]
+    return StreamingResponse(
+        iter_volume_bytes(data),
+        media_type=BINARY_MEDIA_TYPE,
+        headers=_binary_headers(shape, metadata, headers)
+    )
+
+
+def binary_slices_response(slices, shape, metadata, headers=None):
+    """
+    Stream slices produced one at a time, e.g. read lazily from disk.
+
+    Uses the same body layout and headers as binary_volume_response, so
+    only one slice has to be held in memory while the response is sent.
+    """
+    def iter_slice_bytes():
+        for slice_data in slices:
+            yield np.ascontiguousarray(slice_data, dtype='<f4').tobytes()
+
+    return StreamingResponse(
+        iter_slice_bytes(),
+        media_type=BINARY_MEDIA_TYPE,
+        headers=_binary_headers(shape, metadata, headers)
+    )
+
+
+def _frame_header(stage, shape, metadata):
+    """Length-prefixed JSON header that precedes the float32 payload of a stage."""
+    header = json.dumps({
+        "stage": stage,
+        "shape": [int(dim) for dim in shape],
+        "dtype": "float32",
+        "metadata": metadata
+    }).encode('utf-8')
+    return struct.pack('<I', len(header)) + header
+
+
+def progressive_volume_response(preview, preview_metadata, slices, shape, metadata, headers=None):
+    """
+    Stream a downsampled preview first, then the full-resolution slices.
+
+    The body is two frames. Each frame starts with a little-endian uint32
+    byte count and a JSON header of that length giving the stage ("preview"
+    or "full"), the slice-major shape, the dtype and the metadata; the raw
+    little-endian float32 slices follow, laid out as in
+    binary_volume_response. The preview is sent before the first
+    full-resolution slice is read.
+    """
+    preview = to_slice_major(preview)
+    if preview.dtype.byteorder == '>':
+        preview = preview.astype('<f4')
+
+    def iter_frames():
+        yield _frame_header("preview", preview.shape, preview_metadata) + preview.tobytes()
+        yield _frame_header("full", shape, metadata)
+        for slice_data in slices:
+            yield np.ascontiguousarray(slice_data, dtype='<f4').tobytes()
+
+    response_headers = {"Cache-Control": "no-cache"}
+    if headers:
+        response_headers.update(headers)
+    return StreamingResponse(iter_frames(), media_type=PROGRESSIVE_MEDIA_TYPE, headers=response_headers)
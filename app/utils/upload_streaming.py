@@ -0,0 +1,241 @@
+import os
+import hashlib
+import tempfile
+import zlib
+import logging
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from multipart.multipart import MultipartParser, parse_options_header
+from app.config import MAX_UPLOAD_SIZE, MAX_DECOMPRESSED_SIZE, SUPPORTED_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+# Allowance for multipart boundaries and part headers on top of the file size
+MULTIPART_OVERHEAD = 64 * 1024
+
+# OpenAPI description of the multipart body, since the routes read the raw stream
+UPLOAD_OPENAPI_EXTRA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}}
+                }
+            }
+        }
+    }
+}
+
+
+def file_suffix(filename):
+    """Return the file extension, treating .nii.gz as a single suffix."""
+    filename = filename.lower()
+    if filename.endswith('.nii.gz'):
+        return '.nii.gz'
+    return os.path.splitext(filename)[1]
+
+
+class ReceivedUpload:
+    """
+    Destination for one uploaded file, written to disk as it arrives.
+
+    Enforces the upload size limit on the received bytes. When gunzip is
+    set, .nii.gz data is decompressed incrementally and stored as .nii, so
+    the compressed upload is never buffered as a whole. A SHA-256 digest of
+    the received bytes is computed along the way. The file gets a unique
+    name in directory (the system temp directory by default), never the
+    client's filename, so concurrent uploads of the same name stay apart.
+    """
+
+    def __init__(self, filename, directory=None, gunzip=False,
+                 max_size=MAX_UPLOAD_SIZE, max_decompressed_size=MAX_DECOMPRESSED_SIZE):
+        self.filename = filename
+        self.max_size = max_size
+        self.max_decompressed_size = max_decompressed_size
+        self.bytes_received = 0
+        self.bytes_written = 0
+        self._hash = hashlib.sha256()
+
+        suffix = file_suffix(filename)
+        self._decompressor = None
+        if gunzip and suffix == '.nii.gz':
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            suffix = '.nii'
+        self.suffix = suffix
+
+        handle = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=directory)
+        self.path = handle.name
+        self._file = handle
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self.bytes_received += len(data)
+        if self.bytes_received > self.max_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File exceeds the maximum upload size of {self.max_size} bytes"
+            )
+        self._hash.update(data)
+
+        if self._decompressor is not None:
+            data = self._decompress(data)
+        self.bytes_written += len(data)
+        if self.bytes_written > self.max_decompressed_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Decompressed file exceeds the maximum size of {self.max_decompressed_size} bytes"
+            )
+        self._file.write(data)
+
+    def _decompress(self, data):
+        try:
+            output = self._decompressor.decompress(data)
+            # Concatenated gzip members each need a fresh decompressor
+            while self._decompressor.eof and self._decompressor.unused_data:
+                remaining = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                output += self._decompressor.decompress(remaining)
+            return output
+        except zlib.error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid gzip data: {str(e)}")
+
+    def finish(self):
+        if self._decompressor is not None and self.bytes_received:
+            self._file.write(self._decompressor.flush())
+            if not self._decompressor.eof:
+                raise HTTPException(status_code=400, detail="Truncated gzip data")
+        self._file.close()
+
+    def discard(self):
+        """Close and delete the file, e.g. after an error."""
+        self._file.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class _UploadStreamParser:
+    """Multipart callbacks that route the file part into a ReceivedUpload."""
+
+    def __init__(self, field_name, make_upload):
+        self.field_name = field_name
+        self.make_upload = make_upload
+        self.upload = None
+        self.pending = []
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._in_file_part = False
+
+    def on_part_begin(self):
+        self._disposition = b""
+        self._in_file_part = False
+
+    def on_header_field(self, data, start, end):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        if options.get(b"name", b"").decode("latin-1") != self.field_name or b"filename" not in options:
+            return
+        if self.upload is not None:
+            raise HTTPException(status_code=400, detail="Only one file can be uploaded per request")
+        filename = os.path.basename(options[b"filename"].decode("utf-8", errors="replace").replace('\\', '/'))
+        self.upload = self.make_upload(filename)
+        self._in_file_part = True
+
+    def on_part_data(self, data, start, end):
+        if self._in_file_part:
+            self.pending.append(data[start:end])
+
+    def on_part_end(self):
+        self._in_file_part = False
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+
+async def receive_upload(request: Request, field_name="file", destination_dir=None,
+                         gunzip=False, max_size=MAX_UPLOAD_SIZE,
+                         allowed_extensions=SUPPORTED_EXTENSIONS):
+    """
+    Stream a multipart file upload straight to disk.
+
+    The request body is parsed chunk by chunk as it arrives, so memory use
+    is bounded by the chunk size. Requests are rejected with 413 as soon as
+    the declared Content-Length or the received bytes pass max_size, and
+    with 400 as soon as the filename shows an unsupported type.
+
+    Returns a ReceivedUpload whose path holds the written file, under a
+    unique name in destination_dir (default: the temp directory). The
+    caller must delete it.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Request exceeds the maximum upload size of {max_size} bytes"
+        )
+
+    def make_upload(filename):
+        if not any(filename.lower().endswith(ext) for ext in allowed_extensions):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported file type. Supported formats are: {', '.join(allowed_extensions)}"
+            )
+        return ReceivedUpload(filename, directory=destination_dir, gunzip=gunzip, max_size=max_size)
+
+    handler = _UploadStreamParser(field_name, make_upload)
+    parser = MultipartParser(params[b"boundary"], handler.callbacks())
+
+    def write_pending():
+        for data in handler.pending:
+            handler.upload.write(data)
+        handler.pending.clear()
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if handler.pending:
+                await run_in_threadpool(write_pending)
+        parser.finalize()
+
+        if handler.upload is None:
+            raise HTTPException(status_code=400, detail=f"Missing '{field_name}' file in upload")
+        await run_in_threadpool(handler.upload.finish)
+    except Exception:
+        if handler.upload is not None:
+            handler.upload.discard()
+        raise
+
+    logger.info(
+        f"Received {handler.upload.filename}: {handler.upload.bytes_received} bytes "
+        f"({handler.upload.bytes_written} bytes written)"
+    )
+    return handler.upload
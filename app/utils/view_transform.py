@@ -0,0 +1,172 @@
+import json
+import hashlib
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Operations a view can be composed from, see apply_view_operations
+VIEW_OPERATIONS = ("rotate", "flip", "permute", "crop", "reset")
+
+
+def identity_view(shape):
+    """
+    The view showing a volume of the given shape as it is stored.
+
+    A view describes a rotated, flipped, transposed and cropped volume
+    without copying it: output axis i runs over source axis axes[i],
+    starting at source index start[i] in steps of step[i] (1 or -1), for
+    shape[i] voxels. Views are plain JSON data, kept in the image store
+    next to the volume they apply to.
+    """
+    ndim = len(shape)
+    return {
+        "axes": list(range(ndim)),
+        "start": [0] * ndim,
+        "step": [1] * ndim,
+        "shape": [int(size) for size in shape]
+    }
+
+
+def is_identity(view, source_shape):
+    return view == identity_view(source_shape)
+
+
+def _copy(view):
+    return {key: list(values) for key, values in view.items()}
+
+
+def _check_axis(view, axis):
+    if not isinstance(axis, int) or isinstance(axis, bool) or not 0 <= axis < len(view["axes"]):
+        raise ValueError(f"Axis must be an integer between 0 and {len(view['axes']) - 1}")
+
+
+def _flip(view, axis):
+    _check_axis(view, axis)
+    view["start"][axis] += view["step"][axis] * (view["shape"][axis] - 1)
+    view["step"][axis] = -view["step"][axis]
+
+
+def _permute(view, order):
+    if not isinstance(order, list) or sorted(order) != list(range(len(view["axes"]))):
+        raise ValueError(f"Axes must be a permutation of 0-{len(view['axes']) - 1}")
+    for key in ("axes", "start", "step", "shape"):
+        view[key] = [view[key][axis] for axis in order]
+
+
+def _rotate(view, angle):
+    """Rotate in the rows/cols plane like np.rot90(volume, angle // 90)."""
+    if not isinstance(angle, int) or isinstance(angle, bool) or angle % 90 != 0:
+        raise ValueError("Rotation angle must be a multiple of 90 degrees")
+    order = list(range(len(view["axes"])))
+    order[0], order[1] = 1, 0
+    for _ in range((angle // 90) % 4):
+        _flip(view, 1)
+        _permute(view, order)
+
+
+def _crop(view, start, stop):
+    """Keep [start[i], stop[i]) along every output axis i; None keeps an end as it is."""
+    ndim = len(view["axes"])
+    start = start if start is not None else [None] * ndim
+    stop = stop if stop is not None else [None] * ndim
+    if not isinstance(start, list) or not isinstance(stop, list) or len(start) != ndim or len(stop) != ndim:
+        raise ValueError(f"Crop start and stop must list {ndim} bounds")
+    bounds = []
+    for axis in range(ndim):
+        size = view["shape"][axis]
+        low = 0 if start[axis] is None else start[axis]
+        high = size if stop[axis] is None else stop[axis]
+        if not all(isinstance(b, int) and not isinstance(b, bool) for b in (low, high)) or not 0 <= low < high <= size:
+            raise ValueError(f"Crop bounds of axis {axis} must satisfy 0 <= start < stop <= {size}")
+        bounds.append((low, high))
+    for axis, (low, high) in enumerate(bounds):
+        view["start"][axis] += view["step"][axis] * low
+        view["shape"][axis] = high - low
+
+
+def apply_view_operations(view, operations, source_shape):
+    """
+    Compose operations onto view and return the new view; view is left as is.
+
+    Each operation is a dict: {"op": "rotate", "angle": 90} rotates in
+    the rows/cols plane, {"op": "flip", "axis": i} reverses an axis,
+    {"op": "permute", "axes": [...]} reorders the axes, {"op": "crop",
+    "start": [...], "stop": [...]} keeps a box of the current view and
+    {"op": "reset"} returns to the volume as stored (source_shape). All
+    axes refer to the view as it is before the operation. Raises
+    ValueError for an invalid operation.
+    """
+    view = _copy(view)
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get("op") not in VIEW_OPERATIONS:
+            raise ValueError(f"Unsupported view operation: {operation}. Expected op to be one of "
+                             f"{', '.join(VIEW_OPERATIONS)}")
+        op = operation["op"]
+        if op == "rotate":
+            _rotate(view, operation.get("angle"))
+        elif op == "flip":
+            _flip(view, operation.get("axis"))
+        elif op == "permute":
+            _permute(view, operation.get("axes"))
+        elif op == "crop":
+            _crop(view, operation.get("start"), operation.get("stop"))
+        else:
+            view = identity_view(source_shape)
+    return view
+
+
+def as_volume(data):
+    """Stored image data as a (rows, cols, slices) array; only a list of slices is copied."""
+    if isinstance(data, list):
+        return np.stack(data, axis=2)
+    return data[:, :, np.newaxis] if data.ndim == 2 else data
+
+
+def volume_shape(data):
+    """(rows, cols, slices) shape of stored image data, without stacking a list of slices."""
+    if isinstance(data, list):
+        return tuple(np.shape(data[0])) + (len(data),)
+    return as_volume(data).shape
+
+
+def _strided(array, axes, start, step, shape):
+    array = array.transpose(axes)
+    index = []
+    for first, stride, size in zip(start, step, shape):
+        last = first + stride * size
+        index.append(slice(first, last if last >= 0 else None, stride))
+    return array[tuple(index)]
+
+
+def view_array(volume, view):
+    """volume, a (rows, cols, slices) array, as seen through view; a NumPy view, never a copy."""
+    return _strided(volume, view["axes"], view["start"], view["step"], view["shape"])
+
+
+def view_slice(data, view, index):
+    """
+    Slice index (along the last axis of view) of stored image data.
+
+    data is a (rows, cols, slices) array or a list of 2D slices. While
+    the view keeps the source's slice axis last, a list is read one slice
+    at a time; otherwise it has to be stacked first.
+    """
+    if not 0 <= index < view["shape"][2]:
+        raise IndexError(f"Slice {index} out of range")
+    if isinstance(data, list) and view["axes"][2] == 2:
+        source = np.asarray(data[view["start"][2] + view["step"][2] * index])
+        return _strided(source, view["axes"][:2], view["start"][:2], view["step"][:2], view["shape"][:2])
+    return view_array(as_volume(data), view)[:, :, index]
+
+
+def view_spacing(spacing, view):
+    """Voxel dimensions of the source, in the order of the view's axes."""
+    return [spacing[axis] for axis in view["axes"]]
+
+
+def view_digest(digest, view, source_shape):
+    """Content hash of a volume seen through view, from the content hash of the volume itself."""
+    if is_identity(view, source_shape):
+        return digest
+    return hashlib.blake2b(json.dumps([digest, view], sort_keys=True).encode(), digest_size=20).hexdigest()
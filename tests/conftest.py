@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+# Point every on-disk store at a scratch directory before app.config is imported
+_SCRATCH = tempfile.mkdtemp(prefix="viewer-tests-")
+for name, sub in [("IMAGES_DIR", "images"), ("UPLOAD_DIR", "images/uploads"), ("IMAGE_STORE_DIR", "store"),
+                  ("SIDECAR_CACHE_DIR", "sidecars"), ("TILE_CACHE_DIR", "tiles"),
+                  ("TRANSFORM_CACHE_DIR", "transforms"), ("REGISTRATION_JOB_DIR", "jobs")]:
+    os.environ.setdefault(name, os.path.join(_SCRATCH, sub))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_SCRATCH, 'index.db')}")
+os.environ.setdefault("INDEX_SCAN_ON_STARTUP", "false")
+os.environ.setdefault("SIDECAR_SCAN_ON_STARTUP", "false")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
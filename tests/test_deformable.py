@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import SimpleITK as sitk
+from app.utils.image_processing import displacement_magnitude, estimate_bspline_transform
+from app.utils.transform_cache import TransformCache, transform_key
+
+
+def _image(shift=0):
+    volume = np.zeros((10, 24, 24), dtype=np.float32)  # slice-major
+    volume[3:7, 6 + shift:16 + shift, 8:18] = 100.0
+    image = sitk.GetImageFromArray(volume)
+    image.SetSpacing((1.0, 1.0, 2.0))
+    return image
+
+
+@pytest.fixture(scope="module")
+def deformable():
+    fixed, moving = _image(), _image(1)
+    rigid = sitk.Euler3DTransform()
+    rigid.SetTranslation((0.0, 0.5, 0.0))
+    return fixed, estimate_bspline_transform(fixed, moving, rigid, grid_size=2, shrink_factor=1,
+                                             iterations=5, threads=1)
+
+
+def test_bspline_is_composed_after_the_rigid_transform(deformable):
+    fixed, (transform, bspline, report) = deformable
+    assert transform.GetNumberOfTransforms() == 2
+    assert transform.GetNthTransform(0).GetName() == "Euler3DTransform"
+    assert transform.GetNthTransform(1).GetName() == "BSplineTransform"
+    assert [level["shrink_factor"] for level in report["levels"]] == [2, 1]
+    assert report["grid_size"] == 2 and report["final_metric_value"] is not None
+    assert all(1 <= level["iterations"] <= 5 for level in report["levels"])
+
+
+def test_composite_round_trips_through_the_transform_cache(tmp_path, deformable):
+    fixed, (transform, bspline, report) = deformable
+    cache = TransformCache(root=str(tmp_path))
+    key = transform_key("fixed", "moving", {"mode": "deformable", "grid_size": 2})
+    cache.put(key, transform, report)
+
+    loaded, loaded_report = cache.get(key)
+    loaded = sitk.CompositeTransform(loaded)
+    assert loaded_report == report
+    assert loaded.GetNumberOfTransforms() == 2
+    assert np.allclose(loaded.GetNthTransform(1).GetParameters(), bspline.GetParameters())
+    for point in [(0.0, 0.0, 0.0), (11.5, 10.0, 9.0), (20.0, 3.0, 17.0)]:
+        assert np.allclose(loaded.TransformPoint(point), transform.TransformPoint(point))
+    # The displacement is computed from the loaded B-spline as from the original one
+    assert np.allclose(displacement_magnitude(loaded.GetNthTransform(1), fixed, threads=1),
+                       displacement_magnitude(bspline, fixed, threads=1))
+
+
+def test_displacement_magnitude_of_a_uniform_shift():
+    reference = _image()
+    bspline = sitk.BSplineTransformInitializer(reference, [2, 2, 2], order=3)
+    count = len(bspline.GetParameters()) // 3
+    # Parameters are all x offsets, then all y, then all z
+    bspline.SetParameters([3.0] * count + [4.0] * count + [0.0] * count)
+    magnitude = displacement_magnitude(bspline, reference, threads=1)
+    assert magnitude.shape == (10, 24, 24) and magnitude.dtype == np.float32
+    assert np.allclose(magnitude, 5.0, atol=1e-4)
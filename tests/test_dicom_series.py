@@ -0,0 +1,58 @@
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+from app.utils.dicom_series import describe_series, load_dicom_series, scan_series
+
+
+def _write_slice(path, series_uid, pixels, z, instance, slope=1.0, intercept=0.0):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = MRImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = MRImageStorage
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.SeriesInstanceUID = series_uid
+    ds.Modality = "MR"
+    ds.InstanceNumber = instance
+    ds.ImagePositionPatient = [0.0, 0.0, z]
+    ds.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+    ds.PixelSpacing = [0.5, 0.75]
+    ds.SliceThickness = 5.0
+    ds.RescaleSlope = slope
+    ds.RescaleIntercept = intercept
+    ds.Rows, ds.Columns = pixels.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.PixelData = pixels.astype(np.uint16).tobytes()
+    ds.save_as(str(path), write_like_original=False)
+
+
+def test_series_is_grouped_sorted_and_rescaled(tmp_path):
+    rng = np.random.default_rng(0)
+    volume = rng.integers(0, 1000, (6, 5, 4)).astype(np.uint16)
+    series_uid, other_uid = generate_uid(), generate_uid()
+    # Written out of order, with instance numbers that disagree with the positions
+    for name, index in zip("dbca", range(4)):
+        z = 2.0 * (3 - index)
+        _write_slice(tmp_path / f"{name}.dcm", series_uid, volume[:, :, 3 - index], z, instance=index + 1,
+                     slope=2.0, intercept=-10.0)
+    _write_slice(tmp_path / "other.dcm", other_uid, volume[:, :, 0], 0.0, instance=1)
+    (tmp_path / "notes.txt").write_text("not dicom")
+
+    series = scan_series(str(tmp_path), max_workers=2)
+    assert {uid: len(files) for uid, files in series.items()} == {series_uid: 4, other_uid: 1}
+    assert describe_series(series)[0]["series_uid"] == series_uid
+
+    data, metadata = load_dicom_series(str(tmp_path), max_workers=2)
+    assert metadata["series_uid"] == series_uid and data.shape == (6, 5, 4)
+    assert np.array_equal(data, volume * 2.0 - 10.0)
+    assert metadata["voxel_dimensions"] == [0.5, 0.75, 2.0]
+
+    single, single_metadata = load_dicom_series(str(tmp_path), series_uid=other_uid)
+    assert single.shape == (6, 5) and single_metadata["total_slices"] == 1
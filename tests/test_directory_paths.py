@@ -0,0 +1,27 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from app.main import app
+from app.routes.directory import _images_path
+
+
+@pytest.mark.parametrize("path", ["../../..", "images/../app", "scans/../../app/main.py", "..\\..\\etc"])
+def test_paths_outside_the_images_directory_are_rejected(path):
+    with pytest.raises(HTTPException) as error:
+        _images_path(path)
+    assert error.value.status_code == 403
+
+
+def test_paths_inside_the_images_directory_resolve():
+    path, file_path = _images_path("scans/../scan.nii")
+    assert path == "images/scans/../scan.nii" and file_path.endswith("images/scans/../scan.nii")
+
+
+@pytest.mark.parametrize("url", [
+    "/api/load/series?path=../../..",
+    "/api/load?path=../app/main.py",
+    "/api/load/metadata?path=../../etc/scan.nii",
+    "/api/tiles/info?path=../app/static/x.png",
+])
+def test_load_routes_reject_escapes(url):
+    assert TestClient(app).get(url).status_code == 403
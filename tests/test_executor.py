@@ -0,0 +1,48 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
+from app.utils.executor import WorkerPools
+
+
+def test_operations_do_not_share_threads():
+    pools = WorkerPools(thread_workers=1, process_workers=0, limits="slow=1:4,fast=2:4")
+    release = threading.Event()
+
+    async def main():
+        slow = asyncio.ensure_future(pools.run("slow", release.wait, 5))
+        await asyncio.sleep(0.05)
+        # A running slow call must not hold up other operations
+        name = await asyncio.wait_for(pools.run("fast", lambda: threading.current_thread().name), 2)
+        release.set()
+        await slow
+        return name
+
+    try:
+        assert asyncio.run(main()).startswith("worker-fast")
+        assert pools.stats()["thread_workers"] == 3
+    finally:
+        release.set()
+        pools.shutdown()
+
+
+def test_saturated_operation_is_rejected():
+    pools = WorkerPools(thread_workers=1, process_workers=0, limits="slow=1:1")
+    release = threading.Event()
+
+    async def main():
+        running = [asyncio.ensure_future(pools.run("slow", release.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException) as error:
+            await pools.run("slow", release.wait, 5)
+        release.set()
+        await asyncio.gather(*running)
+        return error.value
+
+    try:
+        error = asyncio.run(main())
+        assert error.status_code == 503 and "Retry-After" in error.headers
+        assert pools.operation("slow").stats()["rejected"] == 1
+    finally:
+        release.set()
+        pools.shutdown()
@@ -0,0 +1,66 @@
+import nibabel as nib
+from nibabel.openers import ImageOpener
+import numpy as np
+import pytest
+from app.utils.file_handling import LazyNiftiVolume, read_nifti_data
+
+
+def _save(path, data, slope=None, inter=None):
+    img = nib.Nifti1Image(data, np.eye(4))
+    if slope is not None:
+        img.header.set_slope_inter(slope, inter)
+    nib.save(img, str(path))
+    return str(path)
+
+
+@pytest.mark.parametrize("suffix", [".nii", ".nii.gz"])
+def test_lazy_slices_match_full_read(tmp_path, suffix):
+    data = np.random.default_rng(0).integers(0, 3000, (24, 20, 12)).astype(np.int16)
+    path = _save(tmp_path / f"vol{suffix}", data, slope=2.0, inter=-5.0)
+    expected = read_nifti_data(nib.load(path))
+
+    volume = LazyNiftiVolume(path)
+    assert volume.shape == (24, 20, 12)
+    streamed = list(volume.iter_slices())
+    assert all(s.dtype == np.float32 for s in streamed)
+    assert np.array_equal(np.stack(streamed, axis=2), expected)
+    # Random access, including going back to an earlier slice
+    for index in (7, 9, 2, 11, 0):
+        assert np.array_equal(volume.get_slice(index), expected[:, :, index])
+
+
+def test_lazy_reads_first_time_point_of_4d_gzip(tmp_path):
+    data = np.random.default_rng(1).normal(size=(10, 8, 5, 3)).astype(np.float32)
+    volume = LazyNiftiVolume(_save(tmp_path / "vol4d.nii.gz", data))
+    assert np.array_equal(np.stack(list(volume.iter_slices()), axis=2), data[..., 0])
+
+
+def test_gzip_iteration_reads_one_forward_stream(tmp_path, monkeypatch):
+    data = np.random.default_rng(2).integers(0, 3000, (32, 24, 20)).astype(np.int16)
+    path = _save(tmp_path / "vol.nii.gz", data)
+    volume = LazyNiftiVolume(path)
+    opens, seeks = [], []
+    init, seek = ImageOpener.__init__, ImageOpener.seek
+
+    def counting_init(self, *args, **kwargs):
+        opens.append(args[0] if args else None)
+        init(self, *args, **kwargs)
+
+    def recording_seek(self, offset, whence=0):
+        seeks.append((offset, whence))
+        return seek(self, offset, whence)
+
+    monkeypatch.setattr(ImageOpener, "__init__", counting_init)
+    monkeypatch.setattr(ImageOpener, "seek", recording_seek)
+
+    assert np.array_equal(np.stack(list(volume.iter_slices()), axis=2), data)
+    # Decompressing from the start for every slice would open the file 20 times
+    assert len(opens) == 1
+    assert seeks == [(volume.img.dataobj.offset, 0)]
+
+    # Skipping ahead continues the stream; only going back reopens it
+    opens.clear()
+    for index in (2, 5, 6, 1):
+        assert np.array_equal(volume.get_slice(index), data[:, :, index])
+    assert len(opens) == 2
+    volume.close()
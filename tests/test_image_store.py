@@ -0,0 +1,84 @@
+import numpy as np
+from app.utils.image_store import ImageStore
+
+
+def _volume(value, shape=(8, 8, 4)):
+    return np.full(shape, value, dtype=np.int16)
+
+
+def test_put_and_get_round_trip(tmp_path):
+    store = ImageStore(root=str(tmp_path), max_bytes=1 << 20, ttl_seconds=0)
+    slices = [np.arange(6, dtype=np.float32).reshape(2, 3) + i for i in range(3)]
+    store.put("a", {"data": _volume(7), "slices": slices, "window_center": 40.0}, session_id="s1")
+
+    image = store["a"]
+    assert np.array_equal(image["data"], _volume(7)) and image["data"].dtype == np.int16
+    assert isinstance(image["slices"], list) and np.array_equal(image["slices"][2], slices[2])
+    assert image["window_center"] == 40.0
+    assert store.session_images("s1") == ["a"] and "a" in store and len(store) == 1
+    assert store.release_session("s1") == ["a"]
+    assert store.get("a") is None
+
+
+def test_over_budget_images_are_unmapped_not_removed(tmp_path):
+    nbytes = _volume(0).nbytes
+    store = ImageStore(root=str(tmp_path), max_bytes=2 * nbytes, ttl_seconds=0)
+    for i in range(4):
+        store.put(f"img{i}", {"data": _volume(i)})
+        store[f"img{i}"]
+
+    stats = store.stats()
+    assert stats["entries"] == 4 and stats["evictions"] == 2
+    assert stats["mapped_bytes"] <= 2 * nbytes
+    # Unmapped images are mapped again rather than answering 404
+    for i in range(4):
+        assert np.array_equal(store[f"img{i}"]["data"], _volume(i))
+
+
+def test_scalar_updates_keep_version_and_are_seen_by_other_workers(tmp_path):
+    store = ImageStore(root=str(tmp_path), max_bytes=1 << 20, ttl_seconds=0)
+    other_worker = ImageStore(root=str(tmp_path), max_bytes=1 << 20, ttl_seconds=0)
+    released = []
+    store.add_release_hook(released.append)
+    store.put("a", {"data": _volume(1), "window_center": 0.0})
+    version = store["a"]["version"]
+    other_worker["a"]
+
+    store.update("a", window_center=50.0, window_presets={"auto": 1})
+    assert store["a"]["version"] == version and released == []
+    assert other_worker["a"]["window_center"] == 50.0
+    store.update("a", window_presets=None)
+    assert "window_presets" not in other_worker["a"]
+
+    # Replacing an array bumps the version and releases derived caches
+    store.update("a", data=_volume(2))
+    assert store["a"]["version"] == version + 1 and released == ["a"]
+    assert np.array_equal(other_worker["a"]["data"], _volume(2))
+    assert other_worker["a"]["window_center"] == 50.0
+
+
+def test_toggling_the_window_reuses_cached_renders(tmp_path):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.routes.image import image_storage, encoded_slice_cache, rendered_slice_cache
+
+    image_storage.put("window-toggle", {
+        "data": np.random.default_rng(0).integers(0, 1000, (16, 16, 2)).astype(np.int16),
+        "window_center": 500.0, "window_width": 1000.0, "total_slices": 2
+    })
+    client = TestClient(app)
+    windows = [(500.0, 1000.0), (200.0, 400.0)]
+    for center, width in windows:
+        assert client.post("/api/window-level", params={
+            "image_id": "window-toggle", "window_center": center, "window_width": width}).status_code == 200
+        assert client.get("/api/slice/0", params={"image_id": "window-toggle"}).status_code == 200
+
+    hits, misses = encoded_slice_cache.hits, encoded_slice_cache.misses
+    render_misses = rendered_slice_cache.misses
+    for center, width in windows * 2:
+        client.post("/api/window-level", params={
+            "image_id": "window-toggle", "window_center": center, "window_width": width})
+        assert client.get("/api/slice/0", params={"image_id": "window-toggle"}).status_code == 200
+    assert encoded_slice_cache.hits - hits == 4 and encoded_slice_cache.misses == misses
+    assert rendered_slice_cache.misses == render_misses
+    image_storage.pop("window-toggle")
@@ -0,0 +1,44 @@
+import os
+import threading
+import nibabel as nib
+import numpy as np
+from fastapi.testclient import TestClient
+from PIL import Image
+from app.utils.metadata_index import MetadataIndex, get_metadata_index
+
+
+def _index(tmp_path):
+    root = tmp_path / "images"
+    (root / "sub").mkdir(parents=True)
+    nib.save(nib.Nifti1Image(np.zeros((6, 5, 4), np.int16), np.eye(4)), str(root / "sub" / "vol.nii.gz"))
+    Image.new("L", (7, 3)).save(root / "flat.png")
+    return root, MetadataIndex(str(root), database_url=f"sqlite:///{tmp_path / 'index.db'}")
+
+
+def test_refresh_indexes_headers_and_skips_unchanged_files(tmp_path):
+    root, index = _index(tmp_path)
+    assert index.refresh() == 2
+    total, entries = index.query("", recursive=True)
+    by_name = {entry["name"]: entry for entry in entries}
+    assert total == 2
+    assert by_name["vol.nii.gz"]["shape"] == [6, 5, 4] and by_name["vol.nii.gz"]["dtype"] == "int16"
+    assert by_name["flat.png"]["shape"] == [3, 7]
+
+    assert index.refresh() == 0
+    os.remove(root / "flat.png")
+    index.refresh()
+    assert index.query("", recursive=True)[0] == 1
+
+
+def test_directory_listing_scans_off_the_event_loop(monkeypatch):
+    from app.main import app
+    images_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images")
+    index = get_metadata_index(images_dir)
+    threads = []
+    monkeypatch.setattr(index, "refresh_if_stale",
+                        lambda *args, **kwargs: threads.append(threading.current_thread().name))
+
+    response = TestClient(app).get("/api/directory")
+    assert response.status_code == 200 and response.json()["success"]
+    # Ran in the load pool rather than on the event loop's thread
+    assert threads and threads[0].startswith("worker-load")
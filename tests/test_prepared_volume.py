@@ -0,0 +1,25 @@
+import base64
+import numpy as np
+from app.routes.image import image_storage
+from app.routes.image_registration import _PreparedVolume
+
+
+def test_inline_and_stored_spacing_agree():
+    data = np.random.default_rng(0).random((6, 5, 4)).astype(np.float32)  # (rows, cols, slices)
+    voxel_dimensions = [0.5, 0.8, 2.5]
+    image_storage.put("prepared-spacing", {"data": data, "voxel_dimensions": voxel_dimensions})
+    inline = {
+        "data": [base64.b64encode(np.ascontiguousarray(data[:, :, i]).tobytes()).decode() for i in range(4)],
+        "metadata": {"dimensions": [5, 6], "voxel_dimensions": voxel_dimensions}
+    }
+    try:
+        stored = _PreparedVolume({"image_id": "prepared-spacing"}, "fixed")
+        sent = _PreparedVolume(inline, "moving")
+    finally:
+        image_storage.pop("prepared-spacing")
+
+    for volume in (stored, sent):
+        assert volume.voxel_dimensions == voxel_dimensions
+        # SimpleITK (x, y, z) = (cols, rows, slices)
+        assert volume.image.GetSpacing() == (0.8, 0.5, 2.5)
+        assert volume.image.GetSize() == (5, 6, 4)
@@ -0,0 +1,43 @@
+import json
+import struct
+import nibabel as nib
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.config import PREVIEW_IN_PLANE_STRIDE, PREVIEW_SLICE_STRIDE
+from app.routes import directory
+from app.utils.file_handling import LazyNiftiVolume
+
+
+def _frames(body):
+    offset, frames = 0, []
+    while offset < len(body):
+        (length,) = struct.unpack_from("<I", body, offset)
+        header = json.loads(body[offset + 4:offset + 4 + length])
+        start = offset + 4 + length
+        offset = start + int(np.prod(header["shape"])) * 4
+        frames.append((header, np.frombuffer(body[start:offset], dtype="<f4").reshape(header["shape"])))
+    return frames
+
+
+def _progressive(file_path, file_ext):
+    app = FastAPI()
+    app.get("/load")(lambda: directory._load_progressive(None, file_path, file_ext, None))
+    return TestClient(app).get("/load").content
+
+
+@pytest.mark.parametrize("suffix", [".nii", ".nii.gz"])
+def test_progressive_load_sends_preview_then_every_slice(tmp_path, monkeypatch, suffix):
+    data = np.random.default_rng(0).normal(size=(16, 12, 9)).astype(np.float32)
+    path = str(tmp_path / f"vol{suffix}")
+    nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+    if suffix == ".nii.gz":
+        # Without a sidecar, a gzipped file is decoded once rather than streamed slice by slice
+        monkeypatch.setattr(LazyNiftiVolume, "iter_slices", lambda self: pytest.fail("streamed a gzipped file"))
+
+    (preview_header, preview), (full_header, full) = _frames(_progressive(path, suffix))
+    assert preview_header["stage"] == "preview" and full_header["stage"] == "full"
+    expected_preview = data[::PREVIEW_IN_PLANE_STRIDE, ::PREVIEW_IN_PLANE_STRIDE, ::PREVIEW_SLICE_STRIDE]
+    assert np.array_equal(preview, np.moveaxis(expected_preview, 2, 0))
+    assert np.array_equal(full, np.moveaxis(data, 2, 0))
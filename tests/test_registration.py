@@ -0,0 +1,21 @@
+import SimpleITK as sitk
+from app.utils import image_processing
+from app.utils.image_processing import REGISTRATION_PRESETS
+
+
+def test_gradient_filters_only_skipped_by_coarse_presets(monkeypatch):
+    recorded = {}
+
+    class RecordingMethod(sitk.ImageRegistrationMethod):
+        def SetMetricUseFixedImageGradientFilter(self, value):
+            recorded["fixed"] = value
+            return super().SetMetricUseFixedImageGradientFilter(value)
+
+        def SetMetricUseMovingImageGradientFilter(self, value):
+            recorded["moving"] = value
+            return super().SetMetricUseMovingImageGradientFilter(value)
+
+    monkeypatch.setattr(sitk, "ImageRegistrationMethod", RecordingMethod)
+    for preset, expected in (("full", True), ("fast", False), ("balanced", False), ("accurate", False)):
+        image_processing._rigid_registration_method(REGISTRATION_PRESETS[preset], sitk.Euler3DTransform())
+        assert recorded == {"fixed": expected, "moving": expected}, preset
@@ -0,0 +1,78 @@
+import json
+import numpy as np
+import pytest
+import SimpleITK as sitk
+from fastapi.testclient import TestClient
+from app.main import app
+from app.routes import image_registration
+from app.routes.image import image_storage
+
+
+def _phantom(shift=0):
+    volume = np.zeros((24, 24, 8), dtype=np.float32)
+    volume[6 + shift:16 + shift, 8:18, 2:6] = 100.0
+    return volume
+
+
+@pytest.fixture
+def stored_images():
+    ids = ["batch-fixed", "batch-moving-0", "batch-moving-1"]
+    for image_id, shift in zip(ids, (0, 1, 2)):
+        image_storage.put(image_id, {"data": _phantom(shift), "voxel_dimensions": [1.0, 1.0, 1.0]})
+    yield ids
+    for image_id in ids:
+        image_storage.pop(image_id, None)
+
+
+def test_batch_streams_one_line_per_moving_image(stored_images, monkeypatch):
+    prepared = []
+    original = image_registration._PreparedVolume
+
+    class CountingVolume(original):
+        def __init__(self, image_data, label):
+            prepared.append(label)
+            super().__init__(image_data, label)
+
+    monkeypatch.setattr(image_registration, "_PreparedVolume", CountingVolume)
+    # The stream is under test, not the optimizer: every pair gets the same small shift
+    translation = sitk.TranslationTransform(3, (0.0, 1.0, 0.0))
+    monkeypatch.setattr(image_registration, "_transform_for",
+                        lambda request_data, fixed, moving, progress=None, threads=None:
+                        (moving.digest, translation, {"preset": "fast"}))
+    fixed, *moving = stored_images
+    bad = {"data": ["AAAA"], "metadata": {"dimensions": [24, 24]}}
+    client = TestClient(app, base_url="https://testserver")
+    response = client.post("/api/registration/batch", json={
+        "fixed_image": {"image_id": fixed},
+        "moving_images": [{"image_id": moving[0]}, bad, {"image_id": moving[1]}],
+        "preset": "fast"
+    })
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 4
+    results, summary = {line["index"]: line for line in lines[:-1]}, lines[-1]
+    assert sorted(results) == [0, 1, 2]
+    assert summary["done"] and summary["count"] == 3 and summary["succeeded"] == 2
+
+    assert not results[1]["success"]
+    for index in (0, 2):
+        result = results[index]
+        assert result["success"] and result["metadata"]["dimensions"] == [24, 24]
+        assert result["image_id"] in image_storage
+        image_storage.pop(result["image_id"])
+    # The fixed image is prepared once for the whole batch
+    assert prepared.count("fixed") == 1
+
+
+def test_batch_requests_are_validated_before_streaming(stored_images):
+    client = TestClient(app, base_url="https://testserver")
+    fixed = {"image_id": stored_images[0]}
+    assert client.post("/api/registration/batch", json={"fixed_image": fixed}).status_code == 400
+    assert client.post("/api/registration/batch", json={
+        "fixed_image": fixed, "moving_images": []}).status_code == 400
+    assert client.post("/api/registration/batch", json={
+        "fixed_image": fixed, "moving_images": [{"image_id": "missing"}]}).status_code == 404
+    assert client.post("/api/registration/batch", json={
+        "fixed_image": fixed, "moving_images": [fixed], "preset": "slowest"}).status_code == 400
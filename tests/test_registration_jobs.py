@@ -0,0 +1,102 @@
+import sqlite3
+import threading
+import time
+import pytest
+from fastapi import HTTPException
+from app.routes import image_registration
+from app.utils.registration_jobs import RegistrationJobs
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    jobs = RegistrationJobs(root=str(tmp_path), workers=1, max_queue=1, ttl_seconds=60, stale_seconds=60)
+    yield jobs
+    jobs.shutdown()
+
+
+def _wait_for(jobs, job_id, states, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = jobs.status(job_id)
+        if status["state"] in states:
+            return status
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} is still {jobs.status(job_id)['state']}")
+
+
+def test_job_succeeds_or_fails(jobs):
+    done = jobs.submit(lambda value, progress: {"value": value}, 3)
+    assert _wait_for(jobs, done, ("succeeded",))["finished"] is not None
+    assert jobs.result(done) == {"value": 3}
+
+    def fail(progress):
+        raise HTTPException(status_code=400, detail="bad volume")
+
+    failed = jobs.submit(fail)
+    assert _wait_for(jobs, failed, ("failed",))["error"] == "bad volume"
+    assert jobs.result(failed) is None
+    with pytest.raises(KeyError):
+        jobs.status("missing")
+
+
+def test_cancel_queued_and_running_jobs(jobs):
+    started, ran = threading.Event(), []
+
+    def work(progress):
+        started.set()
+        while not progress.check_cancelled():
+            time.sleep(0.01)
+        return {"unexpected": True}
+
+    running = jobs.submit(work)
+    queued = jobs.submit(lambda progress: ran.append(True))
+    # workers + max_queue jobs are in flight
+    with pytest.raises(HTTPException) as error:
+        jobs.submit(lambda progress: None)
+    assert error.value.status_code == 503
+
+    assert started.wait(5)
+    assert jobs.cancel(queued)["state"] == "cancelled"
+    assert jobs.cancel(running)["cancel_requested"]
+    assert _wait_for(jobs, running, ("cancelled",))["state"] == "cancelled"
+    assert jobs.result(running) is None and ran == []
+
+
+def test_sweep_fails_stale_running_jobs(jobs):
+    with sqlite3.connect(jobs.db_path) as conn:
+        conn.execute("INSERT INTO jobs (job_id, state, created, started, heartbeat) VALUES (?, ?, ?, ?, ?)",
+                     ("orphan", "running", 0.0, 0.0, time.time() - 120))
+    jobs.sweep()
+    status = jobs.status("orphan")
+    assert status["state"] == "failed" and status["finished"] is not None
+
+
+def test_cancelled_registration_is_not_resampled(monkeypatch):
+    class CancelledProgress:
+        cancelled = False
+
+        def check_cancelled(self):
+            return True
+
+    monkeypatch.setattr(image_registration, "_transform_for",
+                        lambda *args: ("transform-id", None, {"mode": "rigid"}))
+    monkeypatch.setattr(image_registration, "resample_to_fixed",
+                        lambda *args: pytest.fail("cancelled registration was resampled"))
+    response = image_registration._register_prepared({}, None, None, CancelledProgress())
+    assert response["state"] == "cancelled" and not response["success"]
+
+
+def test_finishing_does_not_overwrite_a_swept_job(jobs):
+    release = threading.Event()
+    job_id = jobs.submit(lambda progress: release.wait(5) and {"late": True})
+    _wait_for(jobs, job_id, ("running",))
+    # The worker looks dead to the sweep, then completes anyway
+    jobs.stale_seconds = 0.001
+    time.sleep(0.01)
+    jobs.sweep()
+    assert jobs.status(job_id)["state"] == "failed"
+    release.set()
+    deadline = time.monotonic() + 5
+    while jobs.active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert jobs.status(job_id)["state"] == "failed" and jobs.result(job_id) is None
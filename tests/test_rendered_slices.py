@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from app.routes.image import _render_key, image_storage, render_slice
+from app.utils.caching import rendered_slice_cache
+from app.utils.image_processing import window_level_to_uint8
+
+
+@pytest.fixture
+def stored():
+    volume = np.random.default_rng(0).integers(0, 1000, (8, 8, 40)).astype(np.int16)
+    image_storage.put("rendered", {
+        "data": volume, "window_center": 500.0, "window_width": 1000.0, "total_slices": 40
+    })
+    yield volume
+    image_storage.pop("rendered", None)
+
+
+def _key(slice_number, center, width):
+    return _render_key("rendered", image_storage["rendered"]) + (slice_number, center, width)
+
+
+def test_slices_render_on_demand_and_are_reused(stored):
+    rendered = render_slice("rendered", 3, 200.0, 400.0)
+    assert np.array_equal(rendered, window_level_to_uint8(stored[:, :, 3], 200.0, 400.0))
+    # The image's own window is used when none is given
+    assert np.array_equal(render_slice("rendered", 3), window_level_to_uint8(stored[:, :, 3], 500.0, 1000.0))
+
+    hits, misses = rendered_slice_cache.hits, rendered_slice_cache.misses
+    assert render_slice("rendered", 3, 200.0, 400.0) is rendered
+    assert (rendered_slice_cache.hits - hits, rendered_slice_cache.misses - misses) == (1, 0)
+    # Only the requested slice was rendered
+    assert _key(3, 200.0, 400.0) in rendered_slice_cache
+    assert not any(_key(n, 200.0, 400.0) in rendered_slice_cache for n in range(40) if n != 3)
+
+    with pytest.raises(IndexError):
+        render_slice("rendered", 40)
+    with pytest.raises(ValueError):
+        render_slice("rendered", 0, 200.0, 0.0)
+
+
+def test_new_data_invalidates_renders(stored):
+    before = render_slice("rendered", 0, 500.0, 1000.0)
+    old_key = _key(0, 500.0, 1000.0)
+    assert old_key in rendered_slice_cache
+
+    replaced = (1000 - stored).astype(np.int16)
+    image_storage.update("rendered", data=replaced)
+    assert _key(0, 500.0, 1000.0) != old_key
+    assert old_key not in rendered_slice_cache
+
+    after = render_slice("rendered", 0, 500.0, 1000.0)
+    assert np.array_equal(after, window_level_to_uint8(replaced[:, :, 0], 500.0, 1000.0))
+    assert not np.array_equal(after, before)
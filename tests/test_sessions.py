@@ -0,0 +1,81 @@
+import sqlite3
+import numpy as np
+from fastapi.testclient import TestClient
+from app.main import app
+from app.utils.image_store import ImageStore, SessionStore
+
+
+def test_cookie_defaults_allow_cross_site_frontends():
+    cookie = TestClient(app).get("/api/set-session").headers["set-cookie"].lower()
+    assert "samesite=none" in cookie and "secure" in cookie and "httponly" in cookie
+
+
+def test_lax_cookie_following_the_scheme_is_opt_in(monkeypatch):
+    from app.routes import session
+    monkeypatch.setattr(session, "SESSION_COOKIE_SECURE", "auto")
+    monkeypatch.setattr(session, "SESSION_COOKIE_SAMESITE", "lax")
+    plain = TestClient(app).get("/api/set-session").headers["set-cookie"].lower()
+    assert "samesite=lax" in plain and "secure" not in plain
+    secure = TestClient(app, base_url="https://testserver").get("/api/set-session").headers["set-cookie"]
+    assert "secure" in secure.lower()
+
+
+def test_session_round_trip():
+    client = TestClient(app, base_url="https://testserver")
+    client.get("/api/set-session")
+    assert client.post("/api/close-study").json() == {"status": "success", "released": []}
+    assert client.post("/api/end-session").status_code == 200
+    assert client.post("/api/close-study").status_code == 401
+
+
+def _age_session(store, session_id, seconds):
+    with sqlite3.connect(store.db_path) as conn:
+        conn.execute("UPDATE sessions SET last_access = last_access - ? WHERE session_id = ?", (seconds, session_id))
+        conn.execute("UPDATE images SET last_access = last_access - ?", (seconds,))
+
+
+def test_reading_an_image_keeps_its_session_alive(tmp_path):
+    images = ImageStore(root=str(tmp_path), max_bytes=1 << 20, ttl_seconds=0, session_ttl_seconds=60)
+    sessions = SessionStore(images, ttl_seconds=60)
+    session_id = sessions.create({})
+    images.put("a", {"data": np.zeros((4, 4, 2), dtype=np.int16)}, session_id=session_id)
+
+    _age_session(sessions, session_id, 50)
+    images["a"]
+    _age_session(sessions, session_id, 50)
+    sessions.sweep()
+    assert session_id in sessions and "a" in images
+
+    # Reading an image of an expired, not yet swept session does not revive it
+    _age_session(sessions, session_id, 100)
+    images["a"]
+    assert session_id not in sessions
+    sessions.sweep()
+    assert "a" not in images
+
+
+def test_session_endpoints_run_off_the_event_loop(monkeypatch):
+    import threading
+    from app.routes import session
+
+    threads = []
+    end = session.SESSION_STORE.end
+
+    def record_end(session_id):
+        threads.append(threading.current_thread().name)
+        return end(session_id)
+
+    monkeypatch.setattr(session.SESSION_STORE, "end", record_end)
+    client = TestClient(app, base_url="https://testserver")
+    client.get("/api/set-session")
+    assert client.post("/api/end-session").status_code == 200
+    assert threads and threads[0].startswith("worker-session")
+
+
+def test_touch_is_throttled(tmp_path):
+    sessions = SessionStore(ImageStore(root=str(tmp_path), max_bytes=1 << 20, ttl_seconds=0), ttl_seconds=60)
+    session_id = sessions.create({})
+    assert sessions.touch_due(session_id)
+    assert sessions.touch(session_id)
+    assert not sessions.touch_due(session_id)
+    assert not sessions.touch("missing")
@@ -0,0 +1,68 @@
+import base64
+import io
+import numpy as np
+import pytest
+from PIL import Image
+from fastapi.testclient import TestClient
+from app.main import app
+from app.routes.image import image_storage
+from app.utils.caching import encoded_slice_cache, rendered_slice_cache
+from app.utils.image_processing import window_level_to_uint8
+
+
+@pytest.fixture
+def client():
+    volume = np.random.default_rng(0).integers(0, 1000, (12, 10, 4)).astype(np.int16)
+    image_storage.put("encoded", {
+        "data": volume, "window_center": 500.0, "window_width": 1000.0, "total_slices": 4
+    })
+    yield TestClient(app), window_level_to_uint8(volume[:, :, 2], 500.0, 1000.0)
+    image_storage.pop("encoded", None)
+
+
+def _get(client, **params):
+    return client.get("/api/slice/2", params={"image_id": "encoded", "format": "binary", **params})
+
+
+def test_each_encoding_is_cached_separately_from_one_render(client):
+    client, expected = client
+    render_misses = rendered_slice_cache.misses
+    for encoding in ("png", "webp", "raw"):
+        misses, hits = encoded_slice_cache.misses, encoded_slice_cache.hits
+        first = _get(client, encoding=encoding)
+        second = _get(client, encoding=encoding)
+        assert first.status_code == 200 and first.content == second.content
+        assert (encoded_slice_cache.misses - misses, encoded_slice_cache.hits - hits) == (1, 1)
+        assert first.headers["X-Image-Shape"] == "12,10"
+
+        if encoding == "raw":
+            decoded = np.frombuffer(first.content, dtype=np.uint8).reshape(12, 10)
+        else:
+            img = Image.open(io.BytesIO(first.content))
+            assert img.format == encoding.upper()
+            # Lossless WebP decodes as RGB with equal channels
+            decoded = np.asarray(img.convert("L"))
+        assert np.array_equal(decoded, expected)
+    # All three encodings were made from a single render of the slice
+    assert rendered_slice_cache.misses - render_misses == 1
+
+
+def test_png_settings_are_part_of_the_cache_key(client):
+    client, expected = client
+    misses = encoded_slice_cache.misses
+    for params in ({"compress_level": 0}, {"compress_level": 9}, {"optimize": True}):
+        response = _get(client, **params)
+        assert np.array_equal(np.asarray(Image.open(io.BytesIO(response.content))), expected)
+    assert encoded_slice_cache.misses - misses == 3
+
+
+def test_json_responses_and_invalid_settings(client):
+    client, expected = client
+    raw = client.get("/api/slice/2", params={"image_id": "encoded", "encoding": "raw"}).json()
+    assert raw["dimensions"] == [12, 10]
+    assert base64.b64decode(raw["slice"]) == expected.tobytes()
+    png = client.get("/api/slice/2", params={"image_id": "encoded"}).json()
+    assert png["slice"].startswith("data:image/png;base64,")
+
+    assert _get(client, encoding="jpeg").status_code == 400
+    assert _get(client, compress_level=10).status_code == 400
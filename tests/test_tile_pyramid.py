@@ -0,0 +1,66 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from app.utils.tile_pyramid import build_pyramid, get_pyramid, open_pyramid
+
+
+@pytest.fixture
+def source(tmp_path):
+    data = np.arange(7 * 10, dtype=np.uint8).reshape(7, 10)
+    path = tmp_path / "slide.png"
+    Image.fromarray(data).save(path)
+    return str(path), data
+
+
+def test_levels_halve_down_to_one_tile(source):
+    path, data = source
+    pyramid = build_pyramid(path, tile_size=4)
+    info = pyramid.info()
+
+    assert [(level["width"], level["height"]) for level in info["levels"]] == [(10, 7), (5, 4), (3, 2)]
+    assert [(level["tiles_x"], level["tiles_y"]) for level in info["levels"]] == [(3, 2), (2, 1), (1, 1)]
+    assert info["dtype"] == "uint8"
+    assert (info["min_value"], info["max_value"]) == (0.0, 69.0)
+    # Each level averages 2x2 blocks of the one above, padding odd edges
+    assert pyramid.levels[1][0, 0] == np.rint(data[:2, :2].mean())
+    assert pyramid.levels[1][3, 4] == np.rint(data[6, 8:10].mean())
+
+
+def test_tiles_are_addressed_from_top_left(source):
+    path, data = source
+    pyramid = build_pyramid(path, tile_size=4)
+
+    assert np.array_equal(pyramid.read_tile(0, 0, 0), data[:4, :4])
+    assert np.array_equal(pyramid.read_tile(0, 1, 1), data[4:, 4:8])
+    # Edge tiles are cut short rather than padded
+    assert pyramid.read_tile(0, 2, 1).shape == (3, 2)
+    assert pyramid.read_tile(2, 0, 0).shape == (2, 3)
+    for level, x, y in [(3, 0, 0), (-1, 0, 0), (0, 3, 0), (0, 0, 2), (1, -1, 0)]:
+        with pytest.raises(IndexError):
+            pyramid.read_tile(level, x, y)
+
+
+def test_stored_pyramid_is_reused_until_source_changes(source):
+    path, data = source
+    built = get_pyramid(path, tile_size=4)
+    reopened = open_pyramid(path, tile_size=4)
+    assert reopened is not None and reopened.info() == built.info()
+    assert open_pyramid(path, tile_size=8) is None
+
+    Image.fromarray(np.zeros((3, 3), dtype=np.uint8)).save(path)
+    os.utime(path, ns=(1, 1))
+    assert open_pyramid(path, tile_size=4) is None
+    assert get_pyramid(path, tile_size=4).info()["levels"][0]["width"] == 3
+
+
+def test_tile_to_uint8_uses_whole_image_range(tmp_path):
+    data = np.linspace(100, 1100, 64, dtype=np.float32).reshape(8, 8)
+    path = tmp_path / "float.tif"
+    Image.fromarray(data).save(path)
+    pyramid = build_pyramid(str(path), tile_size=4)
+
+    first = pyramid.tile_to_uint8(pyramid.read_tile(0, 0, 0))
+    last = pyramid.tile_to_uint8(pyramid.read_tile(0, 1, 1))
+    assert first.dtype == np.uint8
+    assert first[0, 0] == 0 and last[-1, -1] == 255
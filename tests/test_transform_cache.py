@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import pytest
+import SimpleITK as sitk
+from app.utils.transform_cache import TransformCache, transform_key, volume_digest
+
+
+def test_volume_digest_depends_on_content_not_layout():
+    volume = np.random.default_rng(0).random((4, 6, 5)).astype(np.float32)
+    digest = volume_digest(volume, [1.0, 1.0, 2.0])
+    assert volume_digest(list(volume), [1, 1, 2]) == digest
+    # A strided view hashes like its contiguous copy
+    padded = np.zeros((4, 6, 10), dtype=np.float32)
+    padded[:, :, ::2] = volume
+    assert volume_digest(padded[:, :, ::2], [1.0, 1.0, 2.0]) == digest
+
+    assert volume_digest(volume, [1.0, 1.0, 2.5]) != digest
+    assert volume_digest(volume.astype(np.float64), [1.0, 1.0, 2.0]) != digest
+    changed = volume.copy()
+    changed[3, 5, 4] += 1
+    assert volume_digest(changed, [1.0, 1.0, 2.0]) != digest
+
+
+def test_transform_key_ignores_parameter_order():
+    key = transform_key("a", "b", {"preset": "fast", "mode": "rigid"})
+    assert key == transform_key("a", "b", {"mode": "rigid", "preset": "fast"})
+    assert key != transform_key("b", "a", {"preset": "fast", "mode": "rigid"})
+
+
+def test_round_trip_and_pruning(tmp_path):
+    cache = TransformCache(root=str(tmp_path), max_entries=2)
+    transform = sitk.Euler3DTransform((1.0, 2.0, 3.0), 0.1, 0.0, 0.2, (4.0, 5.0, 6.0))
+    keys = [transform_key("fixed", f"moving{i}", {}) for i in range(3)]
+
+    cache.put(keys[0], transform, {"preset": "fast"})
+    loaded, report = cache.get(keys[0])
+    assert report == {"preset": "fast"}
+    assert np.allclose(loaded.GetParameters(), transform.GetParameters())
+
+    cache.put(keys[1], transform, {})
+    # keys[0] is the oldest entry until it is read again
+    for age, key in ((300, keys[0]), (200, keys[1])):
+        path = os.path.join(str(tmp_path), f"{key}.tfm")
+        os.utime(path, (os.path.getmtime(path) - age,) * 2)
+    cache.get(keys[0])
+    cache.put(keys[2], transform, {})
+
+    assert cache.stats()["entries"] == 2
+    with pytest.raises(KeyError):
+        cache.get(keys[1])
+    cache.get(keys[0])
+    with pytest.raises(KeyError):
+        cache.get("../not-a-key")
@@ -0,0 +1,79 @@
+import json
+import struct
+import numpy as np
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.utils.transport import (
+    binary_slices_response, binary_volume_response, progressive_volume_response, to_slice_major
+)
+
+
+def _client(make_response):
+    app = FastAPI()
+    app.get("/volume")(make_response)
+    return TestClient(app)
+
+
+def test_to_slice_major_matches_volume_slices():
+    volume = np.arange(2 * 3 * 4, dtype=np.int16).reshape(2, 3, 4)
+    slices = to_slice_major(volume)
+    assert slices.shape == (4, 2, 3)
+    assert slices.dtype == np.float32 and slices.flags.c_contiguous
+    for index in range(4):
+        assert np.array_equal(slices[index], volume[:, :, index])
+
+
+def test_binary_volume_response_layout():
+    volume = np.random.default_rng(0).normal(size=(5, 6, 17)).astype(">f4")
+    response = _client(lambda: binary_volume_response(volume, {"a": 1})).get("/volume")
+
+    assert response.headers["x-image-shape"] == "17,5,6"
+    assert response.headers["x-image-dtype"] == "float32"
+    assert json.loads(response.headers["x-image-metadata"]) == {"a": 1}
+    assert int(response.headers["content-length"]) == len(response.content) == volume.size * 4
+    body = np.frombuffer(response.content, dtype="<f4").reshape(17, 5, 6)
+    assert np.array_equal(body, np.moveaxis(volume, 2, 0))
+
+
+def test_binary_slices_response_matches_volume_response():
+    volume = np.random.default_rng(1).normal(size=(4, 3, 6)).astype(np.float32)
+    slices = (volume[:, :, i] for i in range(volume.shape[2]))
+    streamed = _client(lambda: binary_slices_response(slices, (6, 4, 3), {})).get("/volume")
+    whole = _client(lambda: binary_volume_response(volume, {})).get("/volume")
+    assert streamed.content == whole.content
+    assert streamed.headers["x-image-shape"] == whole.headers["x-image-shape"]
+
+
+def _read_frame(body, offset):
+    (length,) = struct.unpack_from("<I", body, offset)
+    header = json.loads(body[offset + 4:offset + 4 + length])
+    start = offset + 4 + length
+    end = start + int(np.prod(header["shape"])) * 4
+    return header, np.frombuffer(body[start:end], dtype="<f4").reshape(header["shape"]), end
+
+
+def test_progressive_response_sends_preview_then_full_frame():
+    volume = np.random.default_rng(2).normal(size=(8, 8, 4)).astype(np.float32)
+    preview = volume[::2, ::2, ::2]
+    slices = (volume[:, :, i] for i in range(4))
+    response = _client(lambda: progressive_volume_response(
+        preview, {"stage": "preview"}, slices, (4, 8, 8), {"stage": "full"}
+    )).get("/volume")
+
+    header, data, offset = _read_frame(response.content, 0)
+    assert header["stage"] == "preview" and header["metadata"] == {"stage": "preview"}
+    assert np.array_equal(data, np.moveaxis(preview, 2, 0))
+    header, data, offset = _read_frame(response.content, offset)
+    assert header["stage"] == "full" and header["shape"] == [4, 8, 8]
+    assert np.array_equal(data, np.moveaxis(volume, 2, 0))
+    assert offset == len(response.content)
+
+
+def test_volume_bytes_are_converted_a_chunk_at_a_time():
+    from app.utils.transport import iter_volume_bytes
+    volume = np.asfortranarray(np.random.default_rng(1).integers(-500, 500, (5, 4, 19)).astype('>i2'))
+    chunks = list(iter_volume_bytes(volume, slices_per_chunk=8))
+    # 8 + 8 + 3 slices, each chunk no bigger than 8 float32 slices
+    assert [len(chunk) for chunk in chunks] == [8 * 20 * 4, 8 * 20 * 4, 3 * 20 * 4]
+    streamed = np.frombuffer(b"".join(chunks), dtype='<f4').reshape(19, 5, 4)
+    assert np.array_equal(streamed, np.moveaxis(volume, 2, 0).astype(np.float32))
@@ -0,0 +1,137 @@
+import nibabel as nib
+import numpy as np
+from app.routes.upload import _decode_upload
+from app.utils.image_processing import window_level_to_uint8
+
+
+def _save(path, data, slope=None):
+    img = nib.Nifti1Image(data, np.eye(4))
+    if slope is not None:
+        img.header.set_slope_inter(slope, 0.0)
+    nib.save(img, str(path))
+    return str(path)
+
+
+def test_integer_upload_keeps_native_dtype(tmp_path):
+    data = np.random.default_rng(0).integers(-1000, 3000, (16, 12, 5)).astype(">i2")
+    path = _save(tmp_path / "vol.nii", data)
+
+    decoded, metadata = _decode_upload(path, ".nii")
+    assert decoded.dtype == np.dtype(np.int16)
+    assert np.array_equal(decoded, data)
+    # The lookup table path renders the same as windowing the float values
+    slice_data = decoded[:, :, 2]
+    assert np.array_equal(window_level_to_uint8(slice_data, 400.0, 1200.0),
+                          window_level_to_uint8(slice_data.astype(np.float32), 400.0, 1200.0))
+
+
+def test_scaled_upload_is_float32(tmp_path):
+    data = np.arange(16 * 12 * 5, dtype=np.int16).reshape(16, 12, 5)
+    path = _save(tmp_path / "vol.nii", data, slope=0.5)
+
+    decoded, metadata = _decode_upload(path, ".nii")
+    assert decoded.dtype == np.float32
+    assert np.allclose(decoded, data * 0.5)
+
+
+BOUNDARY = "upload-test-boundary"
+
+
+def _multipart(filename, payload):
+    return (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + payload + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def _upload_client(directory, max_size):
+    from fastapi import FastAPI, Request
+    from fastapi.testclient import TestClient
+    from app.utils.upload_streaming import receive_upload
+
+    app = FastAPI()
+
+    @app.post("/receive")
+    async def receive(request: Request):
+        upload = await receive_upload(request, destination_dir=str(directory), max_size=max_size)
+        return {"path": upload.path, "bytes": upload.bytes_received}
+
+    return TestClient(app)
+
+
+def test_declared_content_length_over_the_limit_is_rejected(tmp_path):
+    from app.utils.upload_streaming import MULTIPART_OVERHEAD
+    client = _upload_client(tmp_path, max_size=1000)
+    body = _multipart("big.nii", b"\0" * (1000 + MULTIPART_OVERHEAD + 1))
+    response = client.post("/receive", content=body,
+                           headers={"content-type": f"multipart/form-data; boundary={BOUNDARY}"})
+    assert response.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_streamed_upload_over_the_limit_is_rejected_midway(tmp_path):
+    client = _upload_client(tmp_path, max_size=1000)
+    body = _multipart("big.nii", b"\0" * 5000)
+
+    def chunks():
+        # A generator body is sent chunked, without Content-Length
+        for start in range(0, len(body), 512):
+            yield body[start:start + 512]
+
+    response = client.post("/receive", content=chunks(),
+                           headers={"content-type": f"multipart/form-data; boundary={BOUNDARY}"})
+    assert response.status_code == 413
+    # The partly written file is removed
+    assert list(tmp_path.iterdir()) == []
+
+    accepted = client.post("/receive", content=_multipart("small.nii", b"\1" * 500),
+                           headers={"content-type": f"multipart/form-data; boundary={BOUNDARY}"})
+    assert accepted.status_code == 200 and accepted.json()["bytes"] == 500
+
+
+def test_gunzip_is_bounded_by_the_decompressed_limit(tmp_path):
+    import gzip
+    import pytest
+    from fastapi import HTTPException
+    from app.utils.upload_streaming import ReceivedUpload
+
+    # A small upload that inflates far past the limit
+    payload = gzip.compress(b"\0" * 100000)
+    upload = ReceivedUpload("bomb.nii.gz", directory=str(tmp_path), gunzip=True,
+                            max_size=len(payload), max_decompressed_size=10000)
+    assert upload.suffix == ".nii"
+    with pytest.raises(HTTPException) as error:
+        for start in range(0, len(payload), 64):
+            upload.write(payload[start:start + 64])
+    assert error.value.status_code == 413
+    upload.discard()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_uploads_of_the_same_name_get_their_own_files(tmp_path):
+    from app.utils.upload_streaming import ReceivedUpload
+
+    first = ReceivedUpload("scan.nii", directory=str(tmp_path))
+    second = ReceivedUpload("scan.nii", directory=str(tmp_path))
+    first.write(b"first")
+    second.write(b"second")
+    first.finish()
+    second.finish()
+    assert first.path != second.path and first.path.endswith(".nii")
+    with open(first.path, "rb") as f:
+        assert f.read() == b"first"
+    first.discard()
+    second.discard()
+
+
+def test_upload_route_removes_its_file(tmp_path):
+    import os
+    from fastapi.testclient import TestClient
+    from app.main import app, UPLOAD_DIR
+
+    path = _save(tmp_path / "scan.nii", np.arange(4 * 4 * 2, dtype=np.int16).reshape(4, 4, 2))
+    before = set(os.listdir(UPLOAD_DIR))
+    with open(path, "rb") as f:
+        response = TestClient(app).post("/upload", files={"file": ("scan.nii", f, "application/octet-stream")})
+    assert response.status_code == 200
+    assert set(os.listdir(UPLOAD_DIR)) == before
@@ -0,0 +1,90 @@
+import random
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from app.utils.view_transform import (
+    apply_view_operations, identity_view, view_array, view_digest, view_slice, view_spacing
+)
+
+
+def _random_operation(rng, current, source):
+    """A random view operation and the result of applying it to current with NumPy."""
+    op = rng.choice(["rotate", "flip", "permute", "crop", "reset"])
+    if op == "rotate":
+        angle = rng.choice([90, 180, 270, -90, 360])
+        return {"op": op, "angle": angle}, np.rot90(current, angle // 90, axes=(0, 1))
+    if op == "flip":
+        axis = rng.randrange(3)
+        return {"op": op, "axis": axis}, np.flip(current, axis)
+    if op == "permute":
+        axes = rng.sample(range(3), 3)
+        return {"op": op, "axes": axes}, current.transpose(axes)
+    if op == "crop":
+        start = [rng.randrange(0, max(1, size // 2)) for size in current.shape]
+        stop = [rng.randrange(low + 1, size + 1) for low, size in zip(start, current.shape)]
+        return {"op": op, "start": start, "stop": stop}, current[tuple(map(slice, start, stop))]
+    return {"op": "reset"}, source
+
+
+def test_views_match_numpy_without_copying():
+    source = np.random.default_rng(0).normal(size=(5, 7, 4))
+    slices = [source[:, :, i].copy() for i in range(4)]
+    rng = random.Random(1)
+    view, expected = identity_view(source.shape), source
+    for _ in range(200):
+        operation, expected = _random_operation(rng, expected, source)
+        view = apply_view_operations(view, [operation], source.shape)
+        seen = view_array(source, view)
+        assert seen.shape == expected.shape and np.array_equal(seen, expected), operation
+        assert np.shares_memory(seen, source)
+        for index in range(expected.shape[2]):
+            assert np.array_equal(view_slice(slices, view, index), expected[:, :, index])
+
+
+def test_view_spacing_and_digest():
+    shape = (5, 7, 4)
+    view = apply_view_operations(identity_view(shape), [{"op": "permute", "axes": [2, 0, 1]}], shape)
+    assert view_spacing([0.5, 0.8, 2.5], view) == [2.5, 0.5, 0.8]
+    assert view_digest("abc", identity_view(shape), shape) == "abc"
+    assert view_digest("abc", view, shape) not in ("abc", view_digest("abd", view, shape))
+
+
+@pytest.mark.parametrize("operation", [
+    {"op": "rotate", "angle": 45},
+    {"op": "flip", "axis": 3},
+    {"op": "permute", "axes": [0, 0, 1]},
+    {"op": "crop", "start": [0, 0, 0], "stop": [0, 1, 1]},
+    {"op": "shear"},
+])
+def test_invalid_operations_are_rejected(operation):
+    with pytest.raises(ValueError):
+        apply_view_operations(identity_view((5, 7, 4)), [operation], (5, 7, 4))
+
+
+def test_slices_follow_the_view():
+    from app.main import app
+    from app.routes.image import image_storage
+
+    data = np.arange(4 * 6 * 3, dtype=np.uint8).reshape(4, 6, 3)
+    image_storage.put("view-endpoint", {"data": data, "window_center": 127.5, "window_width": 255.0,
+                                        "total_slices": 3, "voxel_dimensions": [1.0, 2.0, 3.0]})
+    client = TestClient(app)
+    try:
+        def raw_slice(index):
+            response = client.get(f"/api/slice/{index}", params={
+                "image_id": "view-endpoint", "encoding": "raw", "format": "binary"})
+            assert response.status_code == 200
+            return np.frombuffer(response.content, dtype=np.uint8)
+
+        before = raw_slice(0)
+        response = client.post("/api/view", params={"image_id": "view-endpoint"},
+                               json={"operations": [{"op": "rotate", "angle": 90}]})
+        assert response.status_code == 200
+        assert response.json()["voxel_dimensions"] == [2.0, 1.0, 3.0]
+        # The slice rendered before the rotation is not served from the caches
+        after = raw_slice(0)
+        assert np.array_equal(np.sort(after), np.sort(before)) and not np.array_equal(after, before)
+        assert client.post("/api/view", params={"image_id": "view-endpoint"},
+                           json={"operations": [{"op": "flip", "axis": 5}]}).status_code == 400
+    finally:
+        image_storage.pop("view-endpoint")
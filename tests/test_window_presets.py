@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from app.utils.image_processing import (
+    WINDOW_PRESETS, estimate_window_presets, histogram_percentiles, window_histogram
+)
+
+
+def test_histogram_percentiles_match_numpy():
+    values = np.random.default_rng(0).normal(100.0, 20.0, 100000)
+    counts, edges = window_histogram(values.reshape(1000, 100), bins=4096)
+    bin_width = edges[1] - edges[0]
+    percentiles = [0, 2, 50, 98, 100]
+    estimated = histogram_percentiles(counts, edges, percentiles)
+    assert np.allclose(estimated, np.percentile(values, percentiles), atol=bin_width)
+
+
+def test_presets_ignore_non_finite_values_and_slice_layout():
+    volume = np.linspace(0, 1000, 20 * 20 * 5, dtype=np.float32).reshape(20, 20, 5)
+    presets = estimate_window_presets(volume)
+    assert set(presets) == set(WINDOW_PRESETS)
+    assert presets["full"]["window_width"] == pytest.approx(1000.0)
+    assert presets["auto"]["window_width"] == pytest.approx(960.0, abs=1.0)
+    assert presets["auto"]["window_center"] == pytest.approx(500.0, abs=1.0)
+    assert presets["narrow"]["window_width"] < presets["auto"]["window_width"] < presets["wide"]["window_width"]
+
+    with_gaps = volume.copy()
+    with_gaps[10, 10, :] = [np.nan, np.inf, -np.inf, np.nan, np.nan]
+    assert estimate_window_presets(with_gaps)["full"]["window_width"] == pytest.approx(1000.0, abs=1.0)
+
+
+def test_presets_of_degenerate_images():
+    nothing = estimate_window_presets(np.full((4, 4, 2), np.nan, dtype=np.float32))
+    assert nothing["auto"] == {"window_width": 1.0, "window_center": 0.0}
+    constant = estimate_window_presets(np.full((4, 4, 2), 7.0, dtype=np.float32))
+    assert constant["auto"]["window_center"] == 7.0 and constant["auto"]["window_width"] > 0
+
+
+def test_endpoint_estimates_presets_once(monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.routes import image
+
+    calls = []
+
+    def counting_estimate(data):
+        calls.append(data.shape)
+        return estimate_window_presets(data)
+
+    monkeypatch.setattr(image, "estimate_window_presets", counting_estimate)
+    image.image_storage.put("presets-once", {
+        "data": np.arange(8 * 8 * 3, dtype=np.float32).reshape(8, 8, 3),
+        "window_center": 0.0, "window_width": 1.0, "total_slices": 3
+    })
+    try:
+        client = TestClient(app)
+        first = client.get("/api/window-presets", params={"image_id": "presets-once"}).json()
+        second = client.get("/api/window-presets", params={"image_id": "presets-once"}).json()
+        assert first == second and first["window_presets"]["full"]["window_width"] == pytest.approx(191.0)
+        assert calls == [(8, 8, 3)]
+        assert client.get("/api/window-presets", params={"image_id": "missing"}).status_code == 404
+    finally:
+        image.image_storage.pop("presets-once")